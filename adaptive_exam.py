@@ -0,0 +1,97 @@
+import random
+
+from question_bank import GENERAL_TOPIC, QUESTION_TYPES, tag_topics
+
+# Remediation exams are shorter than the regular 4/4/2 paper: fewer questions,
+# all aimed at the student's weak topics.
+ADAPTIVE_EXAM_LAYOUT = {"选择": 3, "填空": 3, "简答": 1}
+
+
+class WrongTopicIndex:
+    """
+    Precomputed wrong question key -> topic tags. Tags are computed once per
+    (key, description) and reused, so aggregating weights over the wrong book
+    only sums cached tags instead of re-tagging every question.
+    """
+
+    def __init__(self):
+        self.topics_by_key = {}  # key -> (description, topics)
+
+    def topics_for(self, key, question):
+        description = question.get("description", "")
+        cached = self.topics_by_key.get(key)
+        if cached is None or cached[0] != description:
+            cached = (description, tag_topics(question))
+            self.topics_by_key[key] = cached
+        return cached[1]
+
+    def weak_topic_weights(self, wrong_data):
+        """
+        Returns {topic: weight} with weights summing to 1. Each wrong question
+        contributes its occurrence count, split over its topics.
+        """
+        for stale_key in self.topics_by_key.keys() - wrong_data.keys():
+            del self.topics_by_key[stale_key]
+        totals = {}
+        for key, question in wrong_data.items():
+            topics = self.topics_for(key, question)
+            share = question.get("count", 1) / len(topics)
+            for topic in topics:
+                totals[topic] = totals.get(topic, 0.0) + share
+        grand_total = sum(totals.values())
+        if not grand_total:
+            return {}
+        return {topic: weight / grand_total for topic, weight in totals.items()}
+
+
+def top_weak_topics(weights, limit):
+    """Most-missed topics first; the catch-all topic is only used if nothing else is known."""
+    ranked = sorted(weights.items(), key=lambda item: item[1], reverse=True)
+    specific = [topic for topic, _ in ranked if topic != GENERAL_TOPIC]
+    return (specific or [topic for topic, _ in ranked])[:limit]
+
+
+def assemble_weighted_exam(bank, layout, topic_weights, max_uses=None):
+    """
+    Samples bank questions per type without replacement, weighted by how weak the
+    student is on the question's topics (Efraimidis-Spirakis keys u ** (1 / w)).
+    Only questions touching a weak topic are eligible.
+    Returns (questions, shortage) like QuestionBank.assemble_exam.
+    """
+    paper = []
+    shortage = {}
+    for question_type in QUESTION_TYPES:
+        wanted = layout.get(question_type, 0)
+        if wanted <= 0:
+            continue
+        keyed = []
+        for question_id in bank.available(question_type, topics=list(topic_weights), max_uses=max_uses):
+            weight = sum(topic_weights.get(topic, 0.0) for topic in bank.questions[question_id]["topics"])
+            if weight > 0:
+                keyed.append((random.random() ** (1.0 / weight), question_id))
+        keyed.sort(reverse=True)
+        for _, question_id in keyed[:wanted]:
+            paper.append(bank.as_exam_question(question_id))
+        if len(keyed) < wanted:
+            shortage[question_type] = wanted - len(keyed)
+    return paper, shortage
+
+
+def wrong_question_examples(wrong_data, topics, char_budget):
+    """
+    Picks descriptions of the most repeated wrong questions on the given topics,
+    stopping before char_budget characters, to show the LLM what the student misses.
+    """
+    topic_set = set(topics)
+    ranked = sorted(wrong_data.values(), key=lambda question: question.get("count", 1), reverse=True)
+    examples = []
+    used = 0
+    for question in ranked:
+        description = question.get("description", "")
+        if not description or not topic_set.intersection(tag_topics(question)):
+            continue
+        if used + len(description) > char_budget:
+            break
+        examples.append(description)
+        used += len(description)
+    return examples
@@ -1,17 +1,63 @@
+import atexit
+import hmac
+import json
+import os
+import re
 import gradio as gr
-import backend_logic # Import the backend logic
+import backendlogic as backend_logic # Import the backend logic
 import threading # Need threading for voice input polling
-
-# Instantiate the backend logic class
-app_logic = backend_logic.AppLogic()
+from collections import OrderedDict
+from instrumentation import get_registry
+from storage import get_lock_stats
+from write_behind import get_write_behind_queue
+
+# One backend logic instance per user id, created on first use. Each instance only
+# reads and writes its own user's shard (see backend_logic.get_user_data_dir) and keeps
+# that user's in-memory indexes; the least recently used ones are closed and dropped beyond
+# the cap, and the rest when the server exits (see AppLogic.close).
+MAX_CACHED_USERS = 256
+app_logics = OrderedDict()
+app_logics_lock = threading.Lock()
+
+def get_app_logic(state):
+    """Returns the AppLogic of the session's user."""
+    user_id = state.get("user_id") or backend_logic.DEFAULT_USER_ID
+    evicted = None
+    with app_logics_lock:
+        logic = app_logics.get(user_id)
+        if logic is None:
+            logic = backend_logic.AppLogic(user_id)
+            app_logics[user_id] = logic
+            if len(app_logics) > MAX_CACHED_USERS:
+                _, evicted = app_logics.popitem(last=False)
+        else:
+            app_logics.move_to_end(user_id)
+    if evicted is not None:
+        evicted.close() # Outside the lock: it waits for that user's saves
+    return logic
+
+@atexit.register
+def close_app_logics():
+    """Closes every cached user's session, e.g. when the server stops."""
+    with app_logics_lock:
+        logics = list(app_logics.values())
+    for logic in logics:
+        logic.close()
+
+# Stats other components keep, exported next to the LLM call metrics at /metrics
+get_registry().register_collector("storage_lock", get_lock_stats)
+get_registry().register_collector("write_behind", lambda: dict(get_write_behind_queue().stats))
+get_registry().register_collector("app", lambda: {"cached_users": len(app_logics)})
 
 # --- State Variables for Gradio ---
 # These mirror some states from AppLogic but are managed by Gradio
 # for passing between function calls within a session.
 # We'll use a single state dictionary for simplicity.
 initial_state = {
-    "current_mode": "main", # 'main', 'teaching', 'exam', 'history_list', 'history_detail', 'wrong_book_types', 'wrong_book_list', 'wrong_book_detail'
+    "user_id": backend_logic.DEFAULT_USER_ID, # Selects the AppLogic (and data shard) of this session
+    "current_mode": "main", # 'main', 'teaching', 'exam', 'history_list', 'history_detail', 'wrong_book_types', 'wrong_book_list', 'wrong_book_detail', 'review'
     "conversation_history": [],
+    "chatbot_length": 0, # Rows the teaching chatbot shows in the browser (see chatbot_delta)
     "current_dialog_key": None,
     "exam_questions": [],
     "current_question_index": 0,
@@ -20,6 +66,8 @@ initial_state = {
     "history_list_data": [], # Store data for history list view
     "wrong_data": {}, # Store all wrong data for wrong book views
     "wrong_filtered_list": [], # Store filtered wrong question list
+    "review_items": [], # (key, question) pairs due in the current review session
+    "review_index": 0,
     "voice_input_status": "stopped", # 'stopped', 'running', 'processing'
     "last_voice_text": None # Store the last recognized text
 }
@@ -33,29 +81,73 @@ def set_mode(state, mode):
     # print(f"Mode set to: {mode}")
     return state
 
-def get_main_menu_visibility(state):
-    return gr.update(visible=state["current_mode"] == "main")
-
-def get_teaching_mode_visibility(state):
-    return gr.update(visible=state["current_mode"] == "teaching")
-
-def get_exam_mode_visibility(state):
-    return gr.update(visible=state["current_mode"] == "exam")
-
-def get_history_list_visibility(state):
-     return gr.update(visible=state["current_mode"] == "history_list")
-
-def get_history_detail_visibility(state):
-     return gr.update(visible=state["current_mode"] == "history_detail")
-
-def get_wrong_book_types_visibility(state):
-     return gr.update(visible=state["current_mode"] == "wrong_book_types")
-
-def get_wrong_book_list_visibility(state):
-     return gr.update(visible=state["current_mode"] == "wrong_book_list")
-
-def get_wrong_book_detail_visibility(state):
-     return gr.update(visible=state["current_mode"] == "wrong_book_detail")
+# View blocks in the order their visibility updates are emitted.
+# Must match the `view_blocks` list built in the UI section below.
+VIEW_MODES = [
+    "main",
+    "teaching",
+    "exam",
+    "history_list",
+    "history_detail",
+    "wrong_book_types",
+    "wrong_book_list",
+    "wrong_book_detail",
+    "review",
+]
+
+def get_view_visibility(state):
+    """Returns one visibility update per view block, in VIEW_MODES order."""
+    return [gr.update(visible=state["current_mode"] == mode) for mode in VIEW_MODES]
+
+def route_view(handler, *extra_updates):
+    """
+    Wraps a navigation handler so a single event returns the handler's outputs
+    followed by the visibility of every view block (and any extra updates).
+    This replaces the chain of eight `.then(get_*_visibility)` events per click.
+    extra_updates are functions taking the new state and returning one update or a tuple of updates.
+    """
+    def routed(state, *args):
+        result = handler(state, *args)
+        if not isinstance(result, tuple):
+            result = (result,)
+        new_state = result[0]
+        outputs = list(result) + get_view_visibility(new_state)
+        for extra in extra_updates:
+            update = extra(new_state)
+            outputs.extend(update if isinstance(update, tuple) else (update,))
+        return tuple(outputs)
+    routed.__wrapped__ = handler # Lets benchmarks/bench_view_router.py find the routed events
+    return routed
+
+# --- Incremental Chatbot Updates ---
+# The browser keeps the rendered transcript. Per turn, handlers only send the rows
+# that changed, as {"start": row index, "rows": [...]} in a hidden JSON component,
+# and APPLY_CHATBOT_DELTA_JS splices them into the Chatbot on the client, so the
+# payload per message no longer grows with the length of the conversation.
+
+APPLY_CHATBOT_DELTA_JS = """
+(history, delta) => {
+    if (!delta) return history;
+    return (history || []).slice(0, delta.start).concat(delta.rows);
+}
+"""
+
+def to_chatbot_rows(messages):
+    """Chatbot rows for conversation messages: [user, None] or [None, assistant]."""
+    rows = []
+    for msg in messages:
+        if msg["role"] == "user":
+            rows.append([msg["content"], None])
+        elif msg["role"] == "assistant":
+            rows.append([None, msg["content"]])
+    return rows
+
+def chatbot_delta(state, new_messages):
+    """Delta appending new_messages after the rows the browser already shows."""
+    rows = to_chatbot_rows(new_messages)
+    start = state.get("chatbot_length", 0)
+    state["chatbot_length"] = start + len(rows)
+    return {"start": start, "rows": rows}
 
 def get_voice_button_label(state):
     return gr.update(value="停止语音输入" if state["voice_input_status"] == "running" else "语音输入")
@@ -72,60 +164,130 @@ def get_exam_nav_buttons_visibility(state):
     return gr.update(visible=prev_visible), gr.update(visible=next_visible), gr.update(visible=submit_visible)
 
 
+# --- Accounts ---
+# users.json maps each user id to its password: {"alice": "...", "bob": "..."}.
+# With the file, the server asks for a login and every session works on the records
+# of the user it signed in as; without it, everyone shares the default user's records.
+ACCOUNTS_PATH = "users.json"
+
+def load_accounts(path=ACCOUNTS_PATH):
+    """Returns {user_id: password} from the accounts file, or None if there is none."""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as file:
+        accounts = json.load(file)
+    for user_id in accounts:
+        backend_logic.get_user_data_dir(user_id) # Raises ValueError on an id that cannot name a shard
+    return accounts
+
+def check_login(accounts):
+    """Gradio auth callback accepting the users and passwords of `accounts`."""
+    def authenticate(username, password):
+        expected = accounts.get(username)
+        return expected is not None and hmac.compare_digest(expected.encode("utf-8"), password.encode("utf-8"))
+    return authenticate
+
+
 # --- Event Handlers (calling backend_logic) ---
 
+def bind_user_id(state, request: gr.Request):
+    """
+    Selects the records of the user this session signed in as, on page load. The user id
+    is only ever taken from the authenticated request, never from input the page sends.
+    """
+    user_id = getattr(request, "username", None) or backend_logic.DEFAULT_USER_ID
+    state["user_id"] = user_id
+    return state, gr.update(value=f"当前用户: {user_id}", visible=True)
+
+
+def notify_usage_warning(app_logic):
+    """Shows the soft token quota warning of the last LLM calls, if any, as a toast."""
+    warning = app_logic.usage_ledger.pop_warning()
+    if warning:
+        gr.Warning(warning)
+
+
 def start_teaching_mode(state):
     """Switches to teaching mode and resets state."""
+    app_logic = get_app_logic(state)
     # Save current mode data if applicable before switching
     if state["current_mode"] == "teaching":
-         app_logic.save_chat_history()
+         app_logic.save_chat_history_later()
     elif state["current_mode"] == "exam":
-         app_logic.save_wrong_questions()
+         app_logic.save_wrong_questions_later()
 
     app_logic.reset_teaching_state() # Reset backend state
     state = set_mode(state, "teaching")
     state["conversation_history"] = app_logic.conversation_history # Sync state
     state["current_dialog_key"] = app_logic.current_dialog_key # Sync state
+    state["chatbot_length"] = 0
     return state, [], "" # Return updated state, clear chatbot, clear chat input
 
 
-def start_exam_mode(state):
-    """Generates exam questions and switches to exam mode."""
+def choice_pairs(options):
+    """Radio choices [(label, key)] for an option string like "A:1,B:2,C:3,D:4"."""
+    pairs = [option.split(":", 1) for option in re.split(r"[,，]", (options or "").replace("：", ":")) if ":" in option]
+    return [(f"{key.strip()}: {text.strip()}", key.strip()) for key, text in pairs]
+
+def exam_question_updates(state, index):
+    """Returns the description, progress, choice, fill-in and open answer updates for exam question `index`."""
+    questions = state.get("exam_questions", [])
+    question = questions[index]
+    question_type = question.get("type", "未知")
+    answer = state["user_answers"].get(index)
+    return (gr.update(value=f"**[{question_type}]** {question.get('description', '无描述')}"),
+            gr.update(value=f"第 {index + 1} / {len(questions)} 题"),
+            gr.update(choices=choice_pairs(question.get("option")), value=answer, visible=question_type == "选择"),
+            gr.update(value=answer or "", visible=question_type == "填空"),
+            gr.update(value=answer or "", visible=question_type == "简答"))
+
+
+def start_exam_mode(state, adaptive=False):
+    """Generates exam questions (targeted at the wrong book if adaptive) and switches to exam mode."""
+    app_logic = get_app_logic(state)
     # Save current mode data if applicable before switching
     if state["current_mode"] == "teaching":
-         app_logic.save_chat_history()
+         app_logic.save_chat_history_later()
     elif state["current_mode"] == "exam":
-         app_logic.save_wrong_questions()
+         app_logic.save_wrong_questions_later()
 
     app_logic.reset_exam_state() # Reset backend state
-    questions, error = app_logic.generate_exam_questions()
+    questions, error = app_logic.generate_adaptive_exam() if adaptive else app_logic.generate_exam_questions()
+    notify_usage_warning(app_logic)
 
     if error:
         # Stay on main menu and show error
         state = set_mode(state, "main")
-        return state, [], 0, {}, {}, gr.update(value=f"生成考题失败: {error}", visible=True)
+        return (state, gr.update(), gr.update(), gr.update(), gr.update(), gr.update(),
+                gr.update(value=f"生成考题失败: {error}", visible=True))
 
     state = set_mode(state, "exam")
     state["exam_questions"] = questions
     state["current_question_index"] = 0
-    state["user_answers"] = {} # Ensure user answers are reset
-    state["evaluation_results"] = {} # Ensure evaluation results are reset
+    state["user_answers"] = app_logic.user_answers # Sync state (reset for the new exam)
+    state["evaluation_results"] = app_logic.evaluation_results # Sync state (reset for the new exam)
 
-    return state, questions, 0, state["user_answers"], state["evaluation_results"], gr.update(visible=False) # Return state, questions, current index, answers, eval results, hide message box
+    # State, the first question (description, progress, answer inputs), hidden message box
+    return (state, *exam_question_updates(state, 0), gr.update(visible=False))
+
+
+def start_adaptive_exam_mode(state):
+    """Starts a remediation exam on the weak topics of the wrong book."""
+    return start_exam_mode(state, adaptive=True)
 
 
 def view_chat_history_list(state):
     """Loads chat history list and switches to history list mode."""
+    app_logic = get_app_logic(state)
     # Save current mode data if applicable before switching
     if state["current_mode"] == "teaching":
-         app_logic.save_chat_history()
+         app_logic.save_chat_history_later()
     elif state["current_mode"] == "exam":
-         app_logic.save_wrong_questions()
+         app_logic.save_wrong_questions_later()
 
-    history_list_data, full_chat_data = app_logic.load_chat_history_list()
+    history_list_data, _ = app_logic.load_chat_history_list() # Previews only; dialogs are read when opened
     state = set_mode(state, "history_list")
     state["history_list_data"] = history_list_data # Store list data for display
-    state["chat_data_full"] = full_chat_data # Store full data for drill down
 
     # Prepare history list for Gradio display (e.g., as Markdown list)
     display_text = "## 聊天记录\n\n"
@@ -144,16 +306,9 @@ def view_chat_history_list(state):
 
 def view_chat_detail(state, dialog_key):
     """Loads and displays a specific chat dialogue."""
-    # Ensure full chat data is loaded or available in state
-    if "chat_data_full" not in state or not state["chat_data_full"]:
-         # Should not happen if coming from history list, but as a fallback
-         _, full_chat_data = app_logic.load_chat_history_list()
-         state["chat_data_full"] = full_chat_data
-         if not state["chat_data_full"]:
-              state = set_mode(state, "history_list") # Go back if data not found
-              return state, [], "无法加载聊天详情，请重试。" # Return state, empty chat, error message
-
-    conversation, error = app_logic.load_chat_detail(state["chat_data_full"], dialog_key)
+    app_logic = get_app_logic(state)
+    # Only this dialog is read from storage (by key)
+    conversation, error = app_logic.load_chat_detail(None, dialog_key)
 
     if error:
         state = set_mode(state, "history_list") # Go back if error
@@ -163,41 +318,30 @@ def view_chat_detail(state, dialog_key):
     state["conversation_history"] = conversation # Load into current history for viewing/continuation
     state["current_dialog_key"] = dialog_key # Set current key for continuation
 
-    # Format conversation for Chatbot display
-    chatbot_display = []
-    for msg in conversation:
-         if msg["role"] == "user":
-             chatbot_display.append([msg["content"], None]) # User message
-         elif msg["role"] == "assistant":
-             chatbot_display.append([None, msg["content"]]) # Assistant message
-
-    return state, chatbot_display, None # Return state, chatbot format, no error
+    # Format conversation for Chatbot display (sent once per opened dialog)
+    return state, to_chatbot_rows(conversation), None # Return state, chatbot format, no error
 
 
 def continue_conversation_from_history(state):
      """Switches to teaching mode with loaded history."""
      state = set_mode(state, "teaching")
-     # The conversation_history is already loaded in load_chat_detail
-     # Need to format it for the chatbot
-     chatbot_display = []
-     for msg in state["conversation_history"]:
-          if msg["role"] == "user":
-              chatbot_display.append([msg["content"], None])
-          elif msg["role"] == "assistant":
-              chatbot_display.append([None, msg["content"]])
-     return state, chatbot_display, "" # Return state, chatbot format, clear input
+     # The conversation_history is already loaded in load_chat_detail, and the browser
+     # already shows it in the detail chatbot: it is copied to the teaching chatbot on
+     # the client (see btn_continue_chat), so only the row count is tracked here
+     state["chatbot_length"] = len(to_chatbot_rows(state["conversation_history"]))
+     return state, "" # Return state, clear input
 
 
 def delete_chat_record_action(state, dialog_key_to_delete):
      """Deletes a specific chat record and refreshes the list."""
+     app_logic = get_app_logic(state)
      if not dialog_key_to_delete:
           return state, [], "请先选择要删除的记录。" # No key selected
 
      message = app_logic.delete_chat_record(dialog_key_to_delete)
      # After deleting, refresh the history list view
-     history_list_data, full_chat_data = app_logic.load_chat_history_list()
+     history_list_data, _ = app_logic.load_chat_history_list()
      state["history_list_data"] = history_list_data
-     state["chat_data_full"] = full_chat_data
 
      # Stay on history list view
      state = set_mode(state, "history_list")
@@ -205,28 +349,47 @@ def delete_chat_record_action(state, dialog_key_to_delete):
      return state, history_list_data, message # Return state, refreshed list, message
 
 
+def search_chat_history_action(state, query):
+     """Searches all chat turns and shows matching dialogs with snippets."""
+     app_logic = get_app_logic(state)
+     results, error = app_logic.search_chat_history(query)
+     if error:
+          return state, [], gr.update(value=error, visible=True) # Return state, empty results, message
+
+     # One row per snippet: dialog key, turn (Q1/A1...), character offsets, context text
+     rows = []
+     for result in results:
+          for snippet in result["snippets"]:
+               rows.append([result["dialog_key"], snippet["field"], f"{snippet['start']}-{snippet['end']}", snippet["text"]])
+     message = f"找到 {len(results)} 条相关对话。" if results else "没有找到相关对话。"
+     return state, rows, gr.update(value=message, visible=True) # Return state, results, message
+
+
 def view_wrong_book_types(state):
      """Switches to wrong book types view."""
+     app_logic = get_app_logic(state)
      # Save current mode data if applicable before switching
      if state["current_mode"] == "teaching":
-         app_logic.save_chat_history()
+         app_logic.save_chat_history_later()
      elif state["current_mode"] == "exam":
-         app_logic.save_wrong_questions()
+         app_logic.save_wrong_questions_later()
 
      state = set_mode(state, "wrong_book_types")
-     wrong_data, error = app_logic.load_wrong_questions()
-     state["wrong_data"] = wrong_data # Store all wrong data
+     # Served from memory, with the exam just queued above: no wait for the flusher here
+     question_types = app_logic.wrong_question_types()
+     state["wrong_data"] = {} # Loaded with the list of a type, once the queued writes are in
 
      # Determine if there are questions of each type to potentially show buttons
-     has_choice = any(q.get("type") == "选择" for q in wrong_data.values())
-     has_fill = any(q.get("type") == "填空" for q in wrong_data.values())
-     has_open = any(q.get("type") == "简答" for q in wrong_data.values())
+     has_choice = "选择" in question_types
+     has_fill = "填空" in question_types
+     has_open = "简答" in question_types
 
      return state, gr.update(visible=has_choice), gr.update(visible=has_fill), gr.update(visible=has_open) # Return state and button visibilities
 
 
 def view_wrong_book_list(state, question_type):
      """Loads and displays wrong questions of a specific type."""
+     app_logic = get_app_logic(state)
      filtered_questions, error = app_logic.load_wrong_questions_by_type(question_type)
 
      if error:
@@ -236,6 +399,7 @@ def view_wrong_book_list(state, question_type):
           return state, [], error # Return state, empty list, error message
 
      state = set_mode(state, "wrong_book_list")
+     state["wrong_data"] = filtered_questions # Questions the detail view can open
      state["wrong_filtered_list"] = list(filtered_questions.items()) # Store as list of (key, data) tuples
      state["current_wrong_type"] = question_type # Store current type for 'Back' button
 
@@ -247,40 +411,42 @@ def view_wrong_book_list(state, question_type):
 
 def view_wrong_book_detail(state, wrong_question_key):
     """Loads and displays the detail of a specific wrong question."""
+    app_logic = get_app_logic(state)
     # Ensure wrong_data is loaded
     if "wrong_data" not in state or not state["wrong_data"]:
          wrong_data, error = app_logic.load_wrong_questions()
          state["wrong_data"] = wrong_data
          if error:
              state = set_mode(state, "wrong_book_types")
-             return state, {}, error # Return state, empty detail, error
+             return (state, *[gr.update()] * 6, gr.update(value=error, visible=True)) # Return state, unchanged detail, error
 
     question_detail = state["wrong_data"].get(wrong_question_key)
 
     if not question_detail:
         state = set_mode(state, "wrong_book_list") # Go back if question not found
-        return state, {}, f"未找到错题 '{wrong_question_key}'。" # Return state, empty detail, error
+        return (state, *[gr.update()] * 6, gr.update(value=f"未找到错题 '{wrong_question_key}'。", visible=True)) # Return state, unchanged detail, error
 
     state = set_mode(state, "wrong_book_detail")
     state["current_wrong_key"] = wrong_question_key # Store key for delete/back
     state["current_wrong_type"] = question_detail.get("type", "未知") # Store type for back button
 
-    # Prepare detail for display
-    detail_display = {
-        "题目描述": question_detail.get("description", "无"),
-        "类型": question_detail.get("type", "无"),
-        "你的答案": question_detail.get("user_answer", "无"),
-        "正确答案": question_detail.get("answer", "无"),
-        "答案解释": question_detail.get("explanation", "无"),
-        "选项": question_detail.get("options", "无") if question_detail.get("type") == "选择" else "非选择题"
-    }
-
-
-    return state, detail_display, "" # Return state, detail dictionary, clear message
+    # One update per detail field: description, type, options, user answer, correct answer, explanation
+    count = question_detail.get("count", 1) # Duplicates are merged into one entry
+    description = question_detail.get("description", "无") + (f"\n\n（出现 {count} 次）" if count > 1 else "")
+    is_choice = question_detail.get("type") == "选择"
+    return (state,
+            gr.update(value=description),
+            gr.update(value=question_detail.get("type", "无")),
+            gr.update(value=question_detail.get("options", "无"), visible=is_choice),
+            gr.update(value=question_detail.get("user_answer", "无")),
+            gr.update(value=question_detail.get("answer", "无")),
+            gr.update(value=question_detail.get("explanation", "无")),
+            gr.update(value="", visible=False)) # Clear message
 
 
 def delete_wrong_question_action(state):
      """Deletes the currently viewed wrong question and returns to the list."""
+     app_logic = get_app_logic(state)
      if "current_wrong_key" not in state or not state["current_wrong_key"]:
           return state, [], "没有选中要删除的错题。" # No key selected
 
@@ -303,13 +469,68 @@ def delete_wrong_question_action(state):
      return state, display_list, message # Return state, refreshed list, message
 
 
+def show_review_item(state):
+    """Returns the progress, description, options, answer box and feedback updates for the current review item."""
+    items = state.get("review_items", [])
+    index = state.get("review_index", 0)
+    if index >= len(items):
+        return (f"本次复习完成，共复习 {len(items)} 题。", gr.update(value=""), gr.update(value="", visible=False),
+                gr.update(value="", visible=False), gr.update(value="", visible=False))
+    key, question = items[index]
+    is_choice = question.get("type") == "选择"
+    return (f"第 {index + 1}/{len(items)} 题（{question.get('type', '未知')}，错题 {key}）",
+            gr.update(value=question.get("description", "")),
+            gr.update(value=question.get("options", "") if is_choice else "", visible=is_choice),
+            gr.update(value="", visible=True),
+            gr.update(value="", visible=False))
+
+
+def start_review_session(state):
+    """Starts drilling the wrong questions that are due for review."""
+    app_logic = get_app_logic(state)
+    due, error = app_logic.start_review_session()
+    if error or not due:
+        state = set_mode(state, "wrong_book_types")
+        message = error or "当前没有到期需要复习的错题。"
+        return (state, gr.update(value=message, visible=True)) + show_review_item(state)
+
+    state = set_mode(state, "review")
+    state["review_items"] = due
+    state["review_index"] = 0
+    return (state, gr.update(visible=False)) + show_review_item(state)
+
+
+def submit_review_answer(state, user_answer):
+    """Grades the current review answer and shows when the question comes back."""
+    app_logic = get_app_logic(state)
+    items = state.get("review_items", [])
+    index = state.get("review_index", 0)
+    if index >= len(items):
+        return state, gr.update(visible=False)
+    key, question = items[index]
+    evaluation, error = app_logic.grade_review_answer(key, question, user_answer)
+    if error:
+        return state, gr.update(value=error, visible=True)
+    feedback = (f"{evaluation['result']}：{evaluation['reason']}\n"
+                f"正确答案：{question.get('answer', '')}\n"
+                f"下次复习：{evaluation['interval']} 天后")
+    return state, gr.update(value=feedback, visible=True)
+
+
+def next_review_item(state):
+    """Moves to the next due question of the review session."""
+    state["review_index"] = state.get("review_index", 0) + 1
+    return (state,) + show_review_item(state)
+
+
 def return_to_main_menu(state):
     """Saves current state and returns to main menu."""
+    app_logic = get_app_logic(state)
     # Save current mode data if applicable before switching
     if state["current_mode"] == "teaching":
-         app_logic.save_chat_history()
+         app_logic.save_chat_history_later()
     elif state["current_mode"] == "exam":
-         app_logic.save_wrong_questions()
+         app_logic.save_wrong_questions_later()
 
     state = set_mode(state, "main")
     # Clear transient data related to specific modes
@@ -320,11 +541,12 @@ def return_to_main_menu(state):
     state["user_answers"] = {}
     state["evaluation_results"] = {}
     state["history_list_data"] = []
-    state["chat_data_full"] = {}
     state["wrong_data"] = {}
     state["wrong_filtered_list"] = []
     state["current_wrong_key"] = None
     state["current_wrong_type"] = None
+    state["review_items"] = []
+    state["review_index"] = 0
 
     # Stop voice recognition if running
     if backend_logic.voice_recognition_active:
@@ -338,99 +560,22 @@ def return_to_main_menu(state):
 # --- Teaching Mode Handlers ---
 def send_message(state, user_input):
     """Sends user message and gets AI response."""
+    app_logic = get_app_logic(state)
     if not user_input:
-        # Return current state and chatbot display without changes
-        chatbot_display = []
-        for msg in state["conversation_history"]:
-            if msg["role"] == "user":
-                chatbot_display.append([msg["content"], None])
-            elif msg["role"] == "assistant":
-                chatbot_display.append([None, msg["content"]])
-        return state, chatbot_display, "", "" # state, chatbot, clear input, clear voice text
-
-    # Add user message to backend history
+        # Leave the chatbot as it is
+        return state, None, "", "" # state, no chatbot delta, clear input, clear voice text
+
+    # Sync backend history, let the backend add the user message, retrieve course
+    # material for this turn, call the API and add the assistant reply, then sync back.
     app_logic.conversation_history = state["conversation_history"] # Sync backend history
-    app_logic.conversation_history.append({"role": "user", "content": user_input})
+    turn_start = len(app_logic.conversation_history)
+    app_logic.send_message(user_input) # Errors are added to the history as the AI message
+    notify_usage_warning(app_logic)
     state["conversation_history"] = app_logic.conversation_history # Sync state
 
-    # Call backend to get AI response
-    # backend_logic.send_message handles the API call and appending to its history
-    # We need to adapt it to work with the history passed from state or sync back
-    # Let's refactor backend_logic.send_message to take history and return new history + AI message
-    # --- Adaptation needed in backend_logic.py ---
-    # For now, let's just sync history, call the original send_message, and sync back.
-    # A better approach is to rewrite send_message in backend to take history, add user msg, call API, add AI msg, return updated history.
-    # Assuming send_message is updated to return the full updated history and the AI message text:
-    # updated_history, ai_message_text = app_logic.send_message_adapted(state["conversation_history"], user_input)
-    # state["conversation_history"] = updated_history
-    # But given the original structure, let's try syncing.
-
-    # Temporary: Directly call original logic, assuming it modifies its internal state
-    # This couples frontend and backend state more tightly than ideal.
-    # app_logic.conversation_history = state["conversation_history"] # Ensure backend is synced
-    # try:
-    #      # Original logic gets response and appends to app_logic.conversation_history
-    #      # This needs refactoring in backend_logic to return the new AI message
-    #      # For now, just call and assume backend updates its state, then sync back
-    #      # This is not a clean pattern for Gradio.
-    #      # Need a proper function in backend_logic like:
-    #      # def get_ai_response(self, history, user_input):
-    #      #    # add user_input to history, call API, add response, return new history
-    #      #    pass
-    #      pass # Placeholder
-
-    # Let's simulate the response for now until backend_logic.send_message is adapted to return response
-    # In a real scenario, you call app_logic.send_message() and it updates its state.
-    # Then you sync the state back.
-    try:
-         # Call backend logic to get AI response based on current history
-         # This backend call should get the history, add user input, get AI response, add AI response.
-         # Let's assume backend_logic has a method like process_chat_message(self, user_input)
-         # that handles the API call and updates its internal self.conversation_history
-         # Then we sync state back.
-         # --- Needs refactoring in backend_logic ---
-         # Example of adapted backend_logic.send_message:
-         # def send_message(self, user_input):
-         #     self.conversation_history.append({"role": "user", "content": user_input})
-         #     # API call...
-         #     assistant_message = ... # Get AI message
-         #     self.conversation_history.append({"role": "assistant", "content": assistant_message})
-         #     return assistant_message # Return the AI message text
-         pass # Placeholder
-
-    # Let's implement a simple version here that calls a simplified backend function
-    # that just takes history, adds user, calls API, adds assistant, and returns new history + AI msg
-    # Need to add/adapt this method in backend_logic.py
-    assistant_message = ""
-    try:
-        # Call OpenAI API directly here for demonstration, ideally in backend
-        # This is a temporary placement for demo purposes.
-        response = openai.ChatCompletion.create(
-            model="gpt-4o",
-            messages=state["conversation_history"]
-        )
-        assistant_message = response['choices'][0]['message']['content']
-        app_logic.conversation_history = state["conversation_history"] # Sync backend
-        app_logic.conversation_history.append({"role": "assistant", "content": assistant_message})
-        state["conversation_history"] = app_logic.conversation_history # Sync state
-    except Exception as e:
-        assistant_message = f"Error: 调用 OpenAI API 出错: {e}"
-        # Decide how to handle error in history - maybe add as an AI message?
-        app_logic.conversation_history = state["conversation_history"] # Sync backend
-        app_logic.conversation_history.append({"role": "assistant", "content": assistant_message})
-        state["conversation_history"] = app_logic.conversation_history # Sync state
-
-
-    # Format history for Chatbot display
-    chatbot_display = []
-    for msg in state["conversation_history"]:
-         if msg["role"] == "user":
-             chatbot_display.append([msg["content"], None])
-         elif msg["role"] == "assistant":
-             chatbot_display.append([None, msg["content"]])
-
-
-    return state, chatbot_display, "", "" # Return state, updated chatbot, clear input, clear voice text
+    # Only this turn's messages go to the browser
+    delta = chatbot_delta(state, state["conversation_history"][turn_start:])
+    return state, delta, "", "" # Return state, chatbot delta, clear input, clear voice text
 
 
 def toggle_voice_input(state):
@@ -480,6 +625,9 @@ def show_question(state, index):
         return state, {}, None, None, gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), "" # State, question_data, answer_value, eval_display, nav button visibilities, error
 
     question = questions[index]
+    previous_index = state.get("current_question_index", 0)
+    if previous_index != index:
+        get_app_logic(state).leave_question(previous_index) # May start grading that answer in the background
     state["current_question_index"] = index
 
     # Prepare question data for display
@@ -525,16 +673,25 @@ def show_question(state, index):
             error_message) # Return state and display data/visibility updates
 
 
+def set_speculative_grading(state, enabled):
+    """Turns background grading of answers the student has moved on from on or off."""
+    get_app_logic(state).speculative_grading = bool(enabled)
+    return state
+
 def save_answer(state, user_answer):
     """Saves the user's answer for the current question."""
     current_index = state.get("current_question_index", 0)
     state["user_answers"][current_index] = user_answer
+    get_app_logic(state).record_answer(current_index, user_answer) # Postpones speculative grading while editing
     # print(f"Saved answer for question {current_index}: {user_answer}")
     return state # Return updated state
 
 def submit_exam(state):
     """Submits the exam for evaluation."""
+    app_logic = get_app_logic(state)
+    app_logic.user_answers = state["user_answers"] # Sync backend answers
     total_score, evaluation_results, error = app_logic.submit_exam()
+    notify_usage_warning(app_logic)
 
     state["evaluation_results"] = evaluation_results
     state["total_score"] = total_score # Store total score
@@ -606,8 +763,10 @@ with gr.Blocks() as demo:
     # --- Main Menu Block ---
     with gr.Column(visible=True) as main_menu_block:
         gr.Label("教学与考核系统", label="主菜单")
+        user_message = gr.Textbox(label="信息", visible=False, interactive=False) # Shows the signed-in user
         btn_teaching = gr.Button("教学模式")
         btn_exam = gr.Button("考核模式")
+        btn_adaptive_exam = gr.Button("错题强化考核")
         btn_history = gr.Button("查看聊天记录")
         btn_wrong_book = gr.Button("错题本")
 
@@ -616,6 +775,8 @@ with gr.Blocks() as demo:
         gr.Label("教学模式", label="当前模式")
         # Chatbot component to display conversation
         chatbot = gr.Chatbot(label="对话记录")
+        # Rows added by the last turn; applied to the chatbot in the browser
+        chatbot_delta_json = gr.JSON(visible=False)
         # Input area
         with gr.Row():
             chat_input = gr.Textbox(label="你的消息", scale=4)
@@ -630,6 +791,7 @@ with gr.Blocks() as demo:
     with gr.Column(visible=False) as exam_mode_block:
         gr.Label("考核模式", label="当前模式")
         exam_message = gr.Textbox(label="考试信息", visible=False, interactive=False) # Messages like "生成考题失败" or "考试已提交"
+        speculative_grading_checkbox = gr.Checkbox(label="答题时后台预评分（提交后更快出分）", value=False)
         question_index_display = gr.Textbox(label="题目进度", interactive=False)
         question_description_display = gr.Markdown(label="题目描述") # Use Markdown for formatting
         # Components for different question types (conditionally visible/used)
@@ -655,6 +817,15 @@ with gr.Blocks() as demo:
              datatype=["str", "str"],
              interactive=False
          )
+         # Full-text search over all Q/A turns
+         with gr.Row():
+             history_search_input = gr.Textbox(label="搜索聊天内容", scale=3)
+             btn_search_history = gr.Button("搜索", scale=1)
+         history_search_table = gr.DataFrame(
+             headers=["对话ID", "轮次", "位置", "片段"],
+             datatype=["str", "str", "str", "str"],
+             interactive=False
+         )
          # Select a row to view detail (requires JavaScript or extra component logic)
          # For simplicity, let's add an input box to type the Dialog ID and a button
          with gr.Row():
@@ -682,6 +853,8 @@ with gr.Blocks() as demo:
          btn_wrong_fill = gr.Button("填空题", visible=False)   # Visible only if questions exist
          btn_wrong_open = gr.Button("简答题", visible=False)   # Visible only if questions exist
          with gr.Row():
+            btn_review_wrong_book = gr.Button("复习到期错题")
+            btn_merge_wrong_book = gr.Button("合并相似错题")
             btn_clear_wrong_book = gr.Button("清空错题本", variant="stop")
             btn_return_wrong_types = gr.Button("返回主菜单")
 
@@ -718,140 +891,85 @@ with gr.Blocks() as demo:
              btn_back_to_wrong_list = gr.Button("返回列表")
 
 
+    # --- Review Session Block ---
+    with gr.Column(visible=False) as review_block:
+         gr.Label("错题复习", label="当前模式")
+         review_progress = gr.Textbox(label="进度", interactive=False)
+         review_description = gr.Markdown(label="题目描述")
+         review_options = gr.Markdown(label="选项", visible=False) # Only for choice
+         review_answer_input = gr.Textbox(label="你的答案")
+         review_feedback = gr.Textbox(label="评分", visible=False, interactive=False)
+         with gr.Row():
+             btn_submit_review = gr.Button("提交答案")
+             btn_next_review = gr.Button("下一题")
+             btn_back_from_review = gr.Button("返回错题本")
+
+
     # --- Event Handling Wiring ---
 
+    # All view blocks, in VIEW_MODES order. Navigation events output these
+    # after the handler's own outputs (see route_view).
+    view_blocks = [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block, review_block]
+
+    # The session's records are those of the signed-in user
+    demo.load(
+        bind_user_id,
+        inputs=[state],
+        outputs=[state, user_message]
+    )
+
     # Main Menu Buttons
+
     btn_teaching.click(
-        start_teaching_mode,
-        inputs=[state],
-        outputs=[state, chatbot, chat_input] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # Update visibility
-    ).then( # Use then to update visibility after state change
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
-
-
-    btn_exam.click(
-        start_exam_mode,
+        route_view(start_teaching_mode),
         inputs=[state],
-        outputs=[state, question_description_display, question_index_display, choice_options, fill_in_input, open_answer_input, exam_message] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # Initial outputs for exam + update visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block]
-    ).then( # After showing the first question, determine nav button visibility
-         get_exam_nav_buttons_visibility, inputs=[state], outputs=[btn_prev_question, btn_next_question, btn_submit_exam]
+        outputs=[state, chatbot, chat_input] + view_blocks # Update state, chatbot, input and visibility in one event
     )
 
 
+    for btn_start_exam, exam_handler in [(btn_exam, start_exam_mode), (btn_adaptive_exam, start_adaptive_exam_mode)]:
+        btn_start_exam.click(
+            route_view(exam_handler, get_exam_nav_buttons_visibility),
+            inputs=[state],
+            outputs=[state, question_description_display, question_index_display, choice_options, fill_in_input, open_answer_input, exam_message] + view_blocks + [btn_prev_question, btn_next_question, btn_submit_exam] # Initial outputs for exam + visibility + nav buttons
+        )
+
+
     btn_history.click(
-        view_chat_history_list,
+        route_view(view_chat_history_list),
         inputs=[state],
-        outputs=[state, history_table] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # Outputs: state, history_list, visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
+        outputs=[state, history_table] + view_blocks # Outputs: state, history_list, visibility
+    )
 
 
     btn_wrong_book.click(
-        view_wrong_book_types,
+        route_view(view_wrong_book_types),
         inputs=[state],
-        outputs=[state, btn_wrong_choice, btn_wrong_fill, btn_wrong_open] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # Outputs: state, type button visibility, block visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
+        outputs=[state, btn_wrong_choice, btn_wrong_fill, btn_wrong_open] + view_blocks # Outputs: state, type button visibility, block visibility
+    )
 
     # Return to Main Menu Buttons
-    btn_return_teaching.click(
-        return_to_main_menu,
-        inputs=[state],
-        outputs=[state, btn_voice_input] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # Outputs: state, voice button label, visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
-
-    btn_return_exam.click(
-        return_to_main_menu,
-        inputs=[state],
-        outputs=[state, btn_voice_input] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # Outputs: state, voice button label, visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
-
-    btn_return_history_list.click(
-        return_to_main_menu,
-        inputs=[state],
-        outputs=[state, btn_voice_input] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # Outputs: state, voice button label, visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
-
-    btn_return_wrong_types.click(
-        return_to_main_menu,
-        inputs=[state],
-        outputs=[state, btn_voice_input] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # Outputs: state, voice button label, visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
+    for btn_return in [btn_return_teaching, btn_return_exam, btn_return_history_list, btn_return_wrong_types]:
+        btn_return.click(
+            route_view(return_to_main_menu),
+            inputs=[state],
+            outputs=[state, btn_voice_input] + view_blocks # Outputs: state, voice button label, visibility
+        )
 
     # Teaching Mode Interactions
-    btn_send.click(
-        send_message,
-        inputs=[state, chat_input],
-        outputs=[state, chatbot, chat_input, voice_text_output] # Update state, chatbot, clear input, clear voice text display
-    )
-    # Use .submit for text input to trigger send on Enter key
-    chat_input.submit(
-         send_message,
-         inputs=[state, chat_input],
-         outputs=[state, chatbot, chat_input, voice_text_output] # Update state, chatbot, clear input, clear voice text display
-    )
+    # Send on click or Enter; the server returns only the new rows, which are then
+    # appended to the chatbot in the browser without another round trip
+    for send_event in [btn_send.click, chat_input.submit]:
+        send_event(
+            send_message,
+            inputs=[state, chat_input],
+            outputs=[state, chatbot_delta_json, chat_input, voice_text_output] # Update state, chatbot delta, clear input, clear voice text display
+        ).then(
+            None,
+            inputs=[chatbot, chatbot_delta_json],
+            outputs=[chatbot],
+            js=APPLY_CHATBOT_DELTA_JS
+        )
 
     # Voice Input Polling (Requires a Polling Component or loop in Gradio)
     # Gradio doesn't have a built-in continuous poller for this exact use case easily.
@@ -908,6 +1026,12 @@ with gr.Blocks() as demo:
     )
 
 
+    speculative_grading_checkbox.change(
+        set_speculative_grading,
+        inputs=[state, speculative_grading_checkbox],
+        outputs=[state] # Just update state
+    )
+
     btn_submit_exam.click(
         submit_exam,
         inputs=[state],
@@ -917,18 +1041,10 @@ with gr.Blocks() as demo:
 
     # Chat History List Interactions
     btn_view_history_detail.click(
-        view_chat_detail,
+        route_view(view_chat_detail),
         inputs=[state, history_select_id_input],
-        outputs=[state, history_detail_chatbot, history_message] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # Outputs: state, chat, message, visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
+        outputs=[state, history_detail_chatbot, history_message] + view_blocks # Outputs: state, chat, message, visibility
+    )
 
     btn_delete_history.click(
          delete_chat_record_action,
@@ -936,100 +1052,99 @@ with gr.Blocks() as demo:
          outputs=[state, history_table, history_message] # Update state, refresh list table, show message
     )
 
+    btn_search_history.click(
+         search_chat_history_action,
+         inputs=[state, history_search_input],
+         outputs=[state, history_search_table, history_message] # Update state, search results, show message
+    )
+    history_search_input.submit(
+         search_chat_history_action,
+         inputs=[state, history_search_input],
+         outputs=[state, history_search_table, history_message] # Search on Enter key
+    )
+
     # Chat History Detail Interactions
     btn_continue_chat.click(
-        continue_conversation_from_history,
+        route_view(continue_conversation_from_history),
         inputs=[state],
-        outputs=[state, chatbot, chat_input] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # Outputs: state, chatbot, input, visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
+        outputs=[state, chat_input] + view_blocks # Outputs: state, input, visibility
+    ).then(
+        None,
+        inputs=[history_detail_chatbot],
+        outputs=[chatbot],
+        js="(rows) => rows" # Copy the transcript the browser already has
+    )
 
 
     btn_back_to_history_list.click(
-         view_chat_history_list, # Reload the history list
+         route_view(view_chat_history_list), # Reload the history list
          inputs=[state],
-         outputs=[state, history_table] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # Outputs: state, history_list, visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
+         outputs=[state, history_table] + view_blocks # Outputs: state, history_list, visibility
+    )
 
 
     # Wrong Book Types Interactions
     btn_wrong_choice.click(
-         lambda s: view_wrong_book_list(s, "选择"),
+         route_view(lambda s: view_wrong_book_list(s, "选择")),
          inputs=[state],
-         outputs=[state, wrong_list_table, wrong_types_message] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # State, list data, message, visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
+         outputs=[state, wrong_list_table, wrong_types_message] + view_blocks # State, list data, message, visibility
+    )
 
     btn_wrong_fill.click(
-         lambda s: view_wrong_book_list(s, "填空"),
+         route_view(lambda s: view_wrong_book_list(s, "填空")),
          inputs=[state],
-         outputs=[state, wrong_list_table, wrong_types_message] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # State, list data, message, visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
+         outputs=[state, wrong_list_table, wrong_types_message] + view_blocks # State, list data, message, visibility
+    )
 
     btn_wrong_open.click(
-         lambda s: view_wrong_book_list(s, "简答"),
+         route_view(lambda s: view_wrong_book_list(s, "简答")),
          inputs=[state],
-         outputs=[state, wrong_list_table, wrong_types_message] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # State, list data, message, visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
+         outputs=[state, wrong_list_table, wrong_types_message] + view_blocks # State, list data, message, visibility
+    )
+
+    btn_merge_wrong_book.click(
+        lambda s: (s, gr.update(value=get_app_logic(s).rebuild_wrong_book(), visible=True)), # Return state and message
+        inputs=[state],
+        outputs=[state, wrong_types_message]
+    )
+
+    # Review Session Interactions
+    btn_review_wrong_book.click(
+        route_view(start_review_session),
+        inputs=[state],
+        outputs=[state, wrong_types_message, review_progress, review_description, review_options, review_answer_input, review_feedback] + view_blocks # State, message, first item, visibility
+    )
+
+    btn_submit_review.click(
+        submit_review_answer,
+        inputs=[state, review_answer_input],
+        outputs=[state, review_feedback]
+    )
+
+    btn_next_review.click(
+        next_review_item,
+        inputs=[state],
+        outputs=[state, review_progress, review_description, review_options, review_answer_input, review_feedback]
+    )
+
+    btn_back_from_review.click(
+        route_view(view_wrong_book_types),
+        inputs=[state],
+        outputs=[state, btn_wrong_choice, btn_wrong_fill, btn_wrong_open] + view_blocks # State, type button visibility, block visibility
+    )
 
     btn_clear_wrong_book.click(
-        lambda s: (s, app_logic.clear_wrong_questions_file()), # Return state and message
+        lambda s: (s, get_app_logic(s).clear_wrong_questions_file()), # Return state and message
         inputs=[state],
         outputs=[state, wrong_types_message]
     )
 
     # Wrong Book List Interactions
     btn_view_wrong_detail.click(
-        view_wrong_book_detail,
+        route_view(view_wrong_book_detail),
         inputs=[state, wrong_select_key_input],
-        outputs=[state, wrong_detail_description, wrong_detail_type, wrong_detail_options, wrong_detail_user_answer, wrong_detail_correct_answer, wrong_detail_explanation, wrong_list_message] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # State, detail data, message, visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
+        outputs=[state, wrong_detail_description, wrong_detail_type, wrong_detail_options, wrong_detail_user_answer, wrong_detail_correct_answer, wrong_detail_explanation, wrong_list_message] + view_blocks # State, detail data, message, visibility
+    )
 
     btn_delete_wrong_from_list.click(
         delete_wrong_question_action,
@@ -1038,56 +1153,56 @@ with gr.Blocks() as demo:
     )
 
     btn_back_to_wrong_types.click(
-        view_wrong_book_types, # Return to types view
+        route_view(view_wrong_book_types), # Return to types view
         inputs=[state],
-        outputs=[state, btn_wrong_choice, btn_wrong_fill, btn_wrong_open] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # State, type button visibility, block visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
+        outputs=[state, btn_wrong_choice, btn_wrong_fill, btn_wrong_open] + view_blocks # State, type button visibility, block visibility
+    )
 
 
     # Wrong Book Detail Interactions
     btn_delete_wrong_from_detail.click(
-        delete_wrong_question_action, # Delete the currently viewed one
+        # delete_wrong_question_action already refreshes the list for the stored type
+        # and switches to the list view, so one routed event is enough.
+        route_view(delete_wrong_question_action), # Delete the currently viewed one
         inputs=[state], # The key is in state["current_wrong_key"]
-        outputs=[state, wrong_list_table, wrong_list_message] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # Update state, refresh list, show message, visibility
-    ).then( # After deleting, go back to the list view and update visibility
-        # Need to call view_wrong_book_list with the stored type
-        lambda s: view_wrong_book_list(s, s.get("current_wrong_type", "选择")),
-        inputs=[state],
-         outputs=[state, wrong_list_table, wrong_list_message]
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
+        outputs=[state, wrong_list_table, wrong_list_message] + view_blocks # Update state, refresh list, show message, visibility
+    )
 
 
     btn_back_to_wrong_list.click(
          # Need to call view_wrong_book_list with the stored type
-         lambda s: view_wrong_book_list(s, s.get("current_wrong_type", "选择")),
+         route_view(lambda s: view_wrong_book_list(s, s.get("current_wrong_type", "选择"))),
          inputs=[state],
-         outputs=[state, wrong_list_table, wrong_list_message] + [main_menu_block, teaching_mode_block, exam_mode_block, history_list_block, history_detail_block, wrong_book_types_block, wrong_book_list_block, wrong_book_detail_block] # State, list data, message, visibility
-    ).then( # Update visibility
-        get_main_menu_visibility, inputs=[state], outputs=[main_menu_block]
-    ).then(get_teaching_mode_visibility, inputs=[state], outputs=[teaching_mode_block]
-    ).then(get_exam_mode_visibility, inputs=[state], outputs=[exam_mode_block]
-    ).then(get_history_list_visibility, inputs=[state], outputs=[history_list_block]
-    ).then(get_history_detail_visibility, inputs=[state], outputs=[history_detail_block]
-    ).then(get_wrong_book_types_visibility, inputs=[state], outputs=[wrong_book_types_block]
-    ).then(get_wrong_book_list_visibility, inputs=[state], outputs=[wrong_book_list_block]
-    ).then(get_wrong_book_detail_visibility, inputs=[state], outputs=[wrong_book_detail_block])
+         outputs=[state, wrong_list_table, wrong_list_message] + view_blocks # State, list data, message, visibility
+    )
+
+
+def create_server():
+    """
+    The Gradio app mounted on a FastAPI server that also serves this process's metrics:
+    /metrics in the Prometheus text format, /metrics.json with p50/p90/p99 per call
+    site and the most recent LLM call spans.
+    """
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse, PlainTextResponse
+
+    server = FastAPI()
+
+    @server.get("/metrics")
+    def metrics():
+        return PlainTextResponse(get_registry().to_prometheus(), media_type="text/plain; version=0.0.4")
+
+    @server.get("/metrics.json")
+    def metrics_json(recent: int = 20):
+        return JSONResponse(get_registry().to_json(recent=recent))
+
+    accounts = load_accounts()
+    if accounts is None:
+        return gr.mount_gradio_app(server, demo, path="/")
+    return gr.mount_gradio_app(server, demo, path="/", auth=check_login(accounts))
 
 
 # Launch the Gradio app
-demo.launch()
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(create_server(), host="127.0.0.1", port=7860) # Same address as demo.launch()
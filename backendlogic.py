@@ -1,45 +1,28 @@
+import hashlib
+import itertools
 import threading
-import pyaudio
-import dashscope
-from dashscope.audio.asr import Recognition, RecognitionCallback, RecognitionResult
-import openai
 import json
 import re
 import os
 import queue # Used for voice recognition result communication
-
-# Initialize API keys
-def get_key(filename='key.txt'):
-    """
-    Reads API keys from a file.
-    Expects two lines: dashscope_key, openai_key
-    """
-    try:
-        with open(filename, 'r') as file:
-            lines = file.readlines()
-            dashscope_key = lines[0].strip()
-            openai_key = lines[1].strip()
-        return dashscope_key, openai_key
-    except FileNotFoundError:
-        print(f"Error: {filename} not found. Please create it with your API keys.")
-        return None, None
-    except IndexError:
-        print(f"Error: {filename} format incorrect. Expecting two lines.")
-        return None, None
-    except Exception as e:
-        print(f"Error reading API keys: {e}")
-        return None, None
-
-# Initialize API keys globally for simplicity, but consider passing them in a real app
-# These might need to be set *after* this module is imported in the Gradio app
-# or managed within the AppLogic class if the keys are loaded dynamically.
-# For now, keep them as in the original script:
-dashscope_api_key, openai_api_key = get_key()
-if dashscope_api_key:
-    dashscope.api_key = dashscope_api_key
-if openai_api_key:
-    openai.api_key = openai_api_key
-openai.api_base = "https://api.chatfire.cn/v1" # Assuming this base URL is still needed
+from adaptive_exam import ADAPTIVE_EXAM_LAYOUT, WrongTopicIndex, assemble_weighted_exam, top_weak_topics, wrong_question_examples
+from chat_search import ChatSearchIndex
+from chat_store import dialog_pairs, dialog_preview, dialog_record, open_chat_store
+from config import get_config
+from course_retrieval import BM25Retriever, format_course_context
+from instrumentation import record_retry
+from llm_parse import decode_json_object, json_schema_format, parse_evaluation_record, parse_records, parse_score
+from mastery import MasteryTracker
+from question_bank import DEFAULT_EXAM_LAYOUT, QUESTION_TYPES, get_question_bank, validate_question
+from review_scheduler import RESULT_QUALITY, ReviewScheduler, grade_locally
+from speculative_grading import SpeculativeGrader
+from storage import read_json, remove_file, update_json
+from usage_ledger import HistoryTokenCounter, QuotaExceededError, UsageLedger, count_message_tokens
+from wrong_dedup import build_wrong_question_index, cluster_wrong_questions, find_duplicate_wrong_question
+from write_behind import get_write_behind_queue
+
+# API keys are read from key.txt and the openai / dashscope / pyaudio SDKs are imported
+# on first use (see config.py), so importing this module stays cheap.
 
 # Global state for voice recognition thread communication
 # In a Gradio app, this might be better managed within a class instance
@@ -49,27 +32,38 @@ voice_recognition_queue = queue.Queue()
 voice_recognition_active = False
 voice_recognition_thread = None
 
-# Custom Callback class for ASR
-class BackendRecognitionCallback(RecognitionCallback):
-    """
-    Callback class to process ASR results and put final sentences into a queue.
-    """
-    def __init__(self, result_queue):
-        super().__init__()
-        self.result_queue = result_queue # Queue to communicate with main thread
-
-    def on_event(self, result: RecognitionResult) -> None:
-        """
-        Processes ASR result, puts final sentence into the queue.
-        """
-        try:
-            sentence = result.get_sentence()
-            if sentence and RecognitionResult.is_sentence_end(sentence):
-                text = sentence.get("text", "")
-                if text:
-                    self.result_queue.put(text) # Put result into the queue
-        except Exception as e:
-            print(f"Error processing recognition result in callback: {e}")
+_recognition_callback_class = None
+
+def get_recognition_callback_class():
+    """Defines the ASR callback class on first use (it subclasses a dashscope class)."""
+    global _recognition_callback_class
+    if _recognition_callback_class is None:
+        from dashscope.audio.asr import RecognitionCallback, RecognitionResult
+
+        # Custom Callback class for ASR
+        class BackendRecognitionCallback(RecognitionCallback):
+            """
+            Callback class to process ASR results and put final sentences into a queue.
+            """
+            def __init__(self, result_queue):
+                super().__init__()
+                self.result_queue = result_queue # Queue to communicate with main thread
+
+            def on_event(self, result: RecognitionResult) -> None:
+                """
+                Processes ASR result, puts final sentence into the queue.
+                """
+                try:
+                    sentence = result.get_sentence()
+                    if sentence and RecognitionResult.is_sentence_end(sentence):
+                        text = sentence.get("text", "")
+                        if text:
+                            self.result_queue.put(text) # Put result into the queue
+                except Exception as e:
+                    print(f"Error processing recognition result in callback: {e}")
+
+        _recognition_callback_class = BackendRecognitionCallback
+    return _recognition_callback_class
 
 def run_recognition(result_queue):
     """
@@ -83,10 +77,15 @@ def run_recognition(result_queue):
     recognition = None
 
     try:
+        # The audio and speech SDKs are only needed once 语音输入 is pressed
+        import pyaudio
+        get_config().load_dashscope()
+        from dashscope.audio.asr import Recognition
+
         mic = pyaudio.PyAudio()
         stream = mic.open(format=pyaudio.paInt16, channels=1, rate=16000, input=True, frames_per_buffer=3200)
 
-        callback = BackendRecognitionCallback(result_queue)
+        callback = get_recognition_callback_class()(result_queue)
 
         recognition = Recognition(
             model="paraformer-realtime-v2",
@@ -169,103 +168,329 @@ def get_voice_recognition_result():
     except queue.Empty:
         return None # Queue is empty
 
+# --- Structured output (response_format) schemas ---
+_QUESTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "type": {"type": "string", "enum": list(QUESTION_TYPES)},
+        "description": {"type": "string"},
+        "option": {"type": "string"},
+        "answer": {"type": "string"},
+        "explanation": {"type": "string"},
+    },
+    "required": ["type", "description", "option", "answer", "explanation"],
+    "additionalProperties": False,
+}
+EXAM_QUESTIONS_SCHEMA = {
+    "type": "object",
+    "properties": {"questions": {"type": "array", "items": _QUESTION_SCHEMA}},
+    "required": ["questions"],
+    "additionalProperties": False,
+}
+EVALUATION_SCHEMA = {
+    "type": "object",
+    "properties": {"score": {"type": "integer"}, "reason": {"type": "string"}},
+    "required": ["score", "reason"],
+    "additionalProperties": False,
+}
+
+# --- Per-user data layout ---
+DEFAULT_USER_ID = "default" # Keeps the legacy files in the working directory
+USER_DATA_ROOT = os.path.join("data", "users")
+USER_ID_PATTERN = re.compile(r"^[A-Za-z0-9_\-\u4e00-\u9fff]{1,64}$")
+
+def get_user_data_dir(user_id, root=USER_DATA_ROOT):
+    """
+    Returns the directory holding one user's records: <root>/<shard>/<user_id>, where
+    shard is the first two hex digits of sha1(user_id). The 256 shards keep every
+    directory small however many users enroll.
+    """
+    if not USER_ID_PATTERN.match(user_id):
+        raise ValueError(f"无效的用户ID: {user_id!r}（仅允许字母、数字、下划线、连字符和汉字，最长64个字符）")
+    shard = hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:2]
+    return os.path.join(root, shard, user_id)
+
+# Identifies one conversation / one exam paper for write-behind coalescing
+_session_tokens = itertools.count(1)
+# Key under which a new conversation still queued on the flusher is listed until it gets its dialogN key
+PENDING_DIALOG_PREFIX = "pending-"
+
 # --- Core Logic Class (extracted from App) ---
 class AppLogic:
-    def __init__(self):
-        self.chat_record_path = "discuss.json"
-        self.wrong_question_path = "wrong.json"
+    def __init__(self, user_id=None):
+        # Every per-student file lives in the user's shard; the default user keeps the old paths
+        self.user_id = user_id or DEFAULT_USER_ID
+        self.data_dir = "" if self.user_id == DEFAULT_USER_ID else get_user_data_dir(self.user_id)
+        if self.data_dir:
+            os.makedirs(self.data_dir, exist_ok=True)
+        self.chat_record_path = os.path.join(self.data_dir, "discuss.json")
+        self.wrong_question_path = os.path.join(self.data_dir, "wrong.json")
         self.conversation_history = []
         self.user_answers = {}
         self.evaluation_results = {}
         self.current_dialog_key = None
         self.exam_questions = [] # Store generated exam questions
+        self.chat_search_index = None # Built lazily on the first search, then kept in sync on save/delete
+        self.chat_storage_backend = "journal" # A chat_store.CHAT_STORE_BACKENDS key; saves append only their new turns
+        self.chat_store = None # Opened lazily with chat_storage_backend
+        self.persisted_turns = {} # dialog_key -> turns already written by this instance (the watermark)
+        self.wrong_dedup_index = None # MinHash/LSH index over wrong question descriptions, built lazily
+        self.wrong_book = None # Resident copy of wrong.json, reread only when the file changes (see _get_wrong_book)
+        self.wrong_book_signature = None # (mtime_ns, size) of wrong.json matching wrong_book
+        self.course_index_dir = "course_index" # Written by `python course_retrieval.py ingest`
+        self.retrieval_top_k = 3 # Course chunks added to the prompt per teaching turn
+        self.course_retriever = None # Opened lazily on the first teaching turn
+        self.last_retrieval_ms = None # Retrieval latency of the most recent turn
+        self.question_bank_path = "question_bank.json" # Shared by all users
+        self.question_bank = None # Process-wide QuestionBank, looked up on the first exam
+        self.exam_layout = dict(DEFAULT_EXAM_LAYOUT) # Questions per type in an exam
+        self.question_bank_max_uses = 3 # A bank question stops being served after this many exams
+        self.question_bank_top_up_rounds = 3 # LLM calls to fill a bank shortage when replies repeat questions on the paper
+        self.structured_output = True # Ask for schema-constrained JSON; turned off if the endpoint rejects it
+        self.exam_generation_retries = 2 # Extra LLM calls for questions missing from a generation reply
+        self.wrong_topic_index = WrongTopicIndex() # Cached topic tags of wrong.json entries
+        self.weak_topic_cache = None # (mtime_ns, size, weights) of the last wrong.json aggregated
+        self.adaptive_exam_layout = dict(ADAPTIVE_EXAM_LAYOUT)
+        self.adaptive_max_topics = 3 # Weak topics named in a targeted generation prompt
+        self.adaptive_prompt_char_budget = 300 # Characters of wrong question examples in that prompt
+        self.review_schedule_path = os.path.join(self.data_dir, "review_schedule.json")
+        self.review_scheduler = None # SM-2 schedule of the wrong book, loaded lazily
+        self.review_session_limit = 20 # Due questions drilled per review session
+        self.mastery_path = os.path.join(self.data_dir, "mastery.json")
+        self.mastery_tracker = None # Per-topic knowledge tracing estimates, loaded lazily
+        self.write_behind = get_write_behind_queue() # Background flusher for the *_later saves
+        self.dialog_token = next(_session_tokens) # Current conversation, changes on reset/load
+        self.dialog_keys_by_token = {} # Dialog key assigned by the flusher to each conversation
+        self.exam_token = next(_session_tokens) # Current exam paper
+        self.pending_dialogs = {} # dialog_token -> (dialog key at submit, conversation snapshot) queued, not yet written
+        self.pending_wrong_exams = {} # exam_token -> (questions, evaluation_results) queued, not yet written
+        # The write-behind flusher updates the state above and persisted_turns, current_dialog_key,
+        # dialog_keys_by_token and chat_search_index; _state_lock guards it and is never held across I/O
+        self._state_lock = threading.RLock()
+        self._wrong_book_lock = threading.RLock() # Serializes wrong book writers (dedup index, review schedule)
+        self.speculative_grading = False # Grade fill-in/short answers in the background once the student moves on
+        self.speculative_grading_delay = 3.0 # Seconds an answer must stay unchanged before it is graded
+        self.speculative_grader = None # SpeculativeGrader of the current exam, created on first use
+        self.usage_ledger = UsageLedger(os.path.join(self.data_dir, "usage.json")) # Token totals, quotas and max_tokens per call site
+        self.history_tokens = HistoryTokenCounter() # Prompt tokens of conversation_history, counted once per message
+
+    def _chat_completion(self, messages, call_site="chat", prompt_tokens=None, **kwargs):
+        """
+        Calls gpt-4o with the given messages and returns the reply text. The call is
+        timed and its token usage recorded under call_site (chat, generation, grading)
+        in usage_ledger, which also sets max_tokens and raises QuotaExceededError
+        instead of calling once a quota is used up. prompt_tokens is the token count
+        of messages if the caller keeps one.
+        """
+        openai = get_config().load_openai()
+        response = self.usage_ledger.metered_completion(
+            call_site,
+            openai.ChatCompletion.create,
+            messages,
+            prompt_tokens,
+            model="gpt-4o",
+            **kwargs
+        )
+        return response['choices'][0]['message']['content']
+
+    def _get_course_retriever(self):
+        """Opens the course material BM25 index if it has been ingested, else returns None."""
+        if self.course_retriever is None and os.path.exists(os.path.join(self.course_index_dir, "lexicon.json")):
+            try:
+                self.course_retriever = BM25Retriever(self.course_index_dir)
+            except Exception as e:
+                print(f"Error opening course index: {e}")
+        return self.course_retriever
+
+    def retrieve_course_context(self, query):
+        """
+        Returns a system message with the top-k course chunks relevant to query,
+        or None if no course index exists or nothing matched.
+        """
+        retriever = self._get_course_retriever()
+        if retriever is None:
+            return None
+        chunks, elapsed_ms = retriever.search(query, top_k=self.retrieval_top_k)
+        self.last_retrieval_ms = elapsed_ms
+        print(f"Course retrieval: {len(chunks)} chunks in {elapsed_ms:.2f} ms")
+        if not chunks:
+            return None
+        return format_course_context(chunks)
+
+    def send_message(self, user_input):
+        """
+        Teaching mode turn: appends the user message, asks gpt-4o and appends the reply.
+        Only the chunks retrieved for this turn are sent along as a system message;
+        they are not stored in conversation_history, so saved dialogs keep their Q/A layout
+        and the prompt does not grow with every turn's context.
+        Returns (assistant_message, None) or (error_message, error).
+        """
+        self.conversation_history.append({"role": "user", "content": user_input})
+        context = []
+        weak_topics = self.get_weakest_topics()
+        if weak_topics:
+            context.append({"role": "system", "content": f"该学生目前掌握较弱的知识点：{'、'.join(weak_topics)}。讲解涉及这些知识点时请更详细地说明原理。"})
+        try:
+            course_context = self.retrieve_course_context(user_input)
+        except Exception as e:
+            print(f"Error retrieving course context: {e}")
+            course_context = None
+        if course_context:
+            context.append({"role": "system", "content": course_context})
+        messages = context + self.conversation_history
+        # Only this turn's messages are tokenized; the history's count is kept from earlier turns
+        prompt_tokens = count_message_tokens(context) + self.history_tokens.count(self.conversation_history)
+
+        try:
+            assistant_message = self._chat_completion(messages, prompt_tokens=prompt_tokens)
+            error = None
+        except QuotaExceededError as e:
+            assistant_message = f"Error: {e}"
+            error = str(e)
+        except Exception as e:
+            print(f"Error calling OpenAI for chat: {e}")
+            assistant_message = f"Error: 调用 OpenAI API 出错: {e}"
+            error = str(e)
+        self.conversation_history.append({"role": "assistant", "content": assistant_message})
+        return assistant_message, error
 
     def save_chat_history(self):
         """Saves current conversation history to a JSON file."""
         if not self.conversation_history:
             print("No conversation history to save.")
             return
-
+        self._flush_pending_writes(self.chat_record_path)
+        dialog_key, message = self._write_dialog(self.current_dialog_key, self.conversation_history)
+        if dialog_key:
+            with self._state_lock:
+                self.current_dialog_key = dialog_key
+        return message
+
+    def save_chat_history_later(self):
+        """
+        Queues a save of a snapshot of the current conversation on the write-behind
+        flusher and returns at once. Repeated saves of the same conversation before
+        the flusher gets to it are written once.
+        """
+        if not self.conversation_history:
+            return
+        history = [dict(message) for message in self.conversation_history]
+        with self._state_lock:
+            token = self.dialog_token
+            start_key = self.current_dialog_key
+            pending = self.pending_dialogs[token] = (start_key, history) # Listed by the history view until written
+
+        def persist():
+            with self._state_lock:
+                dialog_key = self.dialog_keys_by_token.get(token, start_key)
+            dialog_key, _ = self._write_dialog(dialog_key, history)
+            with self._state_lock:
+                if self.pending_dialogs.get(token) is pending: # Not replaced by a newer snapshot meanwhile
+                    del self.pending_dialogs[token]
+                if dialog_key:
+                    self.dialog_keys_by_token[token] = dialog_key
+                    if self.dialog_token == token: # Still the same conversation in the UI
+                        self.current_dialog_key = dialog_key
+
+        self.write_behind.submit((self.chat_record_path, token), persist)
+
+    def _flush_pending_writes(self, path):
+        """Waits for queued write-behind saves of one file, so a read sees them."""
+        self.write_behind.flush(lambda key: key[0] == path)
+
+    def _write_dialog(self, current_dialog_key, conversation_history):
+        """
+        Writes one conversation under current_dialog_key (a new dialogN key if None or gone).
+        Only the turns after the dialog's persisted-turn watermark are written; earlier
+        turns are never re-serialized. Returns (dialog_key, message); dialog_key is None
+        if the write failed.
+        """
         try:
-            # Load existing records
-            if os.path.exists(self.chat_record_path):
-                with open(self.chat_record_path, "r", encoding="utf-8") as file:
-                    existing_data = json.load(file)
-            else:
-                existing_data = {}
-
-            # Determine dialog key
-            if not self.current_dialog_key or self.current_dialog_key not in existing_data:
-                 # Create new dialogue record if it's a new conversation or key doesn't exist
-                 # Find the next available dialog key
-                 dialog_num = 1
-                 while f"dialog{dialog_num}" in existing_data:
-                     dialog_num += 1
-                 dialog_key = f"dialog{dialog_num}"
-                 dialog_data = {"num": 0}
-                 self.current_dialog_key = dialog_key
-                 existing_data[dialog_key] = dialog_data
-            else:
-                 # Get current dialogue record
-                 dialog_key = self.current_dialog_key
-                 dialog_data = existing_data.get(dialog_key, {"num": 0}) # Should exist if key is in existing_data
-
-
-            # Append current conversation content
-            existing_num = dialog_data["num"]
-            # Only save new entries not already in the loaded dialog_data
-            # We assume conversation_history contains the full history
-            # Let's find where the new entries start.
-            # This part needs careful logic if you are *continuing* a loaded conversation.
-            # A simpler approach is to overwrite the dialog with the current self.conversation_history
-            # or carefully append only truly *new* entries.
-            # Let's simplify: just save the current conversation_history under the key.
-            # This means if you load a chat and add to it, saving will replace the old entry.
-            # A more robust approach would track what's new.
-            # For simplicity, let's just save the current state under the key.
-
-            dialog_data_to_save = {"num": len(self.conversation_history) // 2} # Assuming Q, A pairs
-            for i in range(len(self.conversation_history) // 2):
-                # Ensure conversation_history structure is as expected
-                if i * 2 < len(self.conversation_history) and self.conversation_history[i*2]["role"] == "user":
-                     dialog_data_to_save[f"Q{i + 1}"] = self.conversation_history[i * 2]["content"]
-                if i * 2 + 1 < len(self.conversation_history) and self.conversation_history[i*2 + 1]["role"] == "assistant":
-                     dialog_data_to_save[f"A{i + 1}"] = self.conversation_history[i * 2 + 1]["content"]
-
-            existing_data[dialog_key] = dialog_data_to_save
-
-
-            # Save to file
-            with open(self.chat_record_path, "w", encoding="utf-8") as file:
-                json.dump(existing_data, file, ensure_ascii=False, indent=4)
-            print(f"Chat history saved to {self.chat_record_path}")
-            return "聊天记录已保存。"
+            pairs = dialog_pairs(conversation_history)
+            with self._state_lock:
+                persisted = self.persisted_turns.get(current_dialog_key, 0) if current_dialog_key else 0
+            dialog_key, fields = self._get_chat_store().append_turns(current_dialog_key, pairs, persisted)
+            print(f"Chat history saved to {self.chat_record_path} ({len(fields)} new fields)")
+            with self._state_lock:
+                self.persisted_turns[dialog_key] = len(pairs)
+                if self.chat_search_index is not None:
+                    if dialog_key != current_dialog_key:
+                        self.chat_search_index.remove_dialog(dialog_key) # Stale turns of a reused key
+                    self.chat_search_index.index_turns(dialog_key, fields)
+            return dialog_key, "聊天记录已保存。"
 
         except Exception as e:
             print(f"Error saving chat history: {e}")
-            return f"保存聊天记录出错: {e}"
+            return None, f"保存聊天记录出错: {e}"
+
+    def _get_chat_store(self):
+        if self.chat_store is None:
+            self.chat_store = open_chat_store(self.chat_record_path, self.chat_storage_backend)
+        return self.chat_store
+
+    def close(self):
+        """
+        Ends the session: waits for its queued chat saves and folds the chat journal
+        into discuss.json, so programs reading that file directly see every turn.
+        """
+        self._flush_pending_writes(self.chat_record_path)
+        try:
+            self._get_chat_store().compact()
+        except Exception as e:
+            print(f"Error compacting chat history: {e}")
+
+    def _pending_dialog_entries(self):
+        """
+        {dialog_key: dialog} of the conversations queued on the flusher, as they will be
+        stored. One that has no dialogN key yet is listed as PENDING_DIALOG_PREFIX + token.
+        """
+        with self._state_lock:
+            return {self.dialog_keys_by_token.get(token, start_key) or f"{PENDING_DIALOG_PREFIX}{token}":
+                    dialog_record(dialog_pairs(history))
+                    for token, (start_key, history) in self.pending_dialogs.items()}
+
+    def _pending_dialog_token(self, dialog_key):
+        """The dialog_token of a queued conversation listed under dialog_key, or None. Call with _state_lock held."""
+        for token, (start_key, _) in self.pending_dialogs.items():
+            if dialog_key in (f"{PENDING_DIALOG_PREFIX}{token}", self.dialog_keys_by_token.get(token, start_key)):
+                return token
+        return None
+
+    def _resolve_dialog_key(self, dialog_key):
+        """The stored key of a dialog listed under a pending key, once the flusher has written it."""
+        if dialog_key and dialog_key.startswith(PENDING_DIALOG_PREFIX):
+            token = int(dialog_key[len(PENDING_DIALOG_PREFIX):])
+            with self._state_lock:
+                return self.dialog_keys_by_token.get(token)
+        return dialog_key
 
     def load_chat_history_list(self):
-        """Loads chat history list for display."""
+        """
+        Loads chat history list for display: [(dialog_key, first_question_preview)] and
+        the dialogs held in memory. Only the previews are read from the store (from the
+        record summaries with the snapshot backend); dialogs are read by key when opened.
+        Conversations still queued on the write-behind flusher are shown from memory
+        instead of waiting for their write.
+        """
         try:
-            if os.path.exists(self.chat_record_path):
-                with open(self.chat_record_path, "r", encoding="utf-8") as file:
-                    chat_data = json.load(file)
-                # Prepare data for display: list of (dialog_key, first_question_preview)
-                history_list = []
-                for dialog_key, dialog_content in chat_data.items():
-                    first_question = dialog_content.get("Q1", "无提问内容")[:30] # Preview
-                    history_list.append((dialog_key, first_question))
-                return history_list, chat_data # Return list for display and full data for detail lookup
-            else:
-                return [], {} # No file, return empty list and data
+            pending = self._pending_dialog_entries() # Taken first: a dialog written meanwhile is then listed by the store
+            previews = dict(self._get_chat_store().list_dialogs())
+            pending = {dialog_key: dialog for dialog_key, dialog in pending.items()
+                       if self._resolve_dialog_key(dialog_key) in (dialog_key, None)} # Not stored under its dialogN key by now
+            for dialog_key, dialog in pending.items():
+                previews[dialog_key] = dialog_preview(dialog)
+            return list(previews.items()), pending
         except (json.JSONDecodeError, FileNotFoundError) as e:
             print(f"Error loading chat history list: {e}")
             return [], {} # Return empty on error
 
     def load_chat_detail(self, chat_data, dialog_key):
-         """Loads detailed conversation for a given dialog key."""
-         dialog = chat_data.get(dialog_key, {})
+         """Loads detailed conversation for a given dialog key (read by key from the store if chat_data is empty)."""
+         dialog = self._pending_dialog_entries().get(dialog_key) or (chat_data or {}).get(dialog_key)
+         if not dialog:
+             self._flush_pending_writes(self.chat_record_path)
+             stored_key = self._resolve_dialog_key(dialog_key)
+             dialog = (self._get_chat_store().load_dialog(stored_key) if stored_key else None) or {}
          if not dialog:
              return None, "未找到指定对话"
 
@@ -277,25 +502,36 @@ class AppLogic:
              if f"A{i}" in dialog:
                  conversation.append({"role": "assistant", "content": dialog[f"A{i}"]})
 
-         self.current_dialog_key = dialog_key # Set current key if continuing
-         self.conversation_history = conversation # Load history for continuation
+         with self._state_lock:
+             token = self._pending_dialog_token(dialog_key)
+             if token is not None:
+                 # Still queued: continuing it must go on with the same write-behind save
+                 start_key, _ = self.pending_dialogs[token]
+                 self.dialog_token = token
+                 self.current_dialog_key = self.dialog_keys_by_token.get(token, start_key)
+             else:
+                 self.current_dialog_key = self._resolve_dialog_key(dialog_key) # Set current key if continuing
+                 self.persisted_turns[self.current_dialog_key] = dialog.get("num", 0) # Continuing appends after the stored turns
+                 self.dialog_token = next(_session_tokens)
+             self.conversation_history = conversation # Load history for continuation
 
          return conversation, None # Return conversation list and no error message
 
     def delete_chat_record(self, dialog_key):
         """Deletes a specific chat record."""
+        self._flush_pending_writes(self.chat_record_path)
         try:
-            if os.path.exists(self.chat_record_path):
-                with open(self.chat_record_path, "r", encoding="utf-8") as file:
-                    chat_data = json.load(file)
-            else:
+            if not self._get_chat_store().exists():
                 return "聊天记录文件不存在。"
 
-            if dialog_key in chat_data:
-                del chat_data[dialog_key]
+            stored_key = self._resolve_dialog_key(dialog_key)
+            found = bool(stored_key) and self._get_chat_store().delete_dialog(stored_key)
 
-                with open(self.chat_record_path, "w", encoding="utf-8") as file:
-                    json.dump(chat_data, file, ensure_ascii=False, indent=4)
+            if found:
+                with self._state_lock:
+                    self.persisted_turns.pop(stored_key, None)
+                    if self.chat_search_index is not None:
+                        self.chat_search_index.remove_dialog(stored_key)
                 return f"聊天记录 '{dialog_key}' 已删除。"
             else:
                 return f"未找到指定聊天记录 '{dialog_key}'。"
@@ -304,67 +540,142 @@ class AppLogic:
             return f"删除聊天记录时出错: {e}"
 
 
+    def search_chat_history(self, query, limit=10):
+        """
+        Full-text search over all Q/A turns in the chat history.
+        Returns (results, None) or ([], error). Each result has dialog_key, score,
+        and snippets: list of {"field", "start", "end", "text"} (offsets into that turn).
+        """
+        if not query or not query.strip():
+            return [], "请输入搜索内容。"
+        try:
+            if self.chat_search_index is None:
+                self._flush_pending_writes(self.chat_record_path) # Index stored turns only; later saves add theirs
+                chat_data = self._get_chat_store().load_all()
+                with self._state_lock:
+                    if self.chat_search_index is None:
+                        self.chat_search_index = ChatSearchIndex().build(chat_data)
+            with self._state_lock:
+                results, elapsed_ms = self.chat_search_index.search(query, limit=limit)
+                for result in results:
+                    for snippet in result["snippets"]:
+                        snippet["text"] = self.chat_search_index.snippet_text(result["dialog_key"], snippet)
+            print(f"Chat search '{query}': {len(results)} dialogs in {elapsed_ms:.2f} ms")
+            return results, None
+        except Exception as e:
+            print(f"Error searching chat history: {e}")
+            return [], f"搜索聊天记录出错: {e}"
+
+
     def save_wrong_questions(self):
         """Saves accumulated wrong questions to a JSON file."""
         if not self.evaluation_results:
             print("No evaluation results to save wrong questions from.")
             return
+        self._flush_pending_writes(self.wrong_question_path)
+        return self._write_wrong_questions(self.exam_questions, self.evaluation_results, self.user_answers)
+
+    def save_wrong_questions_later(self):
+        """
+        Queues a save of the current exam's wrong questions on the write-behind flusher
+        and returns at once. Saving the same exam again before it is written is coalesced.
+        """
+        if not self.evaluation_results:
+            return
+        exam_questions = list(self.exam_questions)
+        evaluation_results = dict(self.evaluation_results)
+        user_answers = dict(self.user_answers)
+        token = self.exam_token
+        with self._state_lock:
+            pending = self.pending_wrong_exams[token] = (exam_questions, evaluation_results)
+
+        def persist():
+            try:
+                self._write_wrong_questions(exam_questions, evaluation_results, user_answers)
+            finally:
+                with self._state_lock:
+                    if self.pending_wrong_exams.get(token) is pending:
+                        del self.pending_wrong_exams[token]
+
+        self.write_behind.submit((self.wrong_question_path, token), persist)
+
+    def _write_wrong_questions(self, exam_questions, evaluation_results, user_answers):
+        """Merges the wrong answers of one graded exam into the wrong book. Returns a message."""
 
         try:
-            if os.path.exists(self.wrong_question_path):
-                with open(self.wrong_question_path, "r", encoding="utf-8") as file:
-                    existing_data = json.load(file)
-            else:
-                existing_data = {}
-
-            # Determine starting index for new questions
-            # Find the max key (assuming keys are strings of integers)
-            next_key_num = 1
-            if existing_data:
-                 try:
-                     max_key = max(int(k) for k in existing_data.keys())
-                     next_key_num = max_key + 1
-                 except ValueError:
-                     # Handle cases where keys are not integers or file is empty but not {}
-                     pass # Start from 1
-
-            new_wrong_count = 0
-            for index, evaluation in self.evaluation_results.items():
-                # Ensure index is valid for exam_questions list
-                if 0 <= index < len(self.exam_questions):
-                    question = self.exam_questions[index]
-                    # Check if the question result indicates it was wrong or partially correct
-                    # In original, it was only != "正确". Let's keep that logic.
-                    if evaluation.get("result") != "正确":
-                        # Check if this question (by description+type) might already be in wrong book
-                        # Simple check by description preview - might not be robust
-                        is_duplicate = False
-                        current_q_desc = question["description"]
-                        for existing_q in existing_data.values():
-                            if existing_q.get("description") == current_q_desc and existing_q.get("type") == question["type"]:
-                                # Found a potential duplicate based on description and type
-                                is_duplicate = True
-                                break # Stop checking existing entries for this question
-
-                        if not is_duplicate:
-                            existing_data[str(next_key_num)] = {
-                                "type": question["type"],
-                                "description": question["description"],
-                                "options": question.get("option", ""),
-                                "answer": question["answer"],
-                                "user_answer": self.user_answers.get(index, ""),
-                                "explanation": question.get("explanation", "") # Save explanation from evaluation if available
-                            }
-                            next_key_num += 1
-                            new_wrong_count += 1
-                        else:
-                             print(f"Skipping saving potential duplicate wrong question: {question['description'][:20]}...")
-
-
-            if new_wrong_count > 0:
-                with open(self.wrong_question_path, "w", encoding="utf-8") as file:
-                    json.dump(existing_data, file, ensure_ascii=False, indent=4)
-                print(f"Saved {new_wrong_count} new wrong questions to {self.wrong_question_path}")
+            # The wrong book stays locked from reading it until the merged entries are written
+            with self._wrong_book_lock, update_json(self.wrong_question_path) as doc:
+                existing_data = doc.data
+
+                # Determine starting index for new questions
+                # Find the max key (assuming keys are strings of integers)
+                next_key_num = 1
+                if existing_data:
+                     try:
+                         max_key = max(int(k) for k in existing_data.keys())
+                         next_key_num = max_key + 1
+                     except ValueError:
+                         # Handle cases where keys are not integers or file is empty but not {}
+                         pass # Start from 1
+
+                # Near-duplicate lookup goes through the LSH index instead of scanning every entry.
+                # Rebuild it if it was never built or the file changed underneath us.
+                if self.wrong_dedup_index is None or len(self.wrong_dedup_index) != len(existing_data):
+                    self.wrong_dedup_index = build_wrong_question_index(existing_data)
+
+                new_wrong_count = 0
+                merged_count = 0
+                scheduled_keys = [] # (key, answered wrong again) for the review schedule
+                for index, evaluation in evaluation_results.items():
+                    # Ensure index is valid for exam_questions list
+                    if 0 <= index < len(exam_questions):
+                        question = exam_questions[index]
+                        # Check if the question result indicates it was wrong or partially correct
+                        # In original, it was only != "正确". Let's keep that logic.
+                        if evaluation.get("result") != "正确":
+                            # Rewordings of a question already in the wrong book (similar description, same
+                            # type, answer and options) are merged into that entry with an occurrence count
+                            # instead of being added again; the stored wording and options are kept
+                            duplicate_key = find_duplicate_wrong_question(self.wrong_dedup_index, existing_data, question)
+
+                            if duplicate_key is None:
+                                existing_data[str(next_key_num)] = {
+                                    "type": question["type"],
+                                    "description": question["description"],
+                                    "options": question.get("option", ""),
+                                    "answer": question["answer"],
+                                    "user_answer": user_answers.get(index, ""),
+                                    "explanation": question.get("explanation", ""), # Save explanation from evaluation if available
+                                    "count": 1 # Occurrences of this question (and its near-duplicates)
+                                }
+                                self.wrong_dedup_index.add(str(next_key_num), question["description"])
+                                scheduled_keys.append((str(next_key_num), False))
+                                next_key_num += 1
+                                new_wrong_count += 1
+                            else:
+                                duplicate = existing_data[duplicate_key]
+                                duplicate["count"] = duplicate.get("count", 1) + 1
+                                # Same answer and options, so the latest wrong answer fits the stored question
+                                duplicate["user_answer"] = user_answers.get(index, "")
+                                scheduled_keys.append((duplicate_key, True))
+                                merged_count += 1
+                                print(f"Merged wrong question into near-duplicate '{duplicate_key}': {question['description'][:20]}...")
+
+                if new_wrong_count == 0 and merged_count == 0:
+                    doc.discard()
+            self._remember_wrong_book(existing_data)
+
+            if new_wrong_count > 0 or merged_count > 0:
+                print(f"Saved {new_wrong_count} new wrong questions ({merged_count} merged) to {self.wrong_question_path}")
+                scheduler = self._get_review_scheduler(existing_data)
+                for key, relapsed in scheduled_keys:
+                    if relapsed:
+                        scheduler.lapse(key)
+                    else:
+                        scheduler.add(key)
+                scheduler.flush_changes()
+                if merged_count > 0:
+                    return f"已保存 {new_wrong_count} 道错题，合并 {merged_count} 道相似错题。"
                 return f"已保存 {new_wrong_count} 道错题。"
             else:
                  print("No new wrong questions to save.")
@@ -376,19 +687,69 @@ class AppLogic:
             return f"保存错题时出错: {e}"
 
 
+    def _remember_wrong_book(self, wrong_data):
+        """Makes wrong_data, just written to wrong.json, the resident copy."""
+        try:
+            stat = os.stat(self.wrong_question_path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            wrong_data, signature = None, None
+        with self._state_lock:
+            self.wrong_book, self.wrong_book_signature = wrong_data, signature
+
+    def _get_wrong_book(self):
+        """
+        The resident copy of wrong.json, reread only when the file changed on disk
+        (e.g. another session of the same user wrote it). None if there is no file.
+        Callers must not modify it: writers replace it through _remember_wrong_book.
+        """
+        try:
+            stat = os.stat(self.wrong_question_path)
+        except FileNotFoundError:
+            with self._state_lock:
+                self.wrong_book, self.wrong_book_signature = None, None
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._state_lock:
+            if self.wrong_book is not None and self.wrong_book_signature == signature:
+                return self.wrong_book
+        wrong_data = read_json(self.wrong_question_path, default=dict)
+        with self._state_lock:
+            self.wrong_book, self.wrong_book_signature = wrong_data, signature
+        return wrong_data
+
     def load_wrong_questions(self):
         """Loads all wrong questions from the JSON file."""
+        self._flush_pending_writes(self.wrong_question_path)
         try:
-            if os.path.exists(self.wrong_question_path):
-                with open(self.wrong_question_path, "r", encoding="utf-8") as file:
-                    wrong_data = json.load(file)
-                return wrong_data, None # Return data and no error
+            wrong_data = self._get_wrong_book()
+            if wrong_data is not None:
+                return dict(wrong_data), None # Return data and no error
             else:
                 return {}, "错题本文件不存在。" # No file, return empty data and message
         except (json.JSONDecodeError, FileNotFoundError) as e:
             print(f"Error loading wrong questions: {e}")
             return {}, f"加载错题本出错: {e}" # Return empty on error
 
+    def wrong_question_types(self):
+        """
+        Question types present in the wrong book, including the wrong answers of exams
+        still queued on the write-behind flusher. Served from memory without waiting for them.
+        """
+        try:
+            wrong_data = self._get_wrong_book() or {}
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Error loading wrong questions: {e}")
+            wrong_data = {}
+        types = {question.get("type") for question in wrong_data.values()}
+        with self._state_lock:
+            pending = list(self.pending_wrong_exams.values())
+        for exam_questions, evaluation_results in pending:
+            for index, evaluation in evaluation_results.items():
+                if evaluation.get("result") != "正确" and 0 <= index < len(exam_questions):
+                    types.add(exam_questions[index]["type"])
+        return types
+
 
     def load_wrong_questions_by_type(self, question_type):
         """Loads wrong questions filtered by type."""
@@ -404,16 +765,26 @@ class AppLogic:
 
     def delete_wrong_question(self, question_key):
         """Deletes a specific wrong question by key."""
+        self._flush_pending_writes(self.wrong_question_path)
         try:
-            wrong_data, error = self.load_wrong_questions()
-            if error:
-                return error # Return error if loading failed
-
-            if question_key in wrong_data:
-                del wrong_data[question_key]
-
-                with open(self.wrong_question_path, "w", encoding="utf-8") as file:
-                    json.dump(wrong_data, file, ensure_ascii=False, indent=4)
+            if not os.path.exists(self.wrong_question_path):
+                return "错题本文件不存在。"
+
+            with self._wrong_book_lock:
+                with update_json(self.wrong_question_path) as doc:
+                    wrong_data = doc.data
+                    found = wrong_data.pop(question_key, None) is not None
+                    if not found:
+                        doc.discard()
+                self._remember_wrong_book(wrong_data)
+
+                if found:
+                    if self.wrong_dedup_index is not None:
+                        self.wrong_dedup_index.remove(question_key)
+                    scheduler = self._get_review_scheduler(wrong_data)
+                    scheduler.remove(question_key)
+                    scheduler.flush_changes()
+            if found:
                 return f"错题 '{question_key}' 已删除。"
             else:
                 return f"未找到指定错题 '{question_key}'。"
@@ -423,75 +794,422 @@ class AppLogic:
 
     def clear_wrong_questions_file(self):
         """Deletes the wrong questions file."""
-        if os.path.exists(self.wrong_question_path):
-            os.remove(self.wrong_question_path)
+        self._flush_pending_writes(self.wrong_question_path)
+        self._flush_pending_writes(self.review_schedule_path)
+        with self._wrong_book_lock:
+            self.wrong_dedup_index = None
+            self._get_review_scheduler().delete_files()
+            self.review_scheduler = None
+            removed = remove_file(self.wrong_question_path)
+            self._remember_wrong_book(None)
+        if removed:
             return "错题本已清空。"
         return "错题本文件不存在，无需清空。"
 
-    def generate_exam_questions(self):
-        """Generates exam questions using OpenAI API."""
-        print("Generating exam questions...")
-        prompt = (
-            "请生成10道关于测试技术与传感器的题目，题目请不要过于简单，比如不要出类似于啥传感器能检测压力（压力传感器）之类的问题，即看题干就能出答案的，每道题目格式如下："
-            "{type='', description='', option='', answer='', explanation=''}。"
-            "其中包含4个选择题，4个填空题和2个简答题。"
+    def rebuild_wrong_book(self):
+        """Merges near-duplicate questions already in the wrong book (bulk MinHash/LSH clustering)."""
+        self._flush_pending_writes(self.wrong_question_path)
+        try:
+            if not os.path.exists(self.wrong_question_path):
+                return "错题本文件不存在。"
+
+            with self._wrong_book_lock:
+                with update_json(self.wrong_question_path) as doc:
+                    merged_data, merged_count = cluster_wrong_questions(doc.data)
+                    doc.data = merged_data
+                self._remember_wrong_book(merged_data)
+                self.wrong_dedup_index = build_wrong_question_index(merged_data)
+                scheduler = self._get_review_scheduler()
+                scheduler.sync(merged_data.keys()) # Drop the merged-away keys even if the sizes happen to match
+                scheduler.save()
+            return f"已合并 {merged_count} 道相似错题，剩余 {len(merged_data)} 道。"
+        except Exception as e:
+            print(f"Error rebuilding wrong book: {e}")
+            return f"整理错题本时出错: {e}"
+
+    def _get_review_scheduler(self, wrong_data=None):
+        """
+        Loads the review schedule on first use. When wrong_data is given and its size
+        differs from the schedule, entries are added/dropped to match its keys.
+        """
+        if self.review_scheduler is None:
+            self.review_scheduler = ReviewScheduler(self.review_schedule_path)
+        if wrong_data is not None and len(self.review_scheduler) != len(wrong_data):
+            self.review_scheduler.sync(wrong_data.keys())
+        return self.review_scheduler
+
+    def _save_review_schedule_later(self):
+        """Queues the rescheduled entries (not the whole schedule) for the write-behind flusher."""
+        self.write_behind.submit((self.review_schedule_path, "changes"), self._get_review_scheduler().flush_changes)
+
+    def start_review_session(self):
+        """
+        Returns (due_questions, error) where due_questions is a list of (key, question)
+        for up to review_session_limit wrong questions that are due, most overdue first.
+        """
+        # The wrong book and the schedule stay resident: a session start costs a stat of wrong.json
+        self._flush_pending_writes(self.wrong_question_path)
+        try:
+            wrong_data = self._get_wrong_book()
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Error loading wrong questions: {e}")
+            return [], f"加载错题本出错: {e}"
+        if wrong_data is None:
+            return [], "错题本文件不存在。"
+        scheduler = self._get_review_scheduler(wrong_data)
+        due = [(key, wrong_data[key]) for key in scheduler.due_keys(limit=self.review_session_limit) if key in wrong_data]
+        return due, None
+
+    def grade_review_answer(self, question_key, question, user_answer):
+        """
+        Grades one review answer and reschedules the question.
+        Choice and fill-in answers are graded locally; short answers go through the LLM.
+        Returns (evaluation, error) with evaluation {"result", "reason", "interval"}.
+        """
+        try:
+            result = grade_locally(question, user_answer)
+            if result is not None:
+                reason = "回答正确" if result == "正确" else f"回答错误，正确答案是 {question.get('answer', '')}"
+            else:
+                evaluation = self.grade_answer(question, user_answer)
+                if evaluation['result'] not in RESULT_QUALITY:
+                    return {}, evaluation['reason']
+                result, reason = evaluation['result'], evaluation['reason']
+
+            scheduler = self._get_review_scheduler()
+            if question_key not in scheduler.items:
+                scheduler.add(question_key)
+            item = scheduler.review(question_key, RESULT_QUALITY[result])
+            self._save_review_schedule_later()
+            return {"result": result, "reason": reason, "interval": item["interval"]}, None
+        except Exception as e:
+            print(f"Error grading review answer: {e}")
+            return {}, f"复习评分出错: {e}"
+
+    def _get_question_bank(self):
+        """The persistent question bank, one instance per process shared by all users."""
+        if self.question_bank is None:
+            self.question_bank = get_question_bank(self.question_bank_path)
+        return self.question_bank
+
+    def _build_exam_prompt(self, counts, topics=None, examples=None, structured=False):
+        """
+        Builds the question generation prompt for the given number of questions per type.
+        With structured=True the output format comes from EXAM_QUESTIONS_SCHEMA instead of examples.
+        """
+        total = sum(counts.values())
+        layout = "，".join(f"{count}个{question_type}题" for question_type, count in counts.items() if count > 0)
+        topic_hint = f"题目请围绕以下知识点：{'、'.join(topics)}。" if topics else ""
+        if examples:
+            topic_hint += "学生曾答错以下题目，请针对其中暴露的薄弱点出新题，不要照抄原题：" + "；".join(examples) + "。"
+        if structured:
+            format_hint = "以JSON返回，questions数组中每个元素是一道题目。"
+            format_examples = ""
+        else:
+            format_hint = "每道题目格式如下：{type='', description='', option='', answer='', explanation=''}。"
+            format_examples = (
+                "请按以下格式一道一道地显示题目：\n"
+                "{type=\"选择\", description=\"1+1=？\", option=\"A:1,B:2,C:3,D:4\", answer=\"B\", explanation=\"略\"}\n"
+                "{type=\"填空\", description=\"古诗补全：床前明月光，_______地上霜。\", option=\"None\", answer=\"疑是\", explanation=\"略\"}\n"
+                "{type=\"简答\", description=\"请说一说为什么压电晶体一压就会产生电？\", option=\"None\", answer=\"因为...\", explanation=\"略\"}"
+            )
+        return (
+            f"请生成{total}道关于测试技术与传感器的题目，题目请不要过于简单，比如不要出类似于啥传感器能检测压力（压力传感器）之类的问题，即看题干就能出答案的，"
+            f"{format_hint}"
+            f"其中包含{layout}。"
+            f"{topic_hint}"
             "请确保题目内容明确、精确，避免多义性。"
             "对于可能有多种答案的题目，请在题干中明确要求回答其中的一种，或指定特定的方向。"
             "type为选择、填空、简答三选一，description为题目的描述，"
             "option为选择题的四个选项格式为A:xxx，B:...，C:...，D:...，"
             "填空和简答回复None即可，answer为题目的答案，选择题给出正确的选项（A-D），"
             "填空题给出要填的答案，简答题给出答案，explanation为答案的解释。\n"
-            "请按以下格式一道一道地显示题目：\n"
-            "{type=\"选择\", description=\"1+1=？\", option=\"A:1,B:2,C:3,D:4\", answer=\"B\", explanation=\"略\"}\n"
-            "{type=\"填空\", description=\"古诗补全：床前明月光，_______地上霜。\", option=\"None\", answer=\"疑是\", explanation=\"略\"}\n"
-            "{type=\"简答\", description=\"请说一说为什么压电晶体一压就会产生电？\", option=\"None\", answer=\"因为...\", explanation=\"略\"}"
+            f"{format_examples}"
         )
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=[{"role": "system", "content": prompt}]
-            )
-            content = response['choices'][0]['message']['content']
-            print("Raw AI response for questions:", content)
-
-            # Parse the content string into a list of question dictionaries
-            formatted_content = re.sub(r'(\w+)=', r'"\1":', content) # Convert key=value to "key":value
-            # Handle potential trailing commas or extra characters outside {}
-            json_objects_str = ",".join(re.findall(r'(\{.*?\}),?', formatted_content, re.DOTALL))
-            json_array_str = f"[{json_objects_str}]"
-
-            # Attempt to parse as a JSON array
-            questions_list = json.loads(json_array_str)
-
-            # Basic validation for the number of questions
-            if len(questions_list) != 10:
-                print(f"Warning: Generated {len(questions_list)} questions instead of 10.")
 
-            # Basic validation for required keys in each question
-            valid_questions = []
-            required_keys = ["type", "description", "answer", "explanation"] # 'option' is optional for non-choice
+    def _structured_completion(self, build_messages, schema_name, schema, call_site):
+        """
+        Calls gpt-4o with a JSON schema response_format while structured_output is on.
+        build_messages(structured) returns the messages for either mode. Returns
+        (content, structured). An endpoint that rejects response_format switches this
+        instance back to the free-text formats.
+        """
+        if self.structured_output:
+            try:
+                return self._chat_completion(build_messages(True), call_site,
+                                             response_format=json_schema_format(schema_name, schema)), True
+            except Exception as e:
+                if "response_format" not in str(e) and "json_schema" not in str(e):
+                    raise
+                print(f"Endpoint rejected structured output, using the text format: {e}")
+                self.structured_output = False
+                record_retry(call_site)
+        return self._chat_completion(build_messages(False), call_site), False
+
+    def _request_questions(self, counts, topics=None, examples=None):
+        """One LLM call for the given number of questions per type. Returns the decoded question dicts."""
+        content, structured = self._structured_completion(
+            lambda structured: [{"role": "system", "content": self._build_exam_prompt(counts, topics, examples, structured)}],
+            "exam_questions", EXAM_QUESTIONS_SCHEMA, "generation",
+        )
+        print("Raw AI response for questions:", content)
+        data = decode_json_object(content) if structured else None
+        if data is not None and isinstance(data.get("questions"), list):
+            return [q for q in data["questions"] if isinstance(q, dict)]
+        # Parse the {key="value", ...} records into question dictionaries (prose around them is skipped)
+        return parse_records(content)
+
+    def _generate_questions_with_llm(self, counts, topics=None, examples=None):
+        """
+        Asks gpt-4o for the given number of questions per type. If some come back
+        missing or malformed, only those are requested again (at most
+        exam_generation_retries more calls). Returns (valid_questions, None) or ([], error).
+        """
+        missing = {question_type: count for question_type, count in counts.items() if count > 0}
+        valid_questions = []
+        for attempt in range(self.exam_generation_retries + 1):
+            print(f"Generating exam questions with LLM: {missing}")
+            if attempt:
+                record_retry("generation")
+            try:
+                questions_list = self._request_questions(missing, topics, examples)
+            except Exception as e:
+                print(f"Error generating or parsing exam questions: {e}")
+                if valid_questions:
+                    break # Keep what the earlier calls produced
+                return [], f"生成考题时出错: {e}"
+
+            # Basic validation for required keys in each question ('option' is required for '选择' only)
             for q in questions_list:
-                if all(key in q for key in required_keys) and q.get("type") in ["选择", "填空", "简答"]:
-                     # Additional check for 'option' in '选择' type
-                     if q["type"] == "选择" and "option" not in q:
-                          print(f"Skipping choice question due to missing 'option': {q.get('description', 'N/A')[:30]}...")
-                          continue
+                if validate_question(q):
                      valid_questions.append(q)
+                     if missing.get(q["type"], 0) > 0:
+                         missing[q["type"]] -= 1
                 else:
                      print(f"Skipping invalid question format: {q}")
+            missing = {question_type: count for question_type, count in missing.items() if count > 0}
+            if not missing:
+                break
+            print(f"Warning: {sum(missing.values())} questions missing after attempt {attempt + 1}: {missing}")
+        return valid_questions, None
+
+    def _top_up_with_llm(self, bank, questions, shortage, topics=None, examples=None):
+        """
+        Generates the questions the bank could not supply, adds them to the bank and
+        appends them to questions. A generated question the bank recognizes as one
+        already on the paper is skipped, and the rest of the shortage is asked for
+        again, up to question_bank_top_up_rounds calls.
+        Returns an error only if nothing could be generated.
+        """
+        missing = {question_type: count for question_type, count in shortage.items() if count > 0}
+        on_paper = {question["bank_id"] for question in questions if question.get("bank_id") is not None}
+        added = 0
+        for _ in range(self.question_bank_top_up_rounds):
+            generated, error = self._generate_questions_with_llm(missing, topics, examples)
+            if error:
+                return error if not added else None
+            bank_ids = bank.add_questions(generated)
+            for question, bank_id in zip(generated, bank_ids):
+                if bank_id is not None and bank_id not in on_paper and missing.get(question["type"], 0) > 0:
+                    questions.append(bank.as_exam_question(bank_id))
+                    on_paper.add(bank_id)
+                    missing[question["type"]] -= 1
+                    added += 1
+            missing = {question_type: count for question_type, count in missing.items() if count > 0}
+            if not missing:
+                break
+            print(f"Generated questions repeat the paper or fell short, still missing: {missing}")
+        return None
+
+    def _start_exam(self, bank, questions):
+        """Orders the paper, records bank usage and makes it the current exam."""
+        # Keep the usual paper order: choice, fill-in, short answer
+        questions.sort(key=lambda q: QUESTION_TYPES.index(q["type"]))
+        bank.record_usage(questions)
+        bank.save()
+
+        self.exam_questions = questions
+        self.exam_token = next(_session_tokens)
+        self.user_answers = {} # Reset user answers for a new exam
+        self.evaluation_results = {} # Reset evaluation results
+        self._close_speculative_grader()
+        print(f"Prepared {len(self.exam_questions)} valid questions.")
+        return self.exam_questions
+
+    def generate_exam_questions(self, topics=None):
+        """
+        Assembles an exam from the question bank. The LLM is only called to top up
+        the question types the bank cannot fill (too few questions, or all of them
+        already served question_bank_max_uses times); new questions go into the bank.
+        """
+        print("Generating exam questions...")
+        try:
+            bank = self._get_question_bank()
+            questions, shortage = bank.assemble_exam(self.exam_layout, topics=topics, max_uses=self.question_bank_max_uses)
+            print(f"Assembled {len(questions)} questions from the bank, missing: {shortage}")
 
+            if shortage:
+                error = self._top_up_with_llm(bank, questions, shortage, topics)
+                if error and not questions:
+                    self.exam_questions = []
+                    return [], error
 
-            self.exam_questions = valid_questions
-            self.user_answers = {} # Reset user answers for a new exam
-            self.evaluation_results = {} # Reset evaluation results
-            print(f"Generated and parsed {len(self.exam_questions)} valid questions.")
-            return self.exam_questions, None # Return questions list and no error
+            return self._start_exam(bank, questions), None # Return questions list and no error
 
         except Exception as e:
             print(f"Error generating or parsing exam questions: {e}")
             self.exam_questions = []
             return [], f"生成考题时出错: {e}" # Return empty list and error message
 
+    def _get_mastery_tracker(self):
+        """Loads the student's topic mastery estimates on first use."""
+        if self.mastery_tracker is None:
+            self.mastery_tracker = MasteryTracker(self.mastery_path)
+        return self.mastery_tracker
+
+    def get_weakest_topics(self, limit=3):
+        """Names of the observed topics the student has mastered least, weakest first."""
+        try:
+            return [topic for topic, _ in self._get_mastery_tracker().weakest_topics(limit)]
+        except Exception as e:
+            print(f"Error reading mastery data: {e}")
+            return []
+
+    def get_weak_topic_weights(self):
+        """
+        Returns ({topic: weight}, wrong_data) aggregated from the wrong book.
+        The weights are recomputed only when wrong.json changed on disk.
+        """
+        wrong_data, error = self.load_wrong_questions()
+        if error or not wrong_data:
+            return {}, {}
+        stat = os.stat(self.wrong_question_path)
+        if self.weak_topic_cache is None or self.weak_topic_cache[:2] != (stat.st_mtime_ns, stat.st_size):
+            weights = self.wrong_topic_index.weak_topic_weights(wrong_data)
+            self.weak_topic_cache = (stat.st_mtime_ns, stat.st_size, weights)
+        return self.weak_topic_cache[2], wrong_data
+
+    def generate_adaptive_exam(self):
+        """
+        Builds a short remediation exam on the student's weak topics, taken from the wrong
+        book and the topic mastery estimates.
+        Bank questions are sampled in proportion to topic weakness; only the shortfall is
+        generated, with a prompt limited to adaptive_max_topics topics and
+        adaptive_prompt_char_budget characters of wrong question examples.
+        Falls back to a regular exam when neither has anything to target.
+        """
+        print("Generating adaptive exam questions...")
+        try:
+            weights, wrong_data = self.get_weak_topic_weights()
+            # Knowledge tracing estimates count as much as the wrong book: topics the
+            # student has not mastered yet get a share proportional to 1 - mastery
+            unmastered = self._get_mastery_tracker().weakest_topics(limit=None)
+            gaps = sum(1 - p_known for _, p_known in unmastered)
+            if gaps:
+                blended = {topic: weight / 2 for topic, weight in weights.items()}
+                for topic, p_known in unmastered:
+                    blended[topic] = blended.get(topic, 0.0) + (1 - p_known) / gaps / (2 if weights else 1)
+                weights = blended
+            if not weights:
+                return self.generate_exam_questions()
+            topics = top_weak_topics(weights, self.adaptive_max_topics)
+            focus_weights = {topic: weights[topic] for topic in topics}
+            print(f"Weak topics: {focus_weights}")
+
+            bank = self._get_question_bank()
+            questions, shortage = assemble_weighted_exam(bank, self.adaptive_exam_layout, focus_weights, max_uses=self.question_bank_max_uses)
+            print(f"Sampled {len(questions)} questions from the bank, missing: {shortage}")
+
+            if shortage:
+                examples = wrong_question_examples(wrong_data, topics, self.adaptive_prompt_char_budget)
+                error = self._top_up_with_llm(bank, questions, shortage, topics, examples)
+                if error and not questions:
+                    self.exam_questions = []
+                    return [], error
+
+            return self._start_exam(bank, questions), None
+
+        except Exception as e:
+            print(f"Error generating adaptive exam questions: {e}")
+            self.exam_questions = []
+            return [], f"生成考题时出错: {e}"
+
+
+    def grade_answer(self, question, user_answer):
+        """
+        Grades one answer to one question. Choice questions are compared with the
+        answer key; fill-in and short answers are graded by GPT.
+        Returns the evaluation dict stored in evaluation_results.
+        """
+        question_type = question.get('type', '未知')
+        description = question.get('description', '无描述')
+        correct_answer = question.get('answer', '').strip()
+        user_answer = user_answer.strip()
+
+        evaluation = {
+            'result': '未作答', # Default
+            'score': 0,
+            'reason': '未作答',
+            'correct_answer': correct_answer,
+            'explanation': question.get('explanation', '')
+        }
+
+        if question_type == "选择":
+            if user_answer == correct_answer:
+                evaluation['result'] = "正确"
+                evaluation['score'] = 10 # Assuming 10 points per question
+                evaluation['reason'] = '回答正确'
+            else:
+                evaluation['result'] = "错误"
+                evaluation['score'] = 0
+                evaluation['reason'] = f'回答错误，正确答案是 {correct_answer}' # Provide correct answer
+        elif question_type in ["填空", "简答"]:
+             # Use GPT for evaluation for fill-in and short answer
+             try:
+                 evaluation_text = self.check_answer_with_gpt(question, user_answer)
+                 parsed_evaluation = self.parse_evaluation(evaluation_text)
+                 evaluation['score'] = parsed_evaluation.get('score', 0)
+                 evaluation['reason'] = parsed_evaluation.get('reason', '无法解析评分理由')
+
+                 # Determine result based on score for fill-in/short-answer
+                 if evaluation['score'] == 10:
+                     evaluation['result'] = '正确'
+                 elif evaluation['score'] > 0:
+                     evaluation['result'] = '部分正确'
+                 else:
+                     evaluation['result'] = '错误'
+
+             except Exception as e:
+                 print(f"Error during GPT evaluation for question '{description[:20]}': {e}")
+                 evaluation['result'] = '评估失败'
+                 evaluation['score'] = 0
+                 evaluation['reason'] = f'GPT 评估出错: {e}'
+
+        return evaluation
+
+    def _close_speculative_grader(self):
+        if self.speculative_grader is not None:
+            self.speculative_grader.close()
+            self.speculative_grader = None
+
+    def record_answer(self, index, answer):
+        """Stores the answer to question `index`; an edit postpones its speculative grading."""
+        self.user_answers[index] = answer if answer is not None else ""
+        if self.speculative_grader is not None:
+            self.speculative_grader.cancel(index)
+
+    def leave_question(self, index):
+        """
+        Called when the student navigates away from question `index`. With
+        speculative_grading on, its answer is graded in the background once it has
+        stayed unchanged for speculative_grading_delay seconds.
+        """
+        if not self.speculative_grading or not 0 <= index < len(self.exam_questions):
+            return
+        if self.speculative_grader is None:
+            self.speculative_grader = SpeculativeGrader(self.grade_answer, delay=self.speculative_grading_delay)
+        self.speculative_grader.schedule(index, self.exam_questions[index], self.user_answers.get(index, ""),
+                                         lambda: self.user_answers.get(index, ""))
 
     def submit_exam(self):
         """Evaluates user answers and calculates total score."""
@@ -501,141 +1219,75 @@ class AppLogic:
         if not self.exam_questions:
             return 0, {}, "没有题目可以提交。"
 
+        grader = self.speculative_grader
         for index, question in enumerate(self.exam_questions):
-            question_type = question.get('type', '未知')
-            description = question.get('description', '无描述')
-            correct_answer = question.get('answer', '').strip()
-            user_answer = self.user_answers.get(index, "").strip()
-
-            evaluation = {
-                'result': '未作答', # Default
-                'score': 0,
-                'reason': '未作答',
-                'correct_answer': correct_answer,
-                'explanation': question.get('explanation', '')
-            }
-
-            if question_type == "选择":
-                if user_answer == correct_answer:
-                    evaluation['result'] = "正确"
-                    evaluation['score'] = 10 # Assuming 10 points per question
-                    evaluation['reason'] = '回答正确'
-                else:
-                    evaluation['result'] = "错误"
-                    evaluation['score'] = 0
-                    evaluation['reason'] = f'回答错误，正确答案是 {correct_answer}' # Provide correct answer
-            elif question_type in ["填空", "简答"]:
-                 # Use GPT for evaluation for fill-in and short answer
-                 try:
-                     evaluation_text = self.check_answer_with_gpt(question, user_answer)
-                     parsed_evaluation = self.parse_evaluation(evaluation_text)
-                     evaluation['score'] = parsed_evaluation.get('score', 0)
-                     evaluation['reason'] = parsed_evaluation.get('reason', '无法解析评分理由')
-
-                     # Determine result based on score for fill-in/short-answer
-                     if evaluation['score'] == 10:
-                         evaluation['result'] = '正确'
-                     elif evaluation['score'] > 0:
-                         evaluation['result'] = '部分正确'
-                     else:
-                         evaluation['result'] = '错误'
-
-                 except Exception as e:
-                     print(f"Error during GPT evaluation for question {index}: {e}")
-                     evaluation['result'] = '评估失败'
-                     evaluation['score'] = 0
-                     evaluation['reason'] = f'GPT 评估出错: {e}'
-
-
+            user_answer = self.user_answers.get(index, "")
+            if grader is not None: # Reuses the evaluation of answers graded while the student was answering
+                evaluation = grader.grade(index, question, user_answer)
+            else:
+                evaluation = self.grade_answer(question, user_answer)
             total_score += evaluation['score']
             self.evaluation_results[index] = evaluation
 
         print(f"Exam submitted. Total score: {total_score}")
+        try:
+            bank = self._get_question_bank()
+            bank.record_results(self.exam_questions, self.evaluation_results)
+            bank.save()
+        except Exception as e:
+            print(f"Error updating question bank statistics: {e}")
+        try:
+            tracker = self._get_mastery_tracker()
+            tracker.update_from_exam(self.exam_questions, self.evaluation_results)
+            tracker.save()
+        except Exception as e:
+            print(f"Error updating topic mastery: {e}")
         return total_score, self.evaluation_results, None # Return total score, results, and no error
 
 
     def check_answer_with_gpt(self, question, user_answer):
         """Uses GPT to evaluate non-multiple-choice answers."""
-        prompt = (
-            "你将扮演一位严格但公平的阅卷老师，"
-            "请根据以下的标准答案和评分标准，评估用户的回答。"
-            "满分为10分，请给出得分和简短的评分理由。"
-            "如果用户的答案部分正确，也应给予适当的分数。"
-            "请注意，答案不需要和标准答案一模一样，只要内容合理、正确即可得分。"
-            "但如果用户未作答或答案与题目无关，则得0分。"
-            "用户答案后面的内容才是用户的答案，也就是你要测评的内容"
-            "请严格按照格式{{score=数字, reason=\"理由\"}}返回，不要有多余的内容。"
-        )
-        messages = [
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": f"问题：{question.get('description', 'N/A')}\n参考答案: {question.get('answer', 'N/A')}\n用户答案：{user_answer}"}
-        ]
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=messages
+        def build_messages(structured):
+            prompt = (
+                "你将扮演一位严格但公平的阅卷老师，"
+                "请根据以下的标准答案和评分标准，评估用户的回答。"
+                "满分为10分，请给出得分和简短的评分理由。"
+                "如果用户的答案部分正确，也应给予适当的分数。"
+                "请注意，答案不需要和标准答案一模一样，只要内容合理、正确即可得分。"
+                "但如果用户未作答或答案与题目无关，则得0分。"
+                "用户答案后面的内容才是用户的答案，也就是你要测评的内容"
             )
-            return response['choices'][0]['message']['content']
+            if structured:
+                prompt += "以JSON返回，score为0到10的整数得分，reason为评分理由。"
+            else:
+                prompt += "请严格按照格式{{score=数字, reason=\"理由\"}}返回，不要有多余的内容。"
+            return [
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": f"问题：{question.get('description', 'N/A')}\n参考答案: {question.get('answer', 'N/A')}\n用户答案：{user_answer}"}
+            ]
+
+        try:
+            content, _ = self._structured_completion(build_messages, "answer_evaluation", EVALUATION_SCHEMA, "grading")
+            return content
+        except QuotaExceededError:
+            raise # Graded as 评估失败 rather than as a wrong answer
         except Exception as e:
             print(f"Error calling OpenAI for evaluation: {e}")
             return f"{{score=0, reason=\"API 调用失败: {e}\"}}" # Return a structured error response
 
     def parse_evaluation(self, evaluation_text):
-        """Parses GPT's evaluation string into a dictionary."""
+        """Parses GPT's evaluation (structured JSON, or the {score=8, reason="..."} text format) into a dictionary."""
         try:
-            # Attempt to parse as JSON first, if it's close to JSON format
-            # Sometimes GPT might output valid JSON.
-            try:
-                # Replace common non-JSON friendly patterns like key=value
-                evaluation_text_json_friendly = evaluation_text.strip()
-                if evaluation_text_json_friendly.startswith('{') and evaluation_text_json_friendly.endswith('}'):
-                    # Convert key=value to "key":value
-                    evaluation_text_json_friendly = re.sub(r'(\w+)\s*=\s*', r'"\1": ', evaluation_text_json_friendly)
-                    # Convert single quotes to double quotes for string values if necessary (be cautious)
-                    # Simple attempt:
-                    evaluation_text_json_friendly = re.sub(r"'([^']*)'", r'"\1"', evaluation_text_json_friendly)
-
-                    # Attempt JSON load
-                    eval_data = json.loads(evaluation_text_json_friendly)
-                    if 'score' in eval_data and 'reason' in eval_data:
-                         # Ensure score is integer
-                         eval_data['score'] = int(eval_data['score'])
-                         return eval_data # Successfully parsed as JSON-like
-                    # If it loaded but didn't have expected keys, fall through to regex
-
-            except (json.JSONDecodeError, ValueError):
-                 # Not strict JSON, fall through to regex
-                 pass
-
-
-            # Fallback to regex parsing if JSON parsing failed
-            # Matches { score: <digits>, reason: "<anything>" }
-            pattern = r'\{\s*score\s*:\s*(\d+)\s*,\s*reason\s*:\s*"([^"]*)"\s*\}'
-            match = re.search(pattern, evaluation_text)
-
-            if match:
-                score = int(match.group(1))
-                reason = match.group(2)
-                return {'score': score, 'reason': reason}
-            else:
-                print(f"Warning: Could not parse evaluation text with regex: {evaluation_text}")
-                # Attempt a more general pattern if the strict one fails
-                pattern_fallback = r'score.*?(\d+).*?reason.*?"?([^"]*)"?'
-                match_fallback = re.search(pattern_fallback, evaluation_text, re.DOTALL | re.IGNORECASE)
-                if match_fallback:
-                    try:
-                        score = int(match_fallback.group(1))
-                        reason = match_fallback.group(2).strip()
-                        print(f"Info: Parsed evaluation with fallback regex. Score: {score}, Reason: {reason[:50]}...")
-                        return {'score': score, 'reason': reason}
-                    except (ValueError, IndexError):
-                         print(f"Warning: Fallback regex failed to parse score or reason.")
-                         return {'score': 0, 'reason': f'无法完全解析评分结果: {evaluation_text}'}
-                else:
-                    print(f"Warning: Fallback regex also failed to parse evaluation text: {evaluation_text}")
-                    return {'score': 0, 'reason': f'无法解析评分结果: {evaluation_text}'} # Final fallback
-
-
+            eval_data = decode_json_object(evaluation_text)
+            score = parse_score(eval_data.get("score", "")) if eval_data else None
+            if score is not None:
+                return {'score': score, 'reason': str(eval_data.get('reason', ''))}
+
+            eval_data = parse_evaluation_record(evaluation_text)
+            if eval_data is None:
+                print(f"Warning: Could not parse evaluation text: {evaluation_text}")
+                return {'score': 0, 'reason': f'无法解析评分结果: {evaluation_text}'}
+            return eval_data
         except Exception as e:
             print(f"Severe error during evaluation parsing: {e}")
             return {'score': 0, 'reason': f'解析评分结果时发生严重错误: {e}'}
@@ -644,12 +1296,16 @@ class AppLogic:
     def reset_teaching_state(self):
          self.conversation_history = []
          self.current_dialog_key = None
+         self.dialog_token = next(_session_tokens)
+         self.usage_ledger.start_session()
          return "新的教学会话已开始。"
 
     def reset_exam_state(self):
          self.user_answers = {}
          self.evaluation_results = {}
          self.exam_questions = [] # Clear questions too
+         self.exam_token = next(_session_tokens)
+         self._close_speculative_grader()
          return "考试状态已重置。"
 
 
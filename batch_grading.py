@@ -0,0 +1,251 @@
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from instrumentation import record_cache_hit
+from review_scheduler import grade_locally, normalize_answer
+
+POINTS_PER_QUESTION = 10 # Same scale as AppLogic.submit_exam
+LOCAL_TYPES = ("选择", "填空")
+
+
+def load_exam(path):
+    """Loads an exam paper: a JSON list of questions, or {"questions": [...]}."""
+    with open(path, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    return data["questions"] if isinstance(data, dict) else data
+
+
+def _answers_from_row(row, num_questions):
+    """Maps CSV columns "1".."n" or "q1".."qn" to 0-based question indexes."""
+    answers = {}
+    for index in range(num_questions):
+        for column in (str(index + 1), f"q{index + 1}", f"Q{index + 1}"):
+            if column in row:
+                answers[index] = row[column] or ""
+                break
+    return answers
+
+
+def iter_student_answers(path, num_questions):
+    """
+    Streams (student_id, {question_index: answer}) from a CSV file with a student_id
+    column, or from JSONL lines {"student_id": ..., "answers": [...] or {"1": ...}}.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8-sig", newline="") as file:
+            for row in csv.DictReader(file):
+                yield str(row["student_id"]), _answers_from_row(row, num_questions)
+        return
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            answers = record.get("answers", {})
+            if isinstance(answers, list):
+                answers = dict(enumerate(answers))
+            else:
+                answers = {int(key) - 1: value for key, value in answers.items()}
+            yield str(record["student_id"]), {index: answer or "" for index, answer in answers.items()}
+
+
+def _blank_evaluation(question):
+    return {"result": "未作答", "score": 0, "reason": "未作答",
+            "correct_answer": question.get("answer", ""), "explanation": question.get("explanation", "")}
+
+
+def grade_students_locally(questions, students):
+    """
+    Grades the choice and fill-in answers of a batch of students (runs in a worker process).
+    Returns [(student_id, {index: evaluation})]; short answers are left for the LLM.
+    """
+    graded = []
+    for student_id, answers in students:
+        evaluations = {}
+        for index, question in enumerate(questions):
+            user_answer = str(answers.get(index, "")).strip()
+            if not user_answer:
+                evaluations[index] = _blank_evaluation(question)
+                continue
+            if question.get("type") not in LOCAL_TYPES:
+                continue
+            result = grade_locally(question, user_answer)
+            evaluation = _blank_evaluation(question)
+            evaluation["result"] = result
+            evaluation["score"] = POINTS_PER_QUESTION if result == "正确" else 0
+            evaluation["reason"] = "回答正确" if result == "正确" else f"回答错误，正确答案是 {question.get('answer', '')}"
+            evaluations[index] = evaluation
+        graded.append((student_id, evaluations))
+    return graded
+
+
+class BatchGrader:
+    """
+    Grades a whole class against one exam and appends one JSONL line per student:
+    {"student_id", "total_score", "evaluations": {index: evaluation}}.
+    Choice/fill-in answers are graded in a process pool. Short answers are
+    deduplicated by (question, normalized answer) and graded by the LLM in a
+    thread pool. Progress survives a crash: students already in the output file are
+    skipped, and LLM gradings are appended to <output>.llm_cache.jsonl so a rerun
+    does not pay for them twice. A student with an answer whose grading failed
+    ("评估失败") is not written, so the next run grades that answer again.
+    """
+
+    def __init__(self, questions, output_path, grade_answer, processes=None, llm_threads=8, batch_size=64):
+        self.questions = questions
+        self.output_path = output_path
+        self.cache_path = output_path + ".llm_cache.jsonl"
+        self.grade_answer = grade_answer # (question, user_answer) -> evaluation, e.g. AppLogic.grade_answer
+        self.processes = processes
+        self.llm_threads = llm_threads
+        self.batch_size = batch_size
+        self.llm_cache = {} # (question_index, normalized answer) -> evaluation
+        self.completed = set()
+        self.stats = {"students": 0, "skipped": 0, "failed": 0, "llm_calls": 0, "llm_cache_hits": 0}
+
+    def _load_checkpoint(self):
+        """Reads finished students and cached LLM gradings, dropping a half-written last line."""
+        if os.path.exists(self.output_path):
+            valid_bytes = 0
+            with open(self.output_path, "rb") as file:
+                for line in file:
+                    try:
+                        self.completed.add(json.loads(line.decode("utf-8"))["student_id"])
+                    except (ValueError, KeyError):
+                        break
+                    valid_bytes += len(line)
+            with open(self.output_path, "r+b") as file:
+                file.truncate(valid_bytes)
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.llm_cache[(record["index"], record["answer"])] = record["evaluation"]
+
+    def _grade_with_llm(self, pending, cache_file):
+        """
+        Grades pending {(index, normalized answer): raw answer} concurrently, one LLM
+        call per distinct answer, and returns {key: evaluation}. Successful gradings
+        are added to the cache; failed ones are left out so they are graded again.
+        """
+        def grade(item):
+            (index, _), answer = item
+            return item[0], self.grade_answer(self.questions[index], answer)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.llm_threads) as pool:
+            for key, evaluation in pool.map(grade, pending.items()):
+                results[key] = evaluation
+                self.stats["llm_calls"] += 1
+                if evaluation.get("result") != "评估失败":
+                    self.llm_cache[key] = evaluation
+                    cache_file.write(json.dumps({"index": key[0], "answer": key[1], "evaluation": evaluation},
+                                                ensure_ascii=False) + "\n")
+        cache_file.flush()
+        return results
+
+    def _process_batch(self, batch, local_pool, output_file, cache_file):
+        chunk_size = max(1, len(batch) // (self.processes or os.cpu_count() or 1))
+        chunks = [batch[i:i + chunk_size] for i in range(0, len(batch), chunk_size)]
+        graded = [student for result in local_pool.map(grade_students_locally, [self.questions] * len(chunks), chunks)
+                  for student in result]
+
+        answers_by_student = dict(batch)
+        pending = {} # (index, normalized answer) -> raw answer of the first student who gave it
+        for student_id, evaluations in graded:
+            for index in range(len(self.questions)):
+                if index in evaluations:
+                    continue
+                answer = str(answers_by_student[student_id].get(index, "")).strip()
+                key = (index, normalize_answer(answer))
+                if key in self.llm_cache or key in pending:
+                    self.stats["llm_cache_hits"] += 1
+                    record_cache_hit("grading")
+                else:
+                    pending[key] = answer
+        results = self._grade_with_llm(pending, cache_file) if pending else {}
+
+        written = 0
+        for student_id, evaluations in graded:
+            for index in range(len(self.questions)):
+                if index not in evaluations:
+                    answer = str(answers_by_student[student_id].get(index, "")).strip()
+                    key = (index, normalize_answer(answer))
+                    evaluations[index] = self.llm_cache.get(key) or results[key]
+            if any(evaluation.get("result") == "评估失败" for evaluation in evaluations.values()):
+                self.stats["failed"] += 1 # Not written: the next run grades this student again
+                continue
+            record = {
+                "student_id": student_id,
+                "total_score": sum(evaluation["score"] for evaluation in evaluations.values()),
+                "evaluations": {str(index): evaluations[index] for index in sorted(evaluations)},
+            }
+            output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            written += 1
+        output_file.flush()
+        os.fsync(output_file.fileno())
+        self.stats["students"] += written
+
+    def run(self, students, total=None, progress_every=1):
+        """
+        Grades an iterable of (student_id, answers) and returns the stats dict.
+        Prints progress after every progress_every batches.
+        """
+        self._load_checkpoint()
+        start_time = time.perf_counter()
+        batch = []
+        batches_done = 0
+        with ProcessPoolExecutor(max_workers=self.processes) as local_pool, \
+                open(self.output_path, "a", encoding="utf-8") as output_file, \
+                open(self.cache_path, "a", encoding="utf-8") as cache_file:
+            for student_id, answers in students:
+                if student_id in self.completed:
+                    self.stats["skipped"] += 1
+                    continue
+                batch.append((student_id, answers))
+                if len(batch) >= self.batch_size:
+                    self._process_batch(batch, local_pool, output_file, cache_file)
+                    batch = []
+                    batches_done += 1
+                    if batches_done % progress_every == 0:
+                        self._print_progress(start_time, total)
+            if batch or batches_done % progress_every:
+                if batch:
+                    self._process_batch(batch, local_pool, output_file, cache_file)
+                self._print_progress(start_time, total)
+        return self.stats
+
+    def _print_progress(self, start_time, total):
+        done = self.stats["students"] + self.stats["skipped"] + self.stats["failed"]
+        elapsed = time.perf_counter() - start_time
+        rate = self.stats["students"] / elapsed if elapsed > 0 else 0.0
+        total_text = f"/{total}" if total else ""
+        print(f"Graded {done}{total_text} students ({self.stats['skipped']} resumed), "
+              f"{self.stats['llm_calls']} LLM calls, {self.stats['llm_cache_hits']} deduplicated, "
+              f"{self.stats['failed']} with failed gradings left for the next run, {rate:.1f} students/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch-grade a class's answers to one exam.")
+    parser.add_argument("exam", help="exam JSON (list of questions)")
+    parser.add_argument("answers", help="student answers, .csv (student_id,1,2,...) or .jsonl")
+    parser.add_argument("output", help="results JSONL, appended to and resumed from")
+    parser.add_argument("--processes", type=int, default=None, help="local grading processes")
+    parser.add_argument("--llm-threads", type=int, default=8, help="concurrent LLM grading requests")
+    parser.add_argument("--batch-size", type=int, default=64, help="students per pipeline batch")
+    args = parser.parse_args()
+
+    import backendlogic # Only the parent process needs the LLM client
+    exam_questions = load_exam(args.exam)
+    with open(args.answers, "rb") as answers_file:
+        total_students = max(sum(1 for _ in answers_file) - (1 if args.answers.lower().endswith(".csv") else 0), 0)
+    grader = BatchGrader(exam_questions, args.output, backendlogic.AppLogic().grade_answer,
+                         processes=args.processes, llm_threads=args.llm_threads, batch_size=args.batch_size)
+    grader.run(iter_student_answers(args.answers, len(exam_questions)), total=total_students)
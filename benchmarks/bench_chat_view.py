@@ -0,0 +1,102 @@
+"""
+Benchmark for rendering long dialogs in the Tk chat views (main.py).
+
+Compares, for a generated dialog of --messages messages:
+  1. eager: one frame with avatar and label per message packed into a scrolled
+     frame, as view_chat_detail and update_chat_display used to do.
+  2. virtual: tk_chat_view.VirtualChatView, which only creates rows for the
+     messages in or near the viewport and recycles them while scrolling.
+It reports the time until the dialog is drawn, the time per scroll step through
+the whole dialog, and the message widgets created. Needs a display.
+
+Usage:
+    python benchmarks/bench_chat_view.py [--messages 2000] [--scroll-steps 200]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tkinter as tk
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from tk_chat_view import TEXT_WIDTH, VirtualChatView
+
+
+def generate_messages(count, seed=7):
+    rng = random.Random(seed)
+    sentences = ["压电晶体受压时晶格形变，正负电荷中心分离。", "请解释一下电容式传感器的工作原理。",
+                 "Strain gauges change resistance when stretched.", "霍尔元件可以用来测量磁场强度。"]
+    return [{"role": "user" if i % 2 == 0 else "assistant",
+             "content": "".join(rng.choice(sentences) for _ in range(rng.randint(1, 12)))} for i in range(count)]
+
+
+def add_message_eager(parent, message, role):
+    """The previous App._add_message_with_avatar."""
+    message_frame = tk.Frame(parent, bg="white")
+    message_frame.pack(fill="x", pady=5, padx=10, anchor="w" if role == "assistant" else "e")
+    avatar_canvas = tk.Canvas(message_frame, width=40, height=40, bg="white", highlightthickness=0)
+    avatar_canvas.create_oval(5, 5, 35, 35, fill="red" if role == "assistant" else "yellow", outline="")
+    avatar_canvas.create_text(20, 20, text="AI" if role == "assistant" else "我", font=("microsoftyahei", 10, "bold"))
+    avatar_canvas.pack(side="top", anchor="w" if role == "assistant" else "e")
+    tk.Label(message_frame, text=message, wraplength=TEXT_WIDTH, justify="left" if role == "assistant" else "right",
+             bg="white", fg="green" if role == "assistant" else "blue", font=("microsoftyahei", 10)
+             ).pack(side="left" if role == "assistant" else "right", padx=5)
+
+
+def render_eager(root, messages):
+    container = tk.Frame(root, bg="white")
+    container.pack(fill="both", expand=True)
+    canvas = tk.Canvas(container, bg="white", width=800, height=600)
+    frame = tk.Frame(canvas, bg="white", width=800)
+    frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
+    canvas.create_window((0, 0), window=frame, anchor="nw", width=800)
+    canvas.pack(fill="both", expand=True)
+    for record in messages:
+        add_message_eager(frame, record["content"], record["role"])
+    return container, canvas, lambda: len(messages)
+
+
+def render_virtual(root, messages):
+    view = VirtualChatView(root, width=800, height=600)
+    view.pack(fill="both", expand=True)
+    view.extend(messages)
+    return view, view.canvas, lambda: view.row_count
+
+
+def measure(root, render, messages, scroll_steps):
+    start = time.perf_counter()
+    container, canvas, count_widgets = render(root, messages)
+    root.update()
+    render_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    for step in range(scroll_steps):
+        canvas.yview_moveto(step / scroll_steps)
+        root.update()
+    scroll_ms = (time.perf_counter() - start) / scroll_steps * 1000
+    widgets = count_widgets()
+    container.destroy()
+    return render_ms, scroll_ms, widgets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--scroll-steps", type=int, default=200)
+    args = parser.parse_args()
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        print(f"skipped (no display: {e})")
+        return
+    messages = generate_messages(args.messages)
+    print(f"== Chat view, {args.messages} messages ==")
+    for name, render in (("eager", render_eager), ("virtual", render_virtual)):
+        render_ms, scroll_ms, widgets = measure(root, render, messages, args.scroll_steps)
+        print(f"{name:<8} first draw {render_ms:9.1f} ms   scroll {scroll_ms:7.2f} ms/step   {widgets:6d} message widgets")
+    root.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Benchmark for the per-turn Chatbot payload of the Gradio teaching mode (app_gradio.py).
+
+Simulates a session of --turns question/answer turns and reports the JSON bytes
+the server sends for the chatbot each turn:
+  1. full: the whole transcript, as send_message used to return.
+  2. delta: only the new rows (app_gradio.chatbot_delta), applied in the browser.
+Needs gradio installed (app_gradio builds its interface on import).
+
+Usage:
+    python benchmarks/bench_chatbot_payload.py [--turns 200]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import app_gradio
+
+
+def payload_size(value):
+    return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    state = {"chatbot_length": 0}
+    history = []
+    full_sizes, delta_sizes = [], []
+    for turn in range(args.turns):
+        new_messages = [{"role": "user", "content": "请解释一下传感器的灵敏度。" * rng.randint(1, 3)},
+                        {"role": "assistant", "content": "灵敏度是输出变化量与输入变化量之比。" * rng.randint(5, 40)}]
+        history.extend(new_messages)
+        full_sizes.append(payload_size(app_gradio.to_chatbot_rows(history)))
+        delta_sizes.append(payload_size(app_gradio.chatbot_delta(state, new_messages)))
+
+    print(f"== Chatbot payload, {args.turns} turns ==")
+    for name, sizes in (("full", full_sizes), ("delta", delta_sizes)):
+        print(f"{name:<6} last turn {sizes[-1] / 1024:9.1f} KiB   whole session {sum(sizes) / 1024:11.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark for question navigation in the Tk exam view (main.py).
+
+Compares, over a mock exam of choice, fill-in and open questions:
+  1. rebuild: clear_screen() and recreate every widget for each question, as
+     show_question used to do on every 上一题/下一题 click.
+  2. reuse: the persistent exam view, which only swaps text, options and answer.
+For each it reports the time per navigation (including the redraw) and the Tk
+widgets created per navigation. Needs a display.
+
+Usage:
+    python benchmarks/bench_exam_view.py [--navigations 200]
+"""
+import argparse
+import os
+import sys
+import time
+import tkinter as tk
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import main as tk_app
+
+MOCK_QUESTIONS = [
+    {"type": "选择", "description": "下列哪个是压电材料？", "option": "A:石英,B:铜,C:铝,D:木头", "answer": "A", "explanation": "略"},
+    {"type": "填空", "description": "古诗补全：床前明月光，_______地上霜。", "option": "None", "answer": "疑是", "explanation": "略"},
+    {"type": "简答", "description": "请说一说为什么压电晶体一压就会产生电？", "option": "None", "answer": "略", "explanation": "略"},
+] * 4
+
+
+def count_widgets(widget):
+    return 1 + sum(count_widgets(child) for child in widget.winfo_children())
+
+
+def run(app, root, navigations, rebuild):
+    created = 0
+    start = time.perf_counter()
+    for step in range(navigations):
+        if rebuild:
+            app.clear_screen() # The exam view is gone, so show_question builds it again
+        before = 0 if rebuild else count_widgets(root)
+        app.show_question(step % len(tk_app.questions))
+        root.update()
+        created += count_widgets(root) - before
+    return (time.perf_counter() - start) / navigations * 1000, created / navigations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--navigations", type=int, default=200)
+    args = parser.parse_args()
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        print(f"skipped (no display: {e})")
+        return
+    app = tk_app.App(root)
+    tk_app.questions = list(MOCK_QUESTIONS)
+    app.show_question(0)
+    root.update()
+
+    print(f"== Exam view, {args.navigations} navigations ==")
+    for name, rebuild in (("rebuild", True), ("reuse", False)):
+        per_navigation_ms, widgets = run(app, root, args.navigations, rebuild)
+        print(f"{name:<8} {per_navigation_ms:8.2f} ms/navigation   {widgets:6.1f} widgets created/navigation")
+    root.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Benchmark for llm_parse against the regex pipelines it replaced in backendlogic.py.
+
+Reports, for exam question responses and grading responses separately:
+  1. Recovery: questions recovered intact / scores read correctly.
+  2. Parse time per response (median over --repeat runs of the whole corpus).
+
+The corpus is a JSONL file of responses, one per line:
+    {"kind": "questions", "text": "...", "expected": [{question}, ...]}
+    {"kind": "evaluation", "text": "...", "expected": 8}
+The default, benchmarks/llm_responses.jsonl, is small and checked in: exam replies
+built from the questions stored in wrong.json and grading replies for the answers
+given to them, in the formats the prompts ask for and the deviations the parser
+handles (prose and code fences around the records, full-width punctuation, JSON
+and single-quoted records, inner quotes, prose-style "score: 8 reason: ...",
+replies cut off by max_tokens). Pass --corpus with responses captured from the
+API to measure those instead. --generate builds a large synthetic corpus from
+templates, for timing.
+
+Usage:
+    python benchmarks/bench_llm_parse.py [--corpus responses.jsonl | --generate] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from llm_parse import parse_evaluation_record, parse_records
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_responses.jsonl")
+
+
+def regex_parse_questions(content):
+    """The previous AppLogic._generate_questions_with_llm parsing."""
+    try:
+        formatted_content = re.sub(r'(\w+)=', r'"\1":', content)
+        json_objects_str = ",".join(re.findall(r'(\{.*?\}),?', formatted_content, re.DOTALL))
+        return json.loads(f"[{json_objects_str}]")
+    except ValueError:
+        return []
+
+
+def regex_parse_evaluation(evaluation_text):
+    """The previous AppLogic.parse_evaluation (without its logging)."""
+    try:
+        text = evaluation_text.strip()
+        if text.startswith('{') and text.endswith('}'):
+            text = re.sub(r'(\w+)\s*=\s*', r'"\1": ', text)
+            text = re.sub(r"'([^']*)'", r'"\1"', text)
+            eval_data = json.loads(text)
+            if 'score' in eval_data and 'reason' in eval_data:
+                eval_data['score'] = int(eval_data['score'])
+                return eval_data
+    except (json.JSONDecodeError, ValueError):
+        pass
+    match = re.search(r'\{\s*score\s*:\s*(\d+)\s*,\s*reason\s*:\s*"([^"]*)"\s*\}', evaluation_text)
+    if match:
+        return {'score': int(match.group(1)), 'reason': match.group(2)}
+    match = re.search(r'score.*?(\d+).*?reason.*?"?([^"]*)"?', evaluation_text, re.DOTALL | re.IGNORECASE)
+    if match:
+        return {'score': int(match.group(1)), 'reason': match.group(2).strip()}
+    return {'score': 0, 'reason': f'无法解析评分结果: {evaluation_text}'}
+
+
+QUESTION_TEMPLATES = [
+    {"type": "选择", "description": "1+1=？", "option": "A:1,B:2,C:3,D:4", "answer": "B", "explanation": "略"},
+    {"type": "选择", "description": "下列哪个是压电材料？", "option": "A:石英,B:铜,C:铝,D:木头", "answer": "A", "explanation": "石英晶体受压产生电荷"},
+    {"type": "填空", "description": "古诗补全：床前明月光，_______地上霜。", "option": "None", "answer": "疑是", "explanation": "略"},
+    {"type": "填空", "description": "若 x=2，则 x²=_____。", "option": "None", "answer": "4", "explanation": "2×2=4"},
+    {"type": "简答", "description": "请说一说为什么压电晶体一压就会产生电？", "option": "None", "answer": "晶格形变使正负电荷中心分离", "explanation": "略"},
+    {"type": "简答", "description": "解释“欧姆定律” U=IR 的含义。", "option": "None", "answer": "电压等于电流乘以电阻", "explanation": "略"},
+]
+
+
+def format_question(question, style):
+    if style == "json":
+        return json.dumps(question, ensure_ascii=False)
+    if style == "full_width":
+        return "｛" + "，".join(f"{key}＝“{value}”" for key, value in question.items()) + "｝"
+    if style == "escaped_quotes":
+        return "{" + ", ".join(f'{key}="{value}"' for key, value in question.items()).replace("“", '\\"').replace("”", '\\"') + "}"
+    return "{" + ", ".join(f'{key}="{value}"' for key, value in question.items()) + "}"
+
+
+def generate_question_responses(rng, count):
+    styles = ["plain", "plain", "json", "full_width", "escaped_quotes"]
+    responses = []
+    for _ in range(count):
+        questions = [dict(rng.choice(QUESTION_TEMPLATES)) for _ in range(rng.randint(3, 7))]
+        style = rng.choice(styles)
+        body = "\n".join(format_question(question, style) for question in questions)
+        expected = [{key: value.replace("“", '"').replace("”", '"') if style == "escaped_quotes" else value
+                     for key, value in question.items()} for question in questions]
+        wrapper = rng.random()
+        if wrapper < 0.3:
+            body = f"好的，以下是为你生成的考题：\n```\n{body}\n```\n祝学习顺利！"
+        elif wrapper < 0.4: # Truncated: the last record is cut off and cannot be used
+            body = body[:body.rfind("answer")]
+            expected = expected[:-1]
+        responses.append({"kind": "questions", "text": body, "expected": expected})
+    return responses
+
+
+REASONS = ["回答正确，要点完整", "部分正确，缺少\"单位\"", "答案与题目无关", "思路正确，但计算 x=3 时出错", "基本正确'但表述不够严谨'"]
+
+
+def generate_evaluation_responses(rng, count):
+    formats = [
+        lambda score, reason: f'{{score={score}, reason="{reason}"}}',
+        lambda score, reason: f'{{score={score}, reason="{reason}"}}',
+        lambda score, reason: f'评分结果如下：{{score={score}, reason="{reason}"}}',
+        lambda score, reason: f'｛score＝{score}，reason＝“{reason}”｝',
+        lambda score, reason: f'{{"score": {score}, "reason": "{reason}"}}',
+        lambda score, reason: f'score={score}, reason="{reason}"',
+        lambda score, reason: f'{{score={score}分, reason="{reason}"}}',
+    ]
+    responses = []
+    for _ in range(count):
+        score = rng.randint(0, 10)
+        reason = rng.choice(REASONS).replace('"', '\\"') if rng.random() < 0.5 else rng.choice(REASONS)
+        responses.append({"kind": "evaluation", "text": rng.choice(formats)(score, reason), "expected": score})
+    return responses
+
+
+def question_matches(parsed, expected):
+    return all(parsed.get(key) == value for key, value in expected.items())
+
+
+def count_recovered(parsed_questions, expected_questions):
+    return sum(1 for parsed, expected in zip(parsed_questions, expected_questions) if question_matches(parsed, expected))
+
+
+def time_parser(parse, texts, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            parse(text)
+        samples.append((time.perf_counter() - start) / len(texts) * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="JSONL file of responses (default: %(default)s)")
+    parser.add_argument("--generate", action="store_true", help="use a generated corpus instead of --corpus")
+    parser.add_argument("--responses", type=int, default=500, help="generated responses per kind")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs over the corpus")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.generate:
+        rng = random.Random(args.seed)
+        corpus = generate_question_responses(rng, args.responses) + generate_evaluation_responses(rng, args.responses)
+    else:
+        with open(args.corpus, "r", encoding="utf-8") as file:
+            corpus = [json.loads(line) for line in file if line.strip()]
+
+    question_responses = [item for item in corpus if item["kind"] == "questions"]
+    evaluation_responses = [item for item in corpus if item["kind"] == "evaluation"]
+
+    if question_responses:
+        print(f"== Exam question responses ({len(question_responses)}) ==")
+        total = sum(len(item["expected"]) for item in question_responses)
+        for name, parse in (("regex", regex_parse_questions), ("llm_parse", parse_records)):
+            recovered = sum(count_recovered(parse(item["text"]), item["expected"]) for item in question_responses)
+            per_response = time_parser(parse, [item["text"] for item in question_responses], args.repeat)
+            print(f"{name:<10} recovered {recovered:5d}/{total} questions ({recovered / total:6.1%})   {per_response:8.1f} us/response")
+
+    if evaluation_responses:
+        print(f"\n== Grading responses ({len(evaluation_responses)}) ==")
+        total = len(evaluation_responses)
+        for name, parse in (("regex", regex_parse_evaluation), ("llm_parse", parse_evaluation_record)):
+            correct = sum(1 for item in evaluation_responses if (parse(item["text"]) or {}).get("score") == item["expected"])
+            per_response = time_parser(parse, [item["text"] for item in evaluation_responses], args.repeat)
+            print(f"{name:<10} correct score {correct:5d}/{total} ({correct / total:6.1%})   {per_response:8.1f} us/response")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark for speculative grading (speculative_grading.py) of exam answers.
+
+Simulates students answering an exam whose fill-in and short-answer questions
+are graded by an LLM call taking --latency seconds. Each student answers the
+questions in order, spending --think seconds on each, and revises a fraction
+(--revise) of the answers on a second pass just before submitting. Reports the
+wait between clicking submit and seeing the score:
+  1. sequential: every answer is graded at submit, as AppLogic.submit_exam did.
+  2. speculative: answers are graded once they stay unchanged for --delay
+     seconds after the student moves on; submit only grades revised ones.
+plus the LLM calls spent per exam (speculation can grade an answer that is
+later revised).
+
+Usage:
+    python benchmarks/bench_speculative_grading.py [--latency 1.0] [--revise 0.2]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from speculative_grading import SpeculativeGrader
+
+EXAM = [{"type": "选择"}] * 4 + [{"type": "填空"}] * 4 + [{"type": "简答"}] * 2
+
+
+def make_grade_fn(latency, calls):
+    def grade(question, answer):
+        if question["type"] != "选择":
+            calls.append(answer)
+            time.sleep(latency)
+        return {"result": "正确", "score": 10}
+    return grade
+
+
+def run_student(rng, args, speculative):
+    calls = []
+    grade_fn = make_grade_fn(args.latency, calls)
+    grader = SpeculativeGrader(grade_fn, delay=args.delay) if speculative else None
+    answers = {}
+    for index, question in enumerate(EXAM):
+        answers[index] = f"answer {index}"
+        time.sleep(args.think)
+        if grader:
+            grader.schedule(index, question, answers[index], lambda index=index: answers[index])
+    for index in range(len(EXAM)):
+        if rng.random() < args.revise:
+            answers[index] = f"revised answer {index}"
+            if grader:
+                grader.cancel(index)
+    start = time.perf_counter()
+    for index, question in enumerate(EXAM):
+        if grader:
+            grader.grade(index, question, answers[index])
+        else:
+            grade_fn(question, answers[index])
+    wait = time.perf_counter() - start
+    if grader:
+        grader.close()
+    return wait, len(calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per LLM grading call")
+    parser.add_argument("--think", type=float, default=0.5, help="seconds a student spends per question")
+    parser.add_argument("--delay", type=float, default=0.3, help="seconds an answer must stay unchanged")
+    parser.add_argument("--revise", type=float, default=0.2, help="fraction of answers revised before submitting")
+    parser.add_argument("--students", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"== Submit wait, {len(EXAM)} questions, {args.latency:.1f} s per LLM grading ==")
+    for name, speculative in (("sequential", False), ("speculative", True)):
+        rng = random.Random(args.seed)
+        results = [run_student(rng, args, speculative) for _ in range(args.students)]
+        wait = sum(result[0] for result in results) / len(results)
+        calls = sum(result[1] for result in results) / len(results)
+        print(f"{name:<12} submit wait {wait:6.2f} s   LLM calls/exam {calls:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
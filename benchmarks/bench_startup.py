@@ -0,0 +1,96 @@
+"""
+Benchmark for startup cost of the app modules (lazy SDK imports, config.py).
+
+Every measurement runs in a fresh interpreter, so nothing is cached in sys.modules:
+  1. import backendlogic: what the Gradio app, batch_grading.py and any test pay
+     before the first line of their own code.
+  2. Deferred SDK imports: openai, dashscope and pyaudio, which backendlogic.py
+     and main.py used to import (and configure from key.txt) at import time and now
+     only load on first use. Their cost is what the eager startup added on top of 1.
+  3. Time to first window of the Tk app: import main, build App and draw the first
+     frame (skipped without a display).
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+IMPORT_BACKEND = """
+import time
+start = time.perf_counter()
+import backendlogic
+print((time.perf_counter() - start) * 1000)
+"""
+
+IMPORT_SDKS = """
+import importlib, time
+missing = []
+start = time.perf_counter()
+for name in ("openai", "dashscope", "dashscope.audio.asr", "pyaudio"):
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        missing.append(name)
+print((time.perf_counter() - start) * 1000, ",".join(missing))
+"""
+
+FIRST_WINDOW = """
+import time
+start = time.perf_counter()
+import tkinter as tk
+import main
+root = tk.Tk()
+main.App(root)
+root.update()
+print((time.perf_counter() - start) * 1000)
+root.destroy()
+"""
+
+
+def time_snippet(code, runs):
+    """
+    Median milliseconds reported by code over `runs` fresh interpreters, plus anything
+    the snippet printed after the number; or (None, error) on the first failure.
+    """
+    samples = []
+    note = ""
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, capture_output=True, text=True)
+        if result.returncode != 0:
+            return None, (result.stderr.strip().splitlines() or ["failed"])[-1]
+        value, _, note = result.stdout.strip().splitlines()[-1].partition(" ")
+        samples.append(float(value))
+    return statistics.median(samples), note
+
+
+def report(name, code, runs):
+    median_ms, note = time_snippet(code, runs)
+    if median_ms is None:
+        print(f"{name:<36} skipped ({note})")
+    else:
+        print(f"{name:<36} {median_ms:8.1f} ms" + (f"   (not installed: {note})" if note else ""))
+    return median_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters per measurement")
+    args = parser.parse_args()
+
+    print(f"== Startup, median of {args.runs} fresh interpreters ==")
+    backend_ms = report("import backendlogic", IMPORT_BACKEND, args.runs)
+    sdk_ms = report("deferred SDK imports (first use)", IMPORT_SDKS, args.runs)
+    report("Tk time to first window", FIRST_WINDOW, args.runs)
+    if backend_ms is not None and sdk_ms is not None:
+        print(f"\nEager imports would add {sdk_ms:.1f} ms to every startup "
+              f"({(backend_ms + sdk_ms) / backend_ms:.1f}x the current import backendlogic).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Benchmark for the Gradio view router (route_view in app_gradio.py).
+
+First checks that every route_view-wrapped handler of the real app returns one
+value per declared output, since a miscounted tuple only fails once clicked in
+the browser. Each routed event is called with the real handler on a scratch
+data directory (exam generation returns canned questions instead of calling the
+LLM), once with inputs that exist and once with inputs that do not, so the
+error branches are checked too. Exits with status 1 on a mismatch.
+
+Then reports two numbers:
+  1. Events per navigation: how many server events each click in the real app
+     triggers (handler + any `.then()` follow-ups), read from the Blocks config.
+  2. Click-to-render latency: a small demo with the same eight view blocks is
+     launched locally and driven through gradio_client, once with the old
+     handler + eight `.then(get_*_visibility)` chain and once with route_view.
+     For the chained version every follow-up event is a separate round trip,
+     exactly as the browser issues them.
+
+Usage:
+    python benchmarks/bench_view_router.py [--clicks 50] [--check-only]
+"""
+import argparse
+import copy
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import gradio as gr
+from gradio_client import Client
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import app_gradio  # Builds the Blocks without launching (launch is guarded by __main__)
+
+
+def count_events_per_navigation(blocks):
+    """Returns {trigger description: number of events in its chain} for every root event."""
+    dependencies = blocks.config["dependencies"]
+    children = {}
+    for index, dep in enumerate(dependencies):
+        parent = dep.get("trigger_after")
+        if parent is not None:
+            children.setdefault(parent, []).append(index)
+
+    def chain_length(index):
+        return 1 + sum(chain_length(child) for child in children.get(index, []))
+
+    components = {c["id"]: c for c in blocks.config["components"]}
+    counts = {}
+    for index, dep in enumerate(dependencies):
+        if dep.get("trigger_after") is not None:
+            continue
+        for target in dep.get("targets", []):
+            target_id, event = target if isinstance(target, (list, tuple)) else (target, "click")
+            props = components.get(target_id, {}).get("props", {})
+            label = props.get("value") or props.get("label") or str(target_id)
+            counts[f"{label}.{event}#{index}"] = chain_length(index)
+    return counts
+
+
+CANNED_EXAM = [
+    {"type": "选择", "description": "热电偶的工作原理是？", "option": "A:压电效应,B:塞贝克效应,C:霍尔效应,D:光电效应", "answer": "B", "explanation": "略"},
+    {"type": "填空", "description": "应变片利用____效应测量应变。", "option": "None", "answer": "应变", "explanation": "略"},
+    {"type": "简答", "description": "简述电容式传感器的测量原理。", "option": "None", "answer": "电容随极距变化", "explanation": "略"},
+]
+
+
+def routed_functions(blocks):
+    """Returns the (handler name, block function) of every route_view-wrapped event."""
+    fns = blocks.fns.values() if isinstance(blocks.fns, dict) else blocks.fns
+    return [(getattr(fn.fn.__wrapped__, "__name__", "<lambda>"), fn) for fn in fns if hasattr(fn.fn, "__wrapped__")]
+
+
+def write_fixture_data():
+    """Writes one saved dialog and one wrong question (key "1") for the default user in the current directory."""
+    logic = app_gradio.get_app_logic({})
+    logic.conversation_history = [{"role": "user", "content": "什么是霍尔效应？"}, {"role": "assistant", "content": "磁场中的载流导体……"}]
+    logic.save_chat_history_later()
+    logic.exam_questions = CANNED_EXAM[:1]
+    logic.user_answers = {0: "A"}
+    logic.evaluation_results = {0: {"result": "错误", "score": 0}}
+    logic.save_wrong_questions_later()
+    logic.write_behind.flush()
+
+
+def check_routed_outputs(blocks):
+    """
+    Calls every routed event of `blocks` with the real handler and compares the number
+    of returned values with its declared outputs. Returns a list of mismatches.
+    """
+    scenarios = {
+        "found": ({app_gradio.history_select_id_input: "dialog1", app_gradio.wrong_select_key_input: "1"}, None),
+        "missing": ({app_gradio.history_select_id_input: "dialog9", app_gradio.wrong_select_key_input: "999"}, "题库为空"),
+    }
+    logic_class = app_gradio.backend_logic.AppLogic
+    generators = (logic_class.generate_exam_questions, logic_class.generate_adaptive_exam)
+    cwd = os.getcwd()
+    mismatches = []
+    for scenario, (input_values, exam_error) in scenarios.items():
+        canned = lambda self, *args, **kwargs: ([], exam_error) if exam_error else (copy.deepcopy(CANNED_EXAM), None)
+        logic_class.generate_exam_questions = logic_class.generate_adaptive_exam = canned
+        with tempfile.TemporaryDirectory() as data_dir:
+            os.chdir(data_dir)
+            app_gradio.app_logics.clear()
+            try:
+                write_fixture_data()
+                for name, fn in routed_functions(blocks):
+                    state = copy.deepcopy(app_gradio.initial_state)
+                    args = [input_values.get(component) for component in fn.inputs[1:]]
+                    result = fn.fn(state, *args)
+                    if len(result) != len(fn.outputs):
+                        mismatches.append(f"{name} ({scenario}): returns {len(result)} values for {len(fn.outputs)} outputs")
+            finally:
+                app_gradio.get_app_logic({}).write_behind.flush()
+                app_gradio.app_logics.clear()
+                os.chdir(cwd)
+                logic_class.generate_exam_questions, logic_class.generate_adaptive_exam = generators
+    return mismatches
+
+
+def build_demo():
+    """Builds a demo with one chained and one routed navigation button over eight view blocks."""
+    def navigate(state):
+        state = dict(state)
+        state["current_mode"] = "history_list" if state["current_mode"] == "main" else "main"
+        return state, f"mode: {state['current_mode']}"
+
+    def visibility_of(mode):
+        return lambda state: gr.update(visible=state["current_mode"] == mode)
+
+    with gr.Blocks() as demo:
+        state = gr.State(value={"current_mode": "main"})
+        status = gr.Textbox()
+        blocks = []
+        for mode in app_gradio.VIEW_MODES:
+            with gr.Column(visible=mode == "main") as block:
+                gr.Markdown(mode)
+            blocks.append(block)
+
+        btn_chained = gr.Button("chained")
+        event = btn_chained.click(navigate, inputs=[state], outputs=[state, status])
+        for mode, block in zip(app_gradio.VIEW_MODES, blocks):
+            event = event.then(visibility_of(mode), inputs=[state], outputs=[block])
+
+        btn_routed = gr.Button("routed")
+        btn_routed.click(app_gradio.route_view(navigate), inputs=[state], outputs=[state, status] + blocks)
+    return demo
+
+
+def time_clicks(client, fn_indices, clicks):
+    """Times `clicks` navigations, each issuing one request per fn index (like the browser does)."""
+    samples = []
+    for _ in range(clicks):
+        start = time.perf_counter()
+        for fn_index in fn_indices:
+            client.predict(fn_index=fn_index)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:<10} mean {statistics.mean(samples):8.2f} ms   p50 {statistics.median(samples):8.2f} ms   p95 {p95:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clicks", type=int, default=50, help="navigations to time per variant")
+    parser.add_argument("--check-only", action="store_true", help="only check the outputs of the routed handlers")
+    args = parser.parse_args()
+
+    print("== Declared outputs of routed handlers ==")
+    mismatches = check_routed_outputs(app_gradio.demo)
+    for mismatch in mismatches:
+        print(f"MISMATCH  {mismatch}")
+    print(f"{len(routed_functions(app_gradio.demo))} routed events, {len(mismatches)} mismatches\n")
+    if mismatches:
+        sys.exit(1)
+    if args.check_only:
+        return
+
+    print("== Events per navigation in app_gradio ==")
+    for trigger, count in sorted(count_events_per_navigation(app_gradio.demo).items()):
+        print(f"{count:3d}  {trigger}")
+
+    demo = build_demo()
+    demo.queue()
+    _, local_url, _ = demo.launch(prevent_thread_lock=True, quiet=True)
+    try:
+        client = Client(local_url, verbose=False)
+        counts = count_events_per_navigation(demo)
+        chained_events = next(c for t, c in counts.items() if t.startswith("chained"))
+        routed_events = next(c for t, c in counts.items() if t.startswith("routed"))
+        chained_indices = list(range(chained_events))  # navigate + eight visibility events
+        routed_index = chained_events  # The routed click is registered right after the chain
+
+        print("\n== Click-to-render latency ==")
+        print(f"events per navigation: chained {chained_events}, routed {routed_events}")
+        time_clicks(client, chained_indices, 3)  # Warm up
+        report("chained", time_clicks(client, chained_indices, args.clicks))
+        report("routed", time_clicks(client, [routed_index], args.clicks))
+    finally:
+        demo.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import heapq
+import math
+import re
+import time
+
+# Splits text into runs that n-grams are built from (whitespace and punctuation break runs)
+_SEGMENT_PATTERN = re.compile(r"[^\s\u3000-\u303f\u2010-\u206f\uff00-\uff0f\uff1a-\uff20,.;:!?()\[\]{}\"'`~<>|/\\#*_=+-]+")
+
+
+def normalize_text(text):
+    """Lowercases text and folds full-width ASCII characters to half-width."""
+    chars = []
+    for ch in text:
+        code = ord(ch)
+        if 0xFF01 <= code <= 0xFF5E:
+            ch = chr(code - 0xFEE0)
+        chars.append(ch)
+    return "".join(chars).lower()
+
+
+def extract_ngrams(text, sizes=(2, 3)):
+    """
+    Yields (gram, position) pairs for the character n-grams of text.
+    Chinese has no word boundaries, so overlapping bigrams/trigrams are used as terms.
+    Runs shorter than the smallest size are kept as a single term.
+    """
+    text = normalize_text(text)
+    for match in _SEGMENT_PATTERN.finditer(text):
+        segment = match.group()
+        base = match.start()
+        if len(segment) < min(sizes):
+            yield segment, base
+            continue
+        for size in sizes:
+            for i in range(len(segment) - size + 1):
+                yield segment[i:i + size], base + i
+
+
+class ChatSearchIndex:
+    """
+    In-memory inverted index over chat history turns (Q1/A1...Qn/An) keyed by
+    character bigrams and trigrams. Dialogs are (re)indexed one at a time so the
+    index can follow save_chat_history / delete_chat_record incrementally.
+    """
+
+    COMMON_GRAM_RATIO = 0.2  # Grams in more turns than this only rescore existing candidates
+    CANDIDATES_PER_RESULT = 20  # Turns phrase-checked per requested result
+
+    def __init__(self, ngram_sizes=(2, 3)):
+        self.ngram_sizes = ngram_sizes
+        self.postings = {}  # gram -> {doc_id: [positions]}
+        self.doc_texts = {}  # doc_id -> original turn text
+        self.doc_grams = {}  # doc_id -> set of grams, used to unindex a turn
+        self.doc_ids = {}  # (dialog_key, field) -> doc_id
+        self.doc_keys = {}  # doc_id -> (dialog_key, field)
+        self.dialog_fields = {}  # dialog_key -> set of indexed fields
+        self._next_doc_id = 0
+
+    def __len__(self):
+        return len(self.dialog_fields)
+
+    def build(self, chat_data):
+        """Indexes every dialog in a discuss.json-style dict."""
+        for dialog_key, dialog in chat_data.items():
+            self.index_dialog(dialog_key, dialog)
+        return self
+
+    def index_dialog(self, dialog_key, dialog):
+        """Indexes a dialog's turns. Turns whose text did not change are left untouched."""
+        fields = {field: text for field, text in dialog.items()
+                  if re.fullmatch(r"[QA]\d+", field) and isinstance(text, str)}
+        for field in self.dialog_fields.get(dialog_key, set()) - fields.keys():
+            self._remove_doc(dialog_key, field)
+        for field, text in fields.items():
+            doc_id = self.doc_ids.get((dialog_key, field))
+            if doc_id is not None and self.doc_texts[doc_id] == text:
+                continue
+            if doc_id is not None:
+                self._remove_doc(dialog_key, field)
+            self._add_doc(dialog_key, field, text)
+
+    def index_turns(self, dialog_key, fields):
+        """Indexes newly appended turns {field: text} of a dialog without looking at its other turns."""
+        for field, text in fields.items():
+            if (dialog_key, field) in self.doc_ids:
+                self._remove_doc(dialog_key, field)
+            self._add_doc(dialog_key, field, text)
+
+    def remove_dialog(self, dialog_key):
+        """Removes all turns of a dialog from the index."""
+        for field in list(self.dialog_fields.get(dialog_key, ())):
+            self._remove_doc(dialog_key, field)
+        self.dialog_fields.pop(dialog_key, None)
+
+    def _add_doc(self, dialog_key, field, text):
+        doc_id = self._next_doc_id
+        self._next_doc_id += 1
+        self.doc_ids[(dialog_key, field)] = doc_id
+        self.doc_keys[doc_id] = (dialog_key, field)
+        self.doc_texts[doc_id] = text
+        grams = set()
+        for gram, position in extract_ngrams(text, self.ngram_sizes):
+            self.postings.setdefault(gram, {}).setdefault(doc_id, []).append(position)
+            grams.add(gram)
+        self.doc_grams[doc_id] = grams
+        self.dialog_fields.setdefault(dialog_key, set()).add(field)
+
+    def _remove_doc(self, dialog_key, field):
+        doc_id = self.doc_ids.pop((dialog_key, field), None)
+        if doc_id is None:
+            return
+        for gram in self.doc_grams.pop(doc_id, ()):
+            docs = self.postings.get(gram)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[gram]
+        del self.doc_keys[doc_id]
+        del self.doc_texts[doc_id]
+        fields = self.dialog_fields.get(dialog_key)
+        if fields is not None:
+            fields.discard(field)
+            if not fields:
+                del self.dialog_fields[dialog_key]
+
+    def _query_grams(self, query):
+        grams = [gram for gram, _ in extract_ngrams(query, self.ngram_sizes)]
+        if len(grams) == 1 and len(grams[0]) < min(self.ngram_sizes):
+            # Single-character query: expand to every indexed gram starting with it
+            prefix = grams[0]
+            return [gram for gram in self.postings if gram.startswith(prefix)]
+        return list(dict.fromkeys(grams))
+
+    def search(self, query, limit=10, snippets_per_dialog=3):
+        """
+        Returns (results, elapsed_ms). Each result is a dict:
+        {"dialog_key", "score", "snippets": [{"field", "start", "end"}]}
+        where start/end are character offsets into that turn's text.
+        Dialogs are ranked by the summed TF-IDF weight of matching grams,
+        with a bonus for turns containing the whole query verbatim.
+        """
+        start_time = time.perf_counter()
+        query = query.strip()
+        if not query:
+            return [], 0.0
+
+        total_docs = max(len(self.doc_texts), 1)
+        # Rarest grams first: they select the candidate turns. Very common grams
+        # (in more than COMMON_GRAM_RATIO of all turns) only add weight to turns
+        # that are already candidates, so a query containing e.g. "传感器" does
+        # not walk a posting list covering most of the archive.
+        gram_postings = sorted(
+            ((gram, self.postings[gram]) for gram in self._query_grams(query) if gram in self.postings),
+            key=lambda item: len(item[1]),
+        )
+        doc_scores = {}
+        doc_best_hit = {}  # doc_id -> (idf, position, gram_length) of the rarest matching gram
+        for rank, (gram, docs) in enumerate(gram_postings):
+            idf = math.log(1 + total_docs / len(docs))
+            if rank > 0 and doc_scores and len(docs) > self.COMMON_GRAM_RATIO * total_docs:
+                items = ((doc_id, docs[doc_id]) for doc_id in doc_scores if doc_id in docs)
+            else:
+                items = docs.items()
+            for doc_id, positions in items:
+                doc_scores[doc_id] = doc_scores.get(doc_id, 0.0) + idf * (1 + math.log(len(positions)))
+                if doc_id not in doc_best_hit:
+                    doc_best_hit[doc_id] = (positions[0], len(gram))
+
+        # Verbatim phrase check only on the best-scoring turns
+        candidates = heapq.nlargest(limit * self.CANDIDATES_PER_RESULT, doc_scores.items(), key=lambda item: item[1])
+        normalized_query = normalize_text(query)
+        dialog_scores = {}
+        dialog_snippets = {}
+        for doc_id, score in candidates:
+            dialog_key, field = self.doc_keys[doc_id]
+            phrase_at = normalize_text(self.doc_texts[doc_id]).find(normalized_query)
+            if phrase_at >= 0:
+                score *= 2
+                span = (phrase_at, phrase_at + len(normalized_query))
+            else:
+                position, length = doc_best_hit[doc_id]
+                span = (position, position + length)
+            dialog_scores[dialog_key] = dialog_scores.get(dialog_key, 0.0) + score
+            dialog_snippets.setdefault(dialog_key, []).append((score, field, span))
+
+        ranked = heapq.nlargest(limit, dialog_scores.items(), key=lambda item: item[1])
+        results = []
+        for dialog_key, score in ranked:
+            best = sorted(dialog_snippets[dialog_key], key=lambda item: item[0], reverse=True)[:snippets_per_dialog]
+            results.append({
+                "dialog_key": dialog_key,
+                "score": round(score, 4),
+                "snippets": [{"field": field, "start": span[0], "end": span[1]} for _, field, span in best],
+            })
+        return results, (time.perf_counter() - start_time) * 1000
+
+    def snippet_text(self, dialog_key, snippet, context=15):
+        """Returns the text around a snippet offset, for display."""
+        doc_id = self.doc_ids.get((dialog_key, snippet["field"]))
+        if doc_id is None:
+            return ""
+        text = self.doc_texts[doc_id]
+        begin = max(0, snippet["start"] - context)
+        end = min(len(text), snippet["end"] + context)
+        prefix = "..." if begin > 0 else ""
+        suffix = "..." if end < len(text) else ""
+        return prefix + text[begin:end].replace("\n", " ") + suffix
@@ -0,0 +1,281 @@
+import json
+import os
+
+from snapshot_format import SNAPSHOT_SUFFIX, SnapshotReader, field_summary, write_snapshot
+from storage import atomic_write_json, file_lock, read_json, update_json
+
+PREVIEW_CHARS = 30 # First question characters shown in the history list
+
+
+def dialog_pairs(conversation_history):
+    """Pairs a conversation history into [(question, answer)] turns; a trailing unanswered question is left out."""
+    pairs = []
+    for i in range(len(conversation_history) // 2):
+        question, answer = conversation_history[i * 2], conversation_history[i * 2 + 1]
+        pairs.append((question["content"] if question.get("role") == "user" else None,
+                      answer["content"] if answer.get("role") == "assistant" else None))
+    return pairs
+
+
+def dialog_preview(dialog):
+    """First question of a dialog, cut for the history list."""
+    return (dialog.get("Q1") or "无提问内容")[:PREVIEW_CHARS]
+
+
+def dialog_record(pairs):
+    """A dialog {"num": n, "Q1": ..., "A1": ..., ...} in the discuss.json layout holding the given turns."""
+    data = {}
+    _apply_turns(data, "dialog", pairs, 0)
+    return data["dialog"]
+
+
+def _next_dialog_key(data):
+    dialog_num = 1
+    while f"dialog{dialog_num}" in data:
+        dialog_num += 1
+    return f"dialog{dialog_num}"
+
+
+def _apply_turns(data, dialog_key, pairs, start):
+    """Sets turns start+1.. of a dialog in the discuss.json layout and returns the fields written."""
+    dialog = data.setdefault(dialog_key, {"num": 0})
+    fields = {}
+    for turn, (question, answer) in enumerate(pairs, start + 1):
+        if question is not None:
+            fields[f"Q{turn}"] = question
+        if answer is not None:
+            fields[f"A{turn}"] = answer
+    dialog.update(fields)
+    dialog["num"] = max(dialog.get("num", 0), start + len(pairs))
+    return fields
+
+
+class JsonChatStore:
+    """
+    Chat records kept as one JSON document (discuss.json):
+    {"dialogN": {"num": n, "Q1": ..., "A1": ..., ...}}
+    Appending turns touches only the new fields, but the document is still
+    rewritten as a whole on every save; JournalChatStore, the default, is not.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load_all(self):
+        return read_json(self.path, default=dict)
+
+    def load_dialog(self, dialog_key):
+        """One dialog, or None if it does not exist."""
+        return self.load_all().get(dialog_key)
+
+    def list_dialogs(self):
+        """[(dialog_key, dialog_preview)] in storage order."""
+        return [(dialog_key, dialog_preview(dialog)) for dialog_key, dialog in self.load_all().items()]
+
+    def _document_exists(self):
+        return os.path.exists(self.path)
+
+    def exists(self):
+        """Whether any chat record has been stored."""
+        return self._document_exists()
+
+    def append_turns(self, dialog_key, pairs, persisted=0):
+        """
+        Writes the turns pairs[persisted:] of a dialog; the first `persisted` turns are
+        already stored and are not touched. A missing dialog_key (None or deleted), or
+        one holding fewer than `persisted` turns (deleted, then reused by another dialog),
+        gets a new dialogN key and all turns are written.
+        Returns (dialog_key, {field: text} of the fields written).
+        """
+        with update_json(self.path) as doc:
+            if not dialog_key or doc.data.get(dialog_key, {}).get("num", -1) < persisted:
+                dialog_key, persisted = _next_dialog_key(doc.data), 0
+            fields = _apply_turns(doc.data, dialog_key, pairs[persisted:], persisted)
+            if not fields and persisted:
+                doc.discard()
+        return dialog_key, fields
+
+    def compact(self):
+        """Brings the document up to date with every stored turn (it always is here)."""
+
+    def delete_dialog(self, dialog_key):
+        """Removes a dialog. Returns False if it does not exist."""
+        with update_json(self.path) as doc:
+            found = doc.data.pop(dialog_key, None) is not None
+            if not found:
+                doc.discard()
+        return found
+
+
+class JournalChatStore(JsonChatStore):
+    """
+    discuss.json plus an append-only journal (discuss.json.journal) of JSON lines
+    {"dialog": key, "start": n, "turns": [[question, answer], ...]}.
+    A save appends and fsyncs only its new turns; readers replay the journal over
+    the document, and the journal is folded into discuss.json once it grows past
+    compact_bytes (or on delete). Other programs reading discuss.json directly
+    only see turns up to the last compaction, so both apps compact when a session
+    closes (AppLogic.close(), the Tk window's on_close).
+    """
+
+    def __init__(self, path, compact_bytes=256 * 1024):
+        super().__init__(path)
+        self.journal_path = path + ".journal"
+        self.compact_bytes = compact_bytes
+
+    def exists(self):
+        return self._document_exists() or os.path.exists(self.journal_path)
+
+    def _read_document(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def _read_document_dialog(self, dialog_key):
+        return self._read_document().get(dialog_key)
+
+    def _write_document(self, data):
+        atomic_write_json(self.path, data)
+
+    def _journal_records(self, dialog_key=None):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError: # Torn write of a crashed save
+                    continue
+                if dialog_key is None or record["dialog"] == dialog_key:
+                    yield record
+
+    def _replay(self):
+        """Document plus journal; the caller holds the lock."""
+        data = self._read_document()
+        for record in self._journal_records():
+            _apply_turns(data, record["dialog"], record["turns"], record["start"])
+        return data
+
+    def load_all(self):
+        with file_lock(self.path, shared=True):
+            return self._replay()
+
+    def _stored_dialog(self, dialog_key):
+        """One dialog from the document plus its journal records; the caller holds the lock."""
+        dialog = self._read_document_dialog(dialog_key)
+        data = {dialog_key: dialog} if dialog is not None else {}
+        for record in self._journal_records(dialog_key):
+            _apply_turns(data, dialog_key, record["turns"], record["start"])
+        return data.get(dialog_key)
+
+    def load_dialog(self, dialog_key):
+        with file_lock(self.path, shared=True):
+            return self._stored_dialog(dialog_key)
+
+    def _compact(self, data):
+        self._write_document(data)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def compact(self):
+        """Folds the journal into discuss.json."""
+        with file_lock(self.path):
+            if os.path.exists(self.journal_path):
+                self._compact(self._replay())
+
+    def append_turns(self, dialog_key, pairs, persisted=0):
+        with file_lock(self.path):
+            # Continuing a dialog only reads that dialog; a new one needs all keys (to pick a free one)
+            dialog = self._stored_dialog(dialog_key) if dialog_key else None
+            if dialog is None or dialog.get("num", 0) < persisted:
+                dialog_key, persisted = _next_dialog_key(self._replay()), 0
+                if not self._document_exists(): # Keep the document present for readers that check it
+                    self._write_document({})
+            new_turns = pairs[persisted:]
+            if not new_turns:
+                return dialog_key, {}
+            record = {"dialog": dialog_key, "start": persisted, "turns": [list(pair) for pair in new_turns]}
+            with open(self.journal_path, "ab") as file:
+                if file.tell() and not self._ends_with_newline():
+                    file.write(b"\n") # Do not glue onto a torn last line
+                file.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                file.flush()
+                os.fsync(file.fileno())
+            if os.path.getsize(self.journal_path) > self.compact_bytes:
+                self._compact(self._replay())
+        return dialog_key, _apply_turns({}, dialog_key, new_turns, persisted)
+
+    def _ends_with_newline(self):
+        with open(self.journal_path, "rb") as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b"\n"
+
+    def delete_dialog(self, dialog_key):
+        with file_lock(self.path):
+            data = self._replay()
+            found = data.pop(dialog_key, None) is not None
+            if found:
+                self._compact(data)
+        return found
+
+
+class SnapshotChatStore(JournalChatStore):
+    """
+    Like JournalChatStore, but compactions write the binary snapshot format
+    (discuss.snap, see snapshot_format.py) instead of discuss.json, so
+    load_dialog() decodes one dialog instead of parsing the whole archive, and
+    list_dialogs() reads the first question previews stored with each record.
+    Convert an existing discuss.json with
+    `python snapshot_format.py to-snapshot discuss.json --summary-field Q1`.
+    """
+
+    def __init__(self, path, compact_bytes=256 * 1024):
+        super().__init__(path, compact_bytes)
+        self.snapshot_path = os.path.splitext(path)[0] + SNAPSHOT_SUFFIX
+
+    def _document_exists(self):
+        return os.path.exists(self.snapshot_path)
+
+    def _read_document(self):
+        if not os.path.exists(self.snapshot_path):
+            return {}
+        with SnapshotReader(self.snapshot_path) as snapshot:
+            return snapshot.to_dict()
+
+    def _read_document_dialog(self, dialog_key):
+        if not os.path.exists(self.snapshot_path):
+            return None
+        with SnapshotReader(self.snapshot_path) as snapshot:
+            return snapshot.get(dialog_key)
+
+    def _write_document(self, data):
+        write_snapshot(self.snapshot_path, data, summary=field_summary("Q1"))
+
+    def list_dialogs(self):
+        with file_lock(self.path, shared=True):
+            previews = {}
+            if os.path.exists(self.snapshot_path):
+                with SnapshotReader(self.snapshot_path) as snapshot:
+                    if snapshot.has_summaries:
+                        previews = {dialog_key: dialog_preview({"Q1": question})
+                                    for dialog_key, question in snapshot.summaries()}
+                    else: # Converted without --summary-field: decoded until the next compaction
+                        previews = {dialog_key: dialog_preview(dialog) for dialog_key, dialog in snapshot.items()}
+            for record in self._journal_records():
+                if record["start"] == 0 and record["turns"]: # First turns of a new dialog
+                    previews[record["dialog"]] = dialog_preview({"Q1": record["turns"][0][0]})
+                else:
+                    previews.setdefault(record["dialog"], dialog_preview({}))
+        return list(previews.items())
+
+
+# Values of AppLogic.chat_storage_backend
+CHAT_STORE_BACKENDS = {"json": JsonChatStore, "journal": JournalChatStore, "snapshot": SnapshotChatStore}
+
+
+def open_chat_store(path, backend="journal"):
+    try:
+        return CHAT_STORE_BACKENDS[backend](path)
+    except KeyError:
+        raise ValueError(f"未知的聊天记录存储方式: {backend!r}（可选: {', '.join(CHAT_STORE_BACKENDS)}）") from None
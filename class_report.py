@@ -0,0 +1,140 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from batch_grading import POINTS_PER_QUESTION, load_exam
+from question_bank import QUESTION_TYPES, tag_topics
+
+# Upper/lower group size for the discrimination index (Kelley's 27%)
+DISCRIMINATION_GROUP = 0.27
+
+
+def load_score_matrix(results_path, num_questions):
+    """
+    Loads batch_grading output into (student_ids, scores) where scores is a
+    float32 students x questions matrix (unanswered and failed gradings count as 0).
+    """
+    student_ids = []
+    rows = []
+    with open(results_path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            row = [0.0] * num_questions
+            for index, evaluation in record.get("evaluations", {}).items():
+                index = int(index)
+                if 0 <= index < num_questions:
+                    row[index] = evaluation.get("score", 0)
+            student_ids.append(record["student_id"])
+            rows.append(row)
+    return student_ids, np.asarray(rows, dtype=np.float32).reshape(len(rows), num_questions)
+
+
+def build_class_report(questions, student_ids, scores, max_score=POINTS_PER_QUESTION):
+    """
+    Computes the class statistics from a students x questions score matrix:
+      questions: per-question difficulty (mean score ratio, higher is easier),
+                 discrimination (upper 27% minus lower 27% score ratio) and miss rate
+      types:     average score ratio per question type
+      topics:    average miss rate per topic tag, most missed first
+      students:  total score and percentile rank per student
+    """
+    num_students, num_questions = scores.shape
+    ratios = scores / max_score
+    totals = scores.sum(axis=1)
+
+    difficulty = ratios.mean(axis=0) if num_students else np.zeros(num_questions)
+    group_size = max(1, int(round(num_students * DISCRIMINATION_GROUP))) if num_students else 0
+    order = np.argsort(totals, kind="stable")
+    if group_size:
+        discrimination = ratios[order[-group_size:]].mean(axis=0) - ratios[order[:group_size]].mean(axis=0)
+    else:
+        discrimination = np.zeros(num_questions)
+    miss_rate = (ratios < 1).mean(axis=0) if num_students else np.zeros(num_questions)
+
+    # Percentile rank: share of the class scoring at or below each student
+    sorted_totals = totals[order]
+    percentiles = np.searchsorted(sorted_totals, totals, side="right") / max(num_students, 1) * 100
+
+    question_types = np.array([question.get("type", "") for question in questions])
+    type_averages = {}
+    for question_type in QUESTION_TYPES:
+        mask = question_types == question_type
+        if mask.any() and num_students:
+            type_averages[question_type] = round(float(ratios[:, mask].mean()), 4)
+
+    # Topic membership matrix (questions x topics) so topic miss rates are one matrix product
+    question_topics = [tag_topics(question) for question in questions]
+    topics = sorted({topic for tags in question_topics for topic in tags})
+    membership = np.zeros((num_questions, len(topics)), dtype=np.float32)
+    for index, tags in enumerate(question_topics):
+        for topic in tags:
+            membership[index, topics.index(topic)] = 1
+    topic_counts = membership.sum(axis=0)
+    topic_miss = (miss_rate @ membership) / np.maximum(topic_counts, 1)
+    topic_report = sorted(
+        ({"topic": topic, "questions": int(topic_counts[i]), "miss_rate": round(float(topic_miss[i]), 4)}
+         for i, topic in enumerate(topics)),
+        key=lambda item: item["miss_rate"], reverse=True,
+    )
+
+    return {
+        "num_students": num_students,
+        "num_questions": num_questions,
+        "mean_total": round(float(totals.mean()), 2) if num_students else 0.0,
+        "questions": [
+            {
+                "index": index,
+                "type": questions[index].get("type", ""),
+                "description": questions[index].get("description", "")[:40],
+                "difficulty": round(float(difficulty[index]), 4),
+                "discrimination": round(float(discrimination[index]), 4),
+                "miss_rate": round(float(miss_rate[index]), 4),
+            }
+            for index in range(num_questions)
+        ],
+        "types": type_averages,
+        "topics": topic_report,
+        "students": [
+            {"student_id": student_id, "total": float(totals[i]), "percentile": round(float(percentiles[i]), 1)}
+            for i, student_id in enumerate(student_ids)
+        ],
+    }
+
+
+def format_class_report(report, top_topics=5):
+    """Plain-text summary for teachers."""
+    lines = [f"学生人数: {report['num_students']}，题目数: {report['num_questions']}，平均总分: {report['mean_total']}"]
+    lines.append("各题型得分率: " + "，".join(f"{t} {v:.0%}" for t, v in report["types"].items()))
+    lines.append("失分最多的知识点:")
+    for item in report["topics"][:top_topics]:
+        lines.append(f"  {item['topic']}: 失分率 {item['miss_rate']:.0%}（{item['questions']} 题）")
+    lines.append("题号  题型  难度(得分率)  区分度  题目")
+    for item in report["questions"]:
+        flag = "  <- 区分度低" if item["discrimination"] < 0.2 else ""
+        lines.append(f"{item['index'] + 1:>4}  {item['type']}  {item['difficulty']:>10.2f}  {item['discrimination']:>6.2f}  {item['description']}{flag}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Class report from batch_grading.py results.")
+    parser.add_argument("exam", help="exam JSON used for grading")
+    parser.add_argument("results", help="results JSONL written by batch_grading.py")
+    parser.add_argument("--json", help="also write the full report to this JSON file")
+    args = parser.parse_args()
+
+    exam_questions = load_exam(args.exam)
+    start_time = time.perf_counter()
+    ids, score_matrix = load_score_matrix(args.results, len(exam_questions))
+    loaded_time = time.perf_counter()
+    class_report = build_class_report(exam_questions, ids, score_matrix)
+    done_time = time.perf_counter()
+    print(format_class_report(class_report))
+    print(f"Loaded {len(ids)} students in {(loaded_time - start_time) * 1000:.1f} ms, "
+          f"computed report in {(done_time - loaded_time) * 1000:.1f} ms")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(class_report, file, ensure_ascii=False, indent=4)
@@ -0,0 +1,89 @@
+import threading
+
+DEFAULT_KEY_FILE = "key.txt"
+DEFAULT_OPENAI_API_BASE = "https://api.chatfire.cn/v1"
+
+
+def get_key(filename=DEFAULT_KEY_FILE):
+    """
+    Reads API keys from a file.
+    Expects two lines: dashscope_key, openai_key
+    """
+    try:
+        with open(filename, 'r') as file:
+            lines = file.readlines()
+            dashscope_key = lines[0].strip()
+            openai_key = lines[1].strip()
+        return dashscope_key, openai_key
+    except FileNotFoundError:
+        print(f"Error: {filename} not found. Please create it with your API keys.")
+        return None, None
+    except IndexError:
+        print(f"Error: {filename} format incorrect. Expecting two lines.")
+        return None, None
+    except Exception as e:
+        print(f"Error reading API keys: {e}")
+        return None, None
+
+
+class Config:
+    """
+    API credentials and endpoint. key.txt is read the first time a key is asked
+    for, and each SDK is imported and configured the first time it is used, so
+    importing the app modules costs neither.
+    """
+
+    def __init__(self, key_file=DEFAULT_KEY_FILE, openai_api_base=DEFAULT_OPENAI_API_BASE):
+        self.key_file = key_file
+        self.openai_api_base = openai_api_base
+        self._keys = None
+        self._openai = None
+        self._dashscope = None
+        self._lock = threading.Lock() # The voice thread and request threads may load SDKs concurrently
+
+    def _get_keys(self):
+        if self._keys is None:
+            self._keys = get_key(self.key_file)
+        return self._keys
+
+    @property
+    def dashscope_api_key(self):
+        return self._get_keys()[0]
+
+    @property
+    def openai_api_key(self):
+        return self._get_keys()[1]
+
+    def load_openai(self):
+        """Imports the openai SDK with the key and API base applied."""
+        with self._lock:
+            if self._openai is None:
+                import openai
+                if self.openai_api_key:
+                    openai.api_key = self.openai_api_key
+                openai.api_base = self.openai_api_base
+                self._openai = openai
+            return self._openai
+
+    def load_dashscope(self):
+        """Imports the dashscope SDK (speech recognition) with the key applied."""
+        with self._lock:
+            if self._dashscope is None:
+                import dashscope
+                if self.dashscope_api_key:
+                    dashscope.api_key = self.dashscope_api_key
+                self._dashscope = dashscope
+            return self._dashscope
+
+
+_default_config = None
+_default_config_lock = threading.Lock()
+
+
+def get_config():
+    """The process-wide configuration shared by the Gradio app, the Tk app and the CLIs."""
+    global _default_config
+    with _default_config_lock:
+        if _default_config is None:
+            _default_config = Config()
+        return _default_config
@@ -0,0 +1,181 @@
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+
+from chat_search import extract_ngrams
+
+# Postings are stored as little-endian (chunk_id, term_frequency) uint32 pairs
+_POSTING = struct.Struct("<II")
+_SUPPORTED_EXTENSIONS = (".txt", ".md")
+
+
+def tokenize(text):
+    """Character bigrams (single characters for short runs), as used by the chat search."""
+    return [gram for gram, _ in extract_ngrams(text, sizes=(2,))]
+
+
+def chunk_text(text, chunk_size=400, overlap=80):
+    """
+    Splits a document into chunks of about chunk_size characters.
+    Paragraphs are kept together where possible; long paragraphs are cut with
+    `overlap` characters repeated between consecutive pieces.
+    """
+    chunks = []
+    current = ""
+    for paragraph in (p.strip() for p in text.split("\n")):
+        if not paragraph:
+            continue
+        while len(paragraph) > chunk_size:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:chunk_size])
+            paragraph = paragraph[chunk_size - overlap:]
+        if current and len(current) + len(paragraph) + 1 > chunk_size:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def ingest_course_materials(source_dir="course_materials", index_dir="course_index", chunk_size=400, overlap=80):
+    """
+    Chunks every .txt/.md file under source_dir and writes a BM25 index to index_dir:
+      chunks.jsonl  one {"source", "text"} record per chunk
+      postings.bin  (chunk_id, tf) pairs, grouped by term
+      lexicon.json  term -> [byte offset, document frequency], chunk lengths and offsets
+    Returns the number of chunks indexed.
+    """
+    postings = {}  # term -> {chunk_id: tf}
+    chunk_lengths = []
+    chunk_offsets = []
+    os.makedirs(index_dir, exist_ok=True)
+
+    with open(os.path.join(index_dir, "chunks.jsonl"), "wb") as chunk_file:
+        for root, _, files in os.walk(source_dir):
+            for name in sorted(files):
+                if not name.lower().endswith(_SUPPORTED_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                with open(path, "r", encoding="utf-8") as file:
+                    text = file.read()
+                for chunk in chunk_text(text, chunk_size, overlap):
+                    chunk_id = len(chunk_lengths)
+                    terms = tokenize(chunk)
+                    for term in terms:
+                        tfs = postings.setdefault(term, {})
+                        tfs[chunk_id] = tfs.get(chunk_id, 0) + 1
+                    chunk_lengths.append(len(terms))
+                    chunk_offsets.append(chunk_file.tell())
+                    record = {"source": os.path.relpath(path, source_dir), "text": chunk}
+                    chunk_file.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    lexicon = {}
+    with open(os.path.join(index_dir, "postings.bin"), "wb") as postings_file:
+        for term, tfs in postings.items():
+            lexicon[term] = [postings_file.tell(), len(tfs)]
+            postings_file.write(b"".join(_POSTING.pack(chunk_id, tf) for chunk_id, tf in sorted(tfs.items())))
+
+    meta = {
+        "num_chunks": len(chunk_lengths),
+        "avg_chunk_length": (sum(chunk_lengths) / len(chunk_lengths)) if chunk_lengths else 0.0,
+        "chunk_lengths": chunk_lengths,
+        "chunk_offsets": chunk_offsets,
+        "terms": lexicon,
+    }
+    with open(os.path.join(index_dir, "lexicon.json"), "w", encoding="utf-8") as file:
+        json.dump(meta, file, ensure_ascii=False)
+    return len(chunk_lengths)
+
+
+class BM25Retriever:
+    """
+    Reads an index written by ingest_course_materials. Postings and chunk texts
+    are memory-mapped, so a query only touches the postings of its own terms
+    and the text of the chunks it returns.
+    """
+
+    def __init__(self, index_dir="course_index", k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        with open(os.path.join(index_dir, "lexicon.json"), "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        self.num_chunks = meta["num_chunks"]
+        self.avg_chunk_length = meta["avg_chunk_length"] or 1.0
+        self.chunk_lengths = meta["chunk_lengths"]
+        self.chunk_offsets = meta["chunk_offsets"]
+        self.terms = meta["terms"]
+        self._postings_file = open(os.path.join(index_dir, "postings.bin"), "rb")
+        self._chunks_file = open(os.path.join(index_dir, "chunks.jsonl"), "rb")
+        # mmap cannot map empty files
+        self._postings = mmap.mmap(self._postings_file.fileno(), 0, access=mmap.ACCESS_READ) if self.terms else b""
+        self._chunks = mmap.mmap(self._chunks_file.fileno(), 0, access=mmap.ACCESS_READ) if self.num_chunks else b""
+
+    def close(self):
+        for mapped in (self._postings, self._chunks):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        self._postings_file.close()
+        self._chunks_file.close()
+
+    def get_chunk(self, chunk_id):
+        start = self.chunk_offsets[chunk_id]
+        end = self._chunks.find(b"\n", start)
+        return json.loads(self._chunks[start:end if end >= 0 else len(self._chunks)].decode("utf-8"))
+
+    def search(self, query, top_k=3):
+        """
+        Returns (chunks, elapsed_ms) where chunks is a list of
+        {"chunk_id", "score", "source", "text"} for the top_k BM25 matches.
+        """
+        start_time = time.perf_counter()
+        scores = {}
+        for term in set(tokenize(query)):
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            offset, df = entry
+            idf = math.log(1 + (self.num_chunks - df + 0.5) / (df + 0.5))
+            for chunk_id, tf in _POSTING.iter_unpack(self._postings[offset:offset + df * _POSTING.size]):
+                norm = 1 - self.b + self.b * self.chunk_lengths[chunk_id] / self.avg_chunk_length
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        results = []
+        for chunk_id, score in top:
+            chunk = self.get_chunk(chunk_id)
+            results.append({"chunk_id": chunk_id, "score": round(score, 4), "source": chunk["source"], "text": chunk["text"]})
+        return results, (time.perf_counter() - start_time) * 1000
+
+
+def format_course_context(chunks):
+    """Builds the per-turn system message that grounds the answer in the retrieved chunks."""
+    lines = ["以下是与学生问题相关的教材片段，请优先依据这些内容作答；若片段与问题无关，请忽略它们："]
+    for i, chunk in enumerate(chunks, 1):
+        lines.append(f"[{i}]（{chunk['source']}）{chunk['text']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python course_retrieval.py ingest [course_materials] [course_index]
+    # python course_retrieval.py query "问题" [course_index]
+    if len(sys.argv) >= 2 and sys.argv[1] == "ingest":
+        source = sys.argv[2] if len(sys.argv) > 2 else "course_materials"
+        target = sys.argv[3] if len(sys.argv) > 3 else "course_index"
+        count = ingest_course_materials(source, target)
+        print(f"Indexed {count} chunks from {source} into {target}")
+    elif len(sys.argv) >= 3 and sys.argv[1] == "query":
+        retriever = BM25Retriever(sys.argv[3] if len(sys.argv) > 3 else "course_index")
+        chunks, elapsed_ms = retriever.search(sys.argv[2])
+        for chunk in chunks:
+            print(f"{chunk['score']:8.3f}  {chunk['source']}  {chunk['text'][:60]}")
+        print(f"Retrieved {len(chunks)} chunks in {elapsed_ms:.2f} ms")
+        retriever.close()
+    else:
+        print("Usage: python course_retrieval.py ingest [source_dir] [index_dir] | query \"问题\" [index_dir]")
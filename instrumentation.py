@@ -0,0 +1,264 @@
+import math
+import threading
+import time
+from collections import deque
+
+# Histogram bucket upper bounds (Prometheus "le"), +Inf is implicit
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+QUANTILES = (0.5, 0.9, 0.99)
+
+# USD per million prompt / completion tokens, for the cost counter
+MODEL_PRICES = {"gpt-4o": (2.5, 10.0)}
+
+
+class Histogram:
+    """Cumulative-bucket histogram (as Prometheus exposes them) with interpolated quantiles."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate of the q-quantile, interpolated linearly within its bucket; None if empty."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if i == len(self.buckets): # Beyond the last bound: the best we can say is "above it"
+                    return float(self.buckets[-1])
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return float(self.buckets[-1])
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """
+    In-process counters and histograms keyed by name and labels, plus collectors
+    that report the stats dicts other components already keep (storage lock waits,
+    the write-behind queue). Rendered as Prometheus text or as JSON with quantiles.
+    """
+
+    def __init__(self, recent_spans=200):
+        self._lock = threading.Lock()
+        self._counters = {} # (name, label key) -> value
+        self._histograms = {} # (name, label key) -> Histogram
+        self._help = {}
+        self._collectors = {} # prefix -> function returning {name: number}
+        self.recent_spans = deque(maxlen=recent_spans)
+
+    def inc(self, name, amount=1, labels=None, help_text=None):
+        with self._lock:
+            key = (name, _label_key(labels))
+            self._counters[key] = self._counters.get(key, 0) + amount
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def observe(self, name, value, labels=None, buckets=LATENCY_BUCKETS, help_text=None):
+        with self._lock:
+            key = (name, _label_key(labels))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+            if help_text:
+                self._help.setdefault(name, help_text)
+
+    def register_collector(self, prefix, collect):
+        """collect() returns {name: number}; exported as gauges named prefix_name."""
+        with self._lock:
+            self._collectors[prefix] = collect
+
+    def add_span(self, span):
+        with self._lock:
+            self.recent_spans.append(span)
+
+    def _collect(self):
+        gauges = {}
+        for prefix, collect in list(self._collectors.items()):
+            try:
+                for name, value in collect().items():
+                    if isinstance(value, (int, float)):
+                        gauges[f"{prefix}_{name}"] = value
+            except Exception as e:
+                print(f"Metrics collector {prefix} failed: {e}")
+        return gauges
+
+    def to_prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            help_texts = dict(self._help)
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in help_texts:
+                    lines.append(f"# HELP {name} {help_texts[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, key), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        for (name, key), histogram in histograms:
+            describe(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + (math.inf,), histogram.counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(key)} {_format_value(histogram.sum)}")
+            lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        for name, value in sorted(self._collect().items()):
+            describe(name, "gauge")
+            lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self, recent=20):
+        """Counters, histogram count/sum/mean/quantiles, collector gauges and the most recent spans."""
+        with self._lock:
+            counters = [{"name": name, "labels": dict(key), "value": value}
+                        for (name, key), value in sorted(self._counters.items())]
+            histograms = []
+            for (name, key), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                entry = {"name": name, "labels": dict(key), "count": histogram.count, "sum": histogram.sum,
+                         "mean": histogram.sum / histogram.count if histogram.count else None}
+                for q in QUANTILES:
+                    entry[f"p{round(q * 100)}"] = histogram.quantile(q)
+                histograms.append(entry)
+            spans = list(self.recent_spans)[-recent:] if recent else []
+        return {"counters": counters, "histograms": histograms, "gauges": self._collect(), "recent_spans": spans}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.recent_spans.clear()
+
+
+_default_registry = MetricsRegistry()
+
+
+def get_registry():
+    """The process-wide registry read by the /metrics endpoint."""
+    return _default_registry
+
+
+class LLMSpan:
+    """
+    One LLM call. Records, when finished: latency, time to first token, prompt and
+    completion tokens and estimated cost, labelled by call site (chat, generation,
+    grading) and outcome.
+    """
+
+    def __init__(self, call_site, model=None, registry=None):
+        self.call_site = call_site
+        self.model = model
+        self.registry = registry or _default_registry
+        self.start = time.perf_counter()
+        self.first_token_at = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+
+    def first_token(self):
+        """Marks the arrival of the first streamed token."""
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def record_usage(self, usage):
+        """Takes the "usage" object of a completion response (prompt_tokens, completion_tokens)."""
+        if usage:
+            self.prompt_tokens = usage.get("prompt_tokens")
+            self.completion_tokens = usage.get("completion_tokens")
+
+    def finish(self, error=None):
+        end = time.perf_counter()
+        latency = end - self.start
+        # Without streaming the whole reply arrives at once, so the first token comes with it
+        ttft = (self.first_token_at or end) - self.start
+        outcome = "error" if error else "ok"
+        registry = self.registry
+        site = {"call_site": self.call_site}
+        registry.inc("llm_calls_total", labels={**site, "outcome": outcome}, help_text="LLM calls by call site and outcome")
+        registry.observe("llm_call_duration_seconds", latency, labels=site, help_text="LLM call latency")
+        registry.observe("llm_time_to_first_token_seconds", ttft, labels=site, help_text="Time until the first reply token")
+        cost = None
+        if self.prompt_tokens is not None and self.completion_tokens is not None:
+            for kind, tokens in (("prompt", self.prompt_tokens), ("completion", self.completion_tokens)):
+                registry.inc("llm_tokens_total", tokens, labels={**site, "type": kind}, help_text="Tokens used by LLM calls")
+                registry.observe(f"llm_{kind}_tokens", tokens, labels=site, buckets=TOKEN_BUCKETS,
+                                 help_text=f"{kind.capitalize()} tokens per LLM call")
+            prices = MODEL_PRICES.get(self.model)
+            if prices:
+                cost = (self.prompt_tokens * prices[0] + self.completion_tokens * prices[1]) / 1e6
+                registry.inc("llm_cost_usd_total", cost, labels=site, help_text="Estimated LLM cost in USD")
+        registry.add_span({
+            "call_site": self.call_site, "model": self.model, "outcome": outcome,
+            "error": str(error)[:200] if error else None, "started_at": time.time() - latency,
+            "latency_s": round(latency, 4), "ttft_s": round(ttft, 4),
+            "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+            "cost_usd": cost,
+        })
+
+
+def timed_completion(call_site, create, **kwargs):
+    """Runs create(**kwargs) (e.g. openai.ChatCompletion.create) inside an LLMSpan and returns the response."""
+    span = LLMSpan(call_site, kwargs.get("model"))
+    try:
+        response = create(**kwargs)
+    except Exception as e:
+        span.finish(error=e)
+        raise
+    span.record_usage(response.get("usage"))
+    span.finish()
+    return response
+
+
+def record_retry(call_site, registry=None):
+    """An LLM call repeated because the previous one was rejected or came back incomplete."""
+    (registry or _default_registry).inc("llm_retries_total", labels={"call_site": call_site},
+                                        help_text="LLM calls repeated after a rejected or incomplete reply")
+
+
+def record_cache_hit(call_site, count=1, registry=None):
+    """LLM calls avoided because an earlier result was reused."""
+    (registry or _default_registry).inc("llm_cache_hits_total", count, labels={"call_site": call_site},
+                                        help_text="LLM calls avoided by reusing an earlier result")
@@ -0,0 +1,143 @@
+import json
+import re
+
+# Structural characters of the {key="value", ...} micro-format, full-width variants included.
+# They only count outside quoted values, so "1+1=？" or "床前明月光，" inside a value are kept as is.
+OPEN_BRACES = "{｛"
+CLOSE_BRACES = "}｝"
+QUOTES = {'"': '"', "'": "'", "“": "”", "‘": "’", "「": "」"}
+ESCAPES = {'"': '"', "'": "'", "\\": "\\", "/": "/", "n": "\n", "t": "\t", "r": "\r"}
+
+_NEXT_OPEN = re.compile(r"[{｛]")
+_SKIP = re.compile(r"[\s,，;；、]*")
+_KEY = re.compile(r"[\"“]?([A-Za-z_][A-Za-z0-9_]*)[\"”]?\s*[=:＝：]\s*")
+# Stray prose inside a record runs up to the next thing that looks like a key, or a brace
+_PROSE = re.compile(r".*?(?=(?<![A-Za-z0-9_])[\"“]?[A-Za-z_][A-Za-z0-9_]*[\"”]?\s*[=:＝：]|[{}｛｝]|\Z)", re.S)
+# A bare value also ends where prose-style "score: 8 reason: ..." starts the next key
+_BARE_VALUE = re.compile(r"(?:(?!\s+[A-Za-z_][A-Za-z0-9_]*\s*[=:＝：])[^,，;；}｝\n])*")
+# A quote closes a value only if the record continues (or ends) right after it;
+# other quotes are taken as part of the text (LLMs rarely escape inner quotes)
+_CLOSE_OK = re.compile(r"[ \t]*(?:[,，;；}｝{｛]|\r?\n|\Z)")
+_STRING_STOP = {close: re.compile("[\\\\" + re.escape(close) + "]") for close in set(QUOTES.values())}
+_HEX4 = re.compile(r"[0-9a-fA-F]{4}")
+_NUMBER = re.compile(r"[-+]?\d+(?:\.\d+)?")
+_FULL_WIDTH_DIGITS = str.maketrans("０１２３４５６７８９．", "0123456789.")
+
+
+def _parse_string(text, i, close):
+    """Reads a quoted value whose opening quote ends before i. Returns (value, index after the closing quote)."""
+    stop = _STRING_STOP[close]
+    parts = []
+    while True:
+        match = stop.search(text, i)
+        if match is None: # Unterminated (truncated response): keep what is there
+            parts.append(text[i:])
+            return "".join(parts), len(text)
+        j = match.start()
+        parts.append(text[i:j])
+        if text[j] == "\\":
+            escaped = text[j + 1:j + 2]
+            if escaped == "u" and _HEX4.match(text, j + 2):
+                parts.append(chr(int(text[j + 2:j + 6], 16)))
+                i = j + 6
+            elif escaped in ESCAPES and escaped:
+                parts.append(ESCAPES[escaped])
+                i = j + 2
+            else: # Not an escape we know (e.g. LaTeX \frac): keep the backslash
+                parts.append("\\")
+                i = j + 1
+        elif _CLOSE_OK.match(text, j + 1):
+            return "".join(parts), j + 1
+        else:
+            parts.append(close)
+            i = j + 1
+
+
+def _parse_value(text, i):
+    if i < len(text) and text[i] in QUOTES:
+        return _parse_string(text, i + 1, QUOTES[text[i]])
+    match = _BARE_VALUE.match(text, i)
+    return match.group().strip(), match.end()
+
+
+def _parse_record(text, i):
+    """Parses key/value pairs from i up to the closing brace. Returns (record, index after it)."""
+    record = {}
+    end = len(text)
+    while True:
+        i = _SKIP.match(text, i).end()
+        if i >= end:
+            return record, end
+        char = text[i]
+        if char in CLOSE_BRACES:
+            return record, i + 1
+        if char in OPEN_BRACES: # The next record starts before this one was closed
+            return record, i
+        match = _KEY.match(text, i)
+        if match is None:
+            i = max(_PROSE.match(text, i).end(), i + 1)
+            continue
+        record[match.group(1)], i = _parse_value(text, match.end())
+
+
+def iter_records(text):
+    """
+    Yields the {key="value", ...} records found in an LLM response, left to right
+    without going back over text already consumed. It is not a character-by-character
+    tokenizer: skipping prose and ending a bare value are regex matches that look
+    ahead for the next key (_PROSE, _BARE_VALUE), which keeps the scanning in the re
+    engine. Keys may be bare or quoted and use = or :, values may be quoted with ASCII
+    or full-width quotes (with backslash escapes) or bare; full-width braces, commas
+    and colons work as separators, and prose or code fences around and between
+    records are skipped. All values are returned as strings.
+    """
+    i = 0
+    while True:
+        match = _NEXT_OPEN.search(text, i)
+        if match is None:
+            return
+        record, i = _parse_record(text, match.end())
+        if record:
+            yield record
+
+
+def parse_records(text):
+    return list(iter_records(text))
+
+
+def json_schema_format(name, schema):
+    """response_format argument asking an OpenAI-compatible endpoint for JSON that matches schema."""
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+def decode_json_object(text):
+    """One json.loads of a structured-output reply; None unless it is a JSON object (e.g. the schema was ignored)."""
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def parse_score(value):
+    """First number in a score value ("8", "８分", "7.5/10") as an int (fractions dropped), or None."""
+    match = _NUMBER.search(str(value).translate(_FULL_WIDTH_DIGITS))
+    return int(float(match.group())) if match else None
+
+
+def parse_evaluation_record(text):
+    """
+    Returns the first record of a grading response with a usable score, as
+    {"score": int, "reason": str, ...}, or None. A response without braces
+    (score=8, reason="...") is read as one record.
+    """
+    records = iter_records(text)
+    if not _NEXT_OPEN.search(text):
+        records = [_parse_record(text, 0)[0]]
+    for record in records:
+        score = parse_score(record.get("score", ""))
+        if score is not None:
+            record["score"] = score
+            record["reason"] = record.get("reason", "")
+            return record
+    return None
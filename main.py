@@ -1,26 +1,17 @@
 import threading
-import pyaudio
-import dashscope
-from dashscope.audio.asr import Recognition, RecognitionCallback, RecognitionResult
-import openai
 import tkinter as tk
 from tkinter import messagebox, StringVar, scrolledtext
 import json
-import re
 import os  # 增加模块用于文件操作
-# 初始化API密钥
-
-# 初始化 API 密钥
-def get_key(filename):
-    with open(filename, 'r') as file:
-        lines = file.readlines()
-        dashscope_key = lines[0].strip()
-        openai_key = lines[1].strip()
-    return dashscope_key, openai_key
+from llm_parse import parse_evaluation_record, parse_records  # 解析大模型返回的 {key="value"} 格式
+from storage import read_json, update_json  # 带文件锁的读写，防止与网页版同时写入时丢失数据
+from chat_store import dialog_pairs, open_chat_store  # 聊天记录只追加新的问答，与网页版共用同一存储
+from config import get_config  # API 密钥在首次调用接口时才从 key.txt 读取
+from tk_worker import TkWorker  # 在后台线程调用大模型，避免界面卡死
+from tk_chat_view import VirtualChatView  # 只为可见区域的消息创建控件，长对话也能流畅滚动
+from usage_ledger import HistoryTokenCounter, UsageLedger  # 统计 token 用量，用完额度后不再调用大模型
 
 # 全局变量
-dashscope.api_key, openai.api_key = get_key('key.txt')
-openai.api_base = "https://api.chatfire.cn/v1"
 text_buffer = ""
 state = "stopped"
 recognition_condition = threading.Condition()
@@ -30,37 +21,49 @@ questions = []
 
 
 
-# 自定义回调类
-class Callback(RecognitionCallback):
-    def __init__(self):
-        super().__init__()  # 调用父类构造函数
-        self.parent = None  # 初始化 parent 属性
+_callback_class = None
 
-    # 设置 parent 属性
-    def set_parent(self, parent):
-        """
-        设置 parent 属性，用于关联外部对象。
-        """
-        self.parent = parent
 
-    # 处理语音识别结果
-    def on_event(self, result: RecognitionResult) -> None:
-        """
-        处理语音识别结果，仅显示完整句子。
-        """
-        if not self.parent:
-            print("Callback parent not set.")
-            return
+# 自定义回调类（继承 dashscope 的类，首次使用语音输入时才定义，避免启动时导入 SDK）
+def get_callback_class():
+    global _callback_class
+    if _callback_class is not None:
+        return _callback_class
+    from dashscope.audio.asr import RecognitionCallback, RecognitionResult
 
-        try:
-            sentence = result.get_sentence()  # 获取句子
-            if sentence and RecognitionResult.is_sentence_end(sentence):
-                text = sentence.get("text", "")  # 获取句子文本
-                if text:
-                    # 将最终句子填入输入框
-                    self.parent.root.after(0, self.parent.process_voice_input, text)
-        except Exception as e:
-            print(f"Error processing recognition result: {e}")
+    class Callback(RecognitionCallback):
+        def __init__(self):
+            super().__init__()  # 调用父类构造函数
+            self.parent = None  # 初始化 parent 属性
+
+        # 设置 parent 属性
+        def set_parent(self, parent):
+            """
+            设置 parent 属性，用于关联外部对象。
+            """
+            self.parent = parent
+
+        # 处理语音识别结果
+        def on_event(self, result: RecognitionResult) -> None:
+            """
+            处理语音识别结果，仅显示完整句子。
+            """
+            if not self.parent:
+                print("Callback parent not set.")
+                return
+
+            try:
+                sentence = result.get_sentence()  # 获取句子
+                if sentence and RecognitionResult.is_sentence_end(sentence):
+                    text = sentence.get("text", "")  # 获取句子文本
+                    if text:
+                        # 将最终句子填入输入框
+                        self.parent.root.after(0, self.parent.process_voice_input, text)
+            except Exception as e:
+                print(f"Error processing recognition result: {e}")
+
+    _callback_class = Callback
+    return _callback_class
 
 class App:
     def __init__(self, root):
@@ -81,9 +84,21 @@ class App:
         self.current_dialog_key = None  # 当前对话的键
         # 文件路径初始化
         self.chat_record_path = "discuss.json"
+        self.chat_store = open_chat_store(self.chat_record_path)  # 默认：discuss.json 加只追加的日志文件
         self.wrong_question_path = "wrong.json"
         self.state = "stopped"  # 默认语音输入的状态为停止
         self.is_recognition_active = False  # 用于语音识别的标志
+        # 后台线程执行大模型请求，结果通过 root.after 回到界面线程（返回主菜单会再次调用 __init__，只创建一次）
+        if not hasattr(self, "worker"):
+            self.worker = TkWorker(root)
+        # token 用量和额度（记录在 usage.json，与网页版默认用户共用），同样只创建一次以保留当天的累计
+        if not hasattr(self, "usage_ledger"):
+            self.usage_ledger = UsageLedger()
+            self.history_tokens = HistoryTokenCounter()  # 对话历史的 token 数，每条消息只计算一次
+        self.busy_task = None  # 当前正在后台运行的任务
+        self.busy_frame = None  # 忙碌提示和取消按钮
+        self.busy_generation = 0  # 区分不同任务的提示动画
+        self.exam_frame = None  # 考题界面，第一次显示考题时创建
 
     # 保存聊天记录到本地
     def save_chat_history(self):
@@ -91,64 +106,107 @@ class App:
             print("再见")
             return
         try:
-            # 加载现有记录
-            if os.path.exists(self.chat_record_path):
-                with open(self.chat_record_path, "r", encoding="utf-8") as file:
-                    existing_data = json.load(file)
-            else:
-                existing_data = {}
-            # 确保 current_dialog_key 存在
-            if not hasattr(self, "current_dialog_key") or not self.current_dialog_key:
-                # 创建新对话记录
-                dialog_key = f"dialog{len(existing_data) + 1}"
-                dialog_data = {"num": 0}
-                self.current_dialog_key = dialog_key
-            else:
-                # 获取当前对话记录
-                dialog_key = self.current_dialog_key
-                dialog_data = existing_data.get(dialog_key, {"num": 0})
-
-            # 获取对话已存在的条数
-            existing_num = dialog_data["num"]
-
-            # 将当前对话内容追加到记录中
-            for i in range(existing_num, len(self.conversation_history) // 2):
-                dialog_data[f"Q{i + 1}"] = self.conversation_history[i * 2]["content"]
-                dialog_data[f"A{i + 1}"] = self.conversation_history[i * 2 + 1]["content"]
-                dialog_data["num"] += 1
-                print(f"Q{i + 1}: {dialog_data[f'Q{i + 1}']}")
-                print(f"A{i + 1}: {dialog_data[f'A{i + 1}']}")
-            # 更新到 existing_data
-            existing_data[dialog_key] = dialog_data
-
-            # 保存到文件
-            with open(self.chat_record_path, "w", encoding="utf-8") as file:
-                json.dump(existing_data, file, ensure_ascii=False, indent=4)
-            print("existing_data:", existing_data)
+            # 已保存的轮数以存储中的记录为准，只追加之后的新问答，已有内容不会被重写
+            existing_num = 0
+            if self.current_dialog_key:
+                existing_num = (self.chat_store.load_dialog(self.current_dialog_key) or {}).get("num", 0)
+            # 没有对话键（新对话）或对话已被删除时，存储会分配新的 dialogN
+            dialog_key, fields = self.chat_store.append_turns(
+                self.current_dialog_key, dialog_pairs(self.conversation_history), existing_num)
+            self.current_dialog_key = dialog_key
+            print(f"聊天记录已保存到 {dialog_key}，新增 {len(fields)} 项")
 
         except Exception as e:
             messagebox.showerror("错误", f"保存聊天记录出错: {e}")
 
     # 退出时保存聊天记录
     def on_close(self):
-        # 保存聊天记录
+        self.cancel_background()
+        self.worker.shutdown()
+        # 保存聊天记录，并把日志合并进 discuss.json，让直接读取该文件的程序看到全部对话
         self.save_chat_history()
+        try:
+            self.chat_store.compact()
+        except Exception as e:
+            print(f"合并聊天记录日志出错: {e}")
         self.root.destroy()
 
+    # 在后台线程运行 func(task, *args)，期间显示忙碌提示和取消按钮；回调都在界面线程执行
+    def run_in_background(self, func, *args, busy_text="请稍候", on_done=None, on_error=None, on_cancel=None):
+        def done(result):
+            self._end_busy()
+            if on_done:
+                on_done(result)
+
+        def error(e):
+            self._end_busy()
+            if on_error:
+                on_error(e)
+            else:
+                messagebox.showerror("错误", f"调用 OpenAI API 出错: {e}")
+
+        def cancelled():
+            self._end_busy()
+            if on_cancel:
+                on_cancel()
+
+        self.busy_task = self.worker.submit(func, *args, on_done=done, on_error=error,
+                                            on_progress=self._set_busy_text, on_cancel=cancelled)
+        self._show_busy(busy_text)
+        return self.busy_task
+
+    # 取消当前后台任务（正在进行的请求返回后结果会被丢弃）
+    def cancel_background(self):
+        if self.busy_task is not None:
+            self.busy_task.cancel()
+
+    # 显示忙碌提示（带动画）和取消按钮
+    def _show_busy(self, text):
+        self._end_busy_widgets()
+        self.busy_frame = tk.Frame(self.root)
+        self.busy_frame.pack(side=tk.BOTTOM, pady=5)
+        self.busy_label = tk.Label(self.busy_frame, text=text, fg="gray")
+        self.busy_label.pack(side=tk.LEFT, padx=5)
+        tk.Button(self.busy_frame, text="取消", command=self.cancel_background).pack(side=tk.LEFT, padx=5)
+        self.busy_text = text
+        self.root.config(cursor="watch")
+        self.busy_generation += 1
+        self._animate_busy(self.busy_generation, 0)
+
+    def _animate_busy(self, generation, step):
+        if generation != self.busy_generation or self.busy_frame is None or not self.busy_frame.winfo_exists():
+            return
+        self.busy_label.config(text=self.busy_text + "." * (step % 4))
+        self.root.after(400, self._animate_busy, generation, step + 1)
+
+    def _set_busy_text(self, text):
+        self.busy_text = text
+
+    def _end_busy_widgets(self):
+        if self.busy_frame is not None and self.busy_frame.winfo_exists():
+            self.busy_frame.destroy()
+        self.busy_frame = None
+        self.root.config(cursor="")
+
+    def _end_busy(self):
+        self.busy_task = None
+        self.busy_generation += 1
+        self._end_busy_widgets()
+
         # 打开指定对话的详细记录
 
     # 打开指定对话的详细记录
     def open_chat(self, dialog_key):
         # 读取聊天记录文件
         try:
-            with open(self.chat_record_path, "r", encoding="utf-8") as file:
-                chat_data = json.load(file)
+            if not self.chat_store.exists():
+                raise FileNotFoundError(self.chat_record_path)
+            dialog = self.chat_store.load_dialog(dialog_key) or {}
         except (json.JSONDecodeError, FileNotFoundError):
             messagebox.showerror("错误", "聊天记录文件格式错误或不存在")
             return
 
         # 获取指定对话记录
-        dialog = chat_data.get(dialog_key, {})
         if not dialog:
             messagebox.showerror("错误", "未找到指定对话")
             return
@@ -220,20 +278,20 @@ class App:
         scrollbar.pack(side="right", fill="y")
 
         # 读取聊天记录文件
+        # 只读取每段对话第一条提问的预览，打开对话时再按 key 读取
         try:
-            with open(self.chat_record_path, "r", encoding="utf-8") as file:
-                chat_data = json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            chat_data = {}
+            previews = self.chat_store.list_dialogs()
+        except json.JSONDecodeError:
+            previews = []
 
         # 显示聊天记录
-        if not chat_data:
+        if not previews:
             no_data_label = tk.Label(scrollable_frame, text="暂无聊天记录", bg="white", font=("Arial", 10))
             no_data_label.pack(pady=10)
         else:
-            for dialog_key, dialog_content in chat_data.items():
-                # 获取第一条提问并截取前 20 个字符
-                first_question = dialog_content.get("Q1", "无提问内容")[:20]
+            for dialog_key, preview in previews:
+                # 第一条提问截取前 20 个字符
+                first_question = preview[:20]
 
                 # 按钮框架
                 button_frame = tk.Frame(scrollable_frame, bg="white")
@@ -243,7 +301,7 @@ class App:
                 dialog_button = tk.Button(
                     button_frame,
                     text=first_question,
-                    command=lambda dk=dialog_key: self.view_chat_detail(chat_data, dk),
+                    command=lambda dk=dialog_key: self.view_chat_detail(dk),
                     width=25
                 )
                 dialog_button.pack(side="left", padx=5)
@@ -252,7 +310,7 @@ class App:
                 delete_btn = tk.Button(
                     button_frame,
                     text="✖",  # 红叉符号
-                    command=lambda dk=dialog_key: self.delete_chat_record(chat_data, dk),
+                    command=lambda dk=dialog_key: self.delete_chat_record(dk),
                     bg="red",
                     fg="white",
                     font=("Arial", 10, "bold"),
@@ -265,18 +323,13 @@ class App:
         return_btn.pack(pady=10)
 
     # 删除指定的聊天记录
-    def delete_chat_record(self, chat_data, dialog_key):
+    def delete_chat_record(self, dialog_key):
         """
         删除指定的聊天记录。
         """
         try:
-            if dialog_key in chat_data:
-                del chat_data[dialog_key]  # 删除指定聊天记录
-
-                # 更新文件内容
-                with open(self.chat_record_path, "w", encoding="utf-8") as file:
-                    json.dump(chat_data, file, ensure_ascii=False, indent=4)
-
+            # 从存储中删除（基于最新记录删除，避免覆盖其他程序的写入）
+            if self.chat_store.delete_dialog(dialog_key):
                 messagebox.showinfo("提示", "聊天记录已删除")
             else:
                 messagebox.showerror("错误", "未找到指定聊天记录")
@@ -288,51 +341,30 @@ class App:
             messagebox.showerror("错误", f"删除聊天记录时出错: {e}")
 
     # 查看具体聊天记录
-    def view_chat_detail(self, chat_data, dialog_key):
+    def view_chat_detail(self, dialog_key):
         """
         查看具体聊天记录，宽度固定为 800，并支持滚动。
         """
         self.clear_screen()
 
         # 获取指定对话的内容
-        dialog = chat_data.get(dialog_key, {})
+        dialog = self.chat_store.load_dialog(dialog_key) or {}
         if not dialog:
             messagebox.showerror("错误", "未找到指定对话")
             self.view_chat_history()
             return
 
-        # 容器框架
-        container = tk.Frame(self.root, bg="white", width=00)
-        container.pack(fill="both", expand=True, padx=10, pady=10)
-
-        # Canvas 和 Scrollbar
-        detail_canvas = tk.Canvas(container, bg="white", width=800, height=600)
-        scrollbar = tk.Scrollbar(container, orient="vertical", command=detail_canvas.yview)
-        scrollable_frame = tk.Frame(detail_canvas, bg="white", width=800)
-
-        # 配置 Canvas
-        scrollable_frame.bind(
-            "<Configure>",
-            lambda e: detail_canvas.configure(scrollregion=detail_canvas.bbox("all"))
-        )
-        detail_canvas.create_window((0, 0), window=scrollable_frame, anchor="nw", width=800)
-        detail_canvas.configure(yscrollcommand=scrollbar.set)
-
-        # 布局 Canvas 和 Scrollbar
-        detail_canvas.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
+        # 聊天内容（只创建可见区域的消息控件，滚动时复用）
+        detail_view = VirtualChatView(self.root, width=800, height=600)
+        detail_view.pack(fill="both", expand=True, padx=10, pady=10)
 
         # 显示具体对话内容
+        messages = []
         for i in range(1, dialog["num"] + 1):
-            # 显示用户提问
-            user_question = dialog.get(f"Q{i}", "")
-            if user_question:
-                self._add_message_with_avatar(scrollable_frame, user_question, role="user")
-
-            # 显示 AI 回答
-            ai_answer = dialog.get(f"A{i}", "")
-            if ai_answer:
-                self._add_message_with_avatar(scrollable_frame, ai_answer, role="assistant")
+            # 用户提问和 AI 回答
+            messages.append({"role": "user", "content": dialog.get(f"Q{i}", "")})
+            messages.append({"role": "assistant", "content": dialog.get(f"A{i}", "")})
+        detail_view.extend(messages)
 
         # 按钮框架
         button_frame = tk.Frame(self.root)
@@ -368,47 +400,9 @@ class App:
         # 显示教学模式界面（正常聊天界面）
         self.show_teaching_mode()
 
-        # 将历史记录加载到聊天框
-        for record in self.conversation_history:
-            role = "user" if record["role"] == "user" else "assistant"
-            self.update_chat_display(f"{record['content']}", role=role)
-
-    # 在指定父容器中添加带头像的消息，按比例对齐和宽度显示
-    def _add_message_with_avatar(self, parent, message, role="user"):
-        """
-        在指定父容器中添加带头像的消息，按比例对齐和宽度显示。
-        AI 消息占左 2/3，用户消息占右 2/3。
-        """
-        # 父框架：按角色对齐
-        message_frame = tk.Frame(parent, bg="white")
-        message_frame.pack(
-            fill="x",
-            pady=5,
-            padx=10,
-            anchor="w" if role == "assistant" else "e"  # AI 左对齐，用户右对齐
-        )
-
-        # 添加头像
-        avatar_canvas = tk.Canvas(message_frame, width=40, height=40, bg="white", highlightthickness=0)
-        avatar_canvas.create_oval(5, 5, 35, 35, fill="red" if role == "assistant" else "yellow", outline="")
-        avatar_canvas.create_text(
-            20, 20, text="AI" if role == "assistant" else "我", fill="white" if role == "assistant" else "black", font=("microsoftyahei", 10, "bold")
-        )
-        avatar_canvas.pack(side="top", anchor="w" if role == "assistant" else "e")  # 顶部对齐
-
-        # 消息文本框：按比例限制宽度
-        text_color = "green" if role == "assistant" else "blue"
-        text_width = int(800 * 2 / 3)  # 2/3 的总宽度（假设窗口宽度为 800）
-        text_label = tk.Label(
-            message_frame,
-            text=message,
-            wraplength=text_width,
-            justify="left" if role == "assistant" else "right",
-            bg="white",
-            fg=text_color,
-            font=("microsoftyahei", 10)
-        )
-        text_label.pack(side="left" if role == "assistant" else "right", padx=5)
+        # 将历史记录加载到聊天框（只有可见的消息会创建控件）
+        self.chat_view.extend(self.conversation_history)
+        self.chat_view.scroll_to_end()
 
     # 显示错题详情
     def view_question_detail(self, wrong_data, question_key):
@@ -507,9 +501,9 @@ class App:
             if question_key in wrong_data:
                 del wrong_data[question_key]  # 删除指定错题
 
-            # 更新文件内容
-            with open(self.wrong_question_path, "w", encoding="utf-8") as file:
-                json.dump(wrong_data, file, ensure_ascii=False, indent=4)
+            # 更新文件内容（基于文件中的最新记录删除，避免覆盖其他程序的写入）
+            with update_json(self.wrong_question_path) as doc:
+                doc.data.pop(question_key, None)
 
             messagebox.showinfo("提示", "错题已删除")
 
@@ -527,47 +521,40 @@ class App:
         # 文件路径
         wrong_file = "wrong.json"
 
-        # 初始化错题记录
-        if os.path.exists(wrong_file):
-            try:
-                with open(wrong_file, "r", encoding="utf-8") as file:
-                    existing_data = json.load(file)
-            except (json.JSONDecodeError, FileNotFoundError):
-                existing_data = {}
-        else:
-            existing_data = {}
-
-        # 确定当前错题的起始编号
-        current_count = len(existing_data)
-        new_wrong_data = {}
-
-        # 收集错题数据
-        for evaluation_index, evaluation in self.evaluation_results.items():
-            if evaluation["result"] != "正确":  # 只保存错误的题目
-                question = questions[evaluation_index]
-                current_count += 1
-                new_wrong_data[str(current_count)] = {
-                    "type": question["type"],
-                    "description": question["description"],
-                    "options": question.get("option", ""),  # 保存选项
-                    "answer": question["answer"],
-                    "user_answer": self.user_answers.get(evaluation_index, ""),
-                    "explanation": question.get("explanation", "")
-                }
-
-        # 如果没有新错题，直接返回
-        if not new_wrong_data:
-            print("save_wrong_questions: No new wrong questions to save.")
-            return
-
-        # 合并新错题
-        existing_data.update(new_wrong_data)
-
-        # 保存到文件
         try:
-            with open(wrong_file, "w", encoding="utf-8") as file:
-                json.dump(existing_data, file, ensure_ascii=False, indent=4)
+            # 读取、合并、写回都在同一把文件锁内完成
+            with update_json(wrong_file) as doc:
+                existing_data = doc.data
+
+                # 确定当前错题的起始编号
+                current_count = len(existing_data)
+                new_wrong_data = {}
+
+                # 收集错题数据
+                for evaluation_index, evaluation in self.evaluation_results.items():
+                    if evaluation["result"] != "正确":  # 只保存错误的题目
+                        question = questions[evaluation_index]
+                        current_count += 1
+                        new_wrong_data[str(current_count)] = {
+                            "type": question["type"],
+                            "description": question["description"],
+                            "options": question.get("option", ""),  # 保存选项
+                            "answer": question["answer"],
+                            "user_answer": self.user_answers.get(evaluation_index, ""),
+                            "explanation": question.get("explanation", "")
+                        }
+
+                # 如果没有新错题，不写文件直接返回
+                if not new_wrong_data:
+                    doc.discard()
+                    print("save_wrong_questions: No new wrong questions to save.")
+                    return
+
+                # 合并新错题，退出 with 时原子写回文件
+                existing_data.update(new_wrong_data)
             print("save_wrong_questions: Wrong questions saved successfully.")
+        except json.JSONDecodeError:
+            print("save_wrong_questions: wrong.json is corrupted, nothing saved.")
         except Exception as e:
             print(f"save_wrong_questions: Error occurred - {e}")
             messagebox.showerror("错误", f"保存错题时出错: {e}")
@@ -628,9 +615,8 @@ class App:
 
         # 读取错题记录
         try:
-            with open(self.wrong_question_path, "r", encoding="utf-8") as file:
-                wrong_data = json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
+            wrong_data = read_json(self.wrong_question_path, default=dict)
+        except json.JSONDecodeError:
             wrong_data = {}
 
         # 筛选对应类型的错题
@@ -676,6 +662,8 @@ class App:
 
     # 返回主菜单
     def return_to_main(self):
+        # 离开当前界面时取消还在进行的请求
+        self.cancel_background()
         # 确保保存当前对话记录
         if hasattr(self, "current_mode") and self.current_mode == "teaching":
             self.save_chat_history()  # 调用保存方法
@@ -693,27 +681,11 @@ class App:
         """
         self.clear_screen()
         self.current_mode = "teaching"
+        self.usage_ledger.start_session()  # 新的教学会话重新计算会话额度
 
-        # 容器框架
-        container = tk.Frame(self.root, bg="white", width=800, height=600)
-        container.pack(fill="both", expand=True, padx=10, pady=10)
-
-        # Canvas 和 Scrollbar
-        self.chat_canvas = tk.Canvas(container, bg="white", width=800, height=600)
-        scrollbar = tk.Scrollbar(container, orient="vertical", command=self.chat_canvas.yview)
-        self.chat_display_frame = tk.Frame(self.chat_canvas, bg="white", width=800, height=600)
-
-        # 配置 Canvas
-        self.chat_display_frame.bind(
-            "<Configure>",
-            lambda e: self.chat_canvas.configure(scrollregion=self.chat_canvas.bbox("all"))
-        )
-        self.chat_canvas.create_window((0, 0), window=self.chat_display_frame, anchor="nw", width=780)
-        self.chat_canvas.configure(yscrollcommand=scrollbar.set)
-
-        # 布局 Canvas 和 Scrollbar
-        self.chat_canvas.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
+        # 聊天框（虚拟化：只为可见区域附近的消息创建控件，滚动时复用）
+        self.chat_view = VirtualChatView(self.root, width=800, height=600)
+        self.chat_view.pack(fill="both", expand=True, padx=10, pady=10)
 
         # 消息输入框
         self.message_entry = tk.Entry(self.root, width=70)
@@ -753,16 +725,19 @@ class App:
         """
         开始语音识别，将语音实时转化为文本。
         """
-        import pyaudio
-        from dashscope.audio.asr import Recognition
-
+        mic = stream = None
         try:
+            # 首次使用语音输入时才加载音频和语音识别 SDK
+            import pyaudio
+            get_config().load_dashscope()
+            from dashscope.audio.asr import Recognition
+
             # 初始化麦克风和音频流
             mic = pyaudio.PyAudio()
             stream = mic.open(format=pyaudio.paInt16, channels=1, rate=16000, input=True, frames_per_buffer=3200)
 
             # 创建识别实例和回调
-            callback = Callback()
+            callback = get_callback_class()()
             callback.set_parent(self)  # 设置回调的 parent
 
             recognition = Recognition(
@@ -788,9 +763,11 @@ class App:
             if self.is_recognition_active:
                 recognition.stop()
                 self.is_recognition_active = False
-            stream.stop_stream()
-            stream.close()
-            mic.terminate()
+            if stream:
+                stream.stop_stream()
+                stream.close()
+            if mic:
+                mic.terminate()
 
     # 将最终识别的文本显示在输入框中
     def process_voice_input(self, voice_text):
@@ -803,6 +780,8 @@ class App:
 
     # 发送用户消息并调用 OpenAI API 获取回复
     def send_message(self):
+        if self.busy_task is not None:
+            return  # 上一条消息的回复还没返回
         user_message = self.message_entry.get().strip()
         if not user_message:
             return
@@ -814,65 +793,94 @@ class App:
         self.conversation_history.append({"role": "user", "content": user_message})
         self.update_chat_display(f"{user_message}", role="user")
 
-        # 调用 OpenAI API 获取回复
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=self.conversation_history
-            )
-            assistant_message = response['choices'][0]['message']['content']
+        # 在后台线程调用 OpenAI API 获取回复，等待期间界面可以继续操作
+        self.run_in_background(
+            self.request_reply, list(self.conversation_history),
+            busy_text="AI 正在回复", on_done=self.receive_reply,
+            on_error=lambda e: self.drop_pending_message(f"调用 OpenAI API 出错: {e}"),
+            on_cancel=self.drop_pending_message,
+        )
 
-            # 更新对话历史并显示 AI 的回答
-            self.conversation_history.append({"role": "assistant", "content": assistant_message})
-            self.update_chat_display(f"{assistant_message}", role="assistant")
-        except Exception as e:
-            messagebox.showerror("错误", f"调用 OpenAI API 出错: {e}")
+    # 请求 AI 回复（在后台线程运行）
+    def request_reply(self, task, messages):
+        openai = get_config().load_openai()
+        response = self.usage_ledger.metered_completion(
+            "chat",
+            openai.ChatCompletion.create,
+            messages,
+            self.history_tokens.count(messages),
+            model="gpt-4o"
+        )
+        return response['choices'][0]['message']['content']
+
+    # 收到回复（界面线程）：更新对话历史并显示 AI 的回答
+    def receive_reply(self, assistant_message):
+        self.conversation_history.append({"role": "assistant", "content": assistant_message})
+        self.update_chat_display(f"{assistant_message}", role="assistant")
+        self.show_usage_warning()
+
+    # 用量接近额度时提醒一次（界面线程）
+    def show_usage_warning(self):
+        warning = self.usage_ledger.pop_warning()
+        if warning:
+            messagebox.showwarning("提示", warning)
+
+    # 请求失败或被取消：撤回未得到回复的提问（保持问答一一对应），并放回输入框以便重发
+    def drop_pending_message(self, error=None):
+        if self.conversation_history and self.conversation_history[-1]["role"] == "user":
+            pending = self.conversation_history.pop()["content"]
+            entry = getattr(self, "message_entry", None)
+            if entry is not None and entry.winfo_exists() and not entry.get():
+                entry.insert(0, pending)
+        if error:
+            messagebox.showerror("错误", error)
 
     # 更新聊天记录显示
     def update_chat_display(self, message, role="user"):
         """
-        更新聊天记录显示，并刷新滑框滚动区域。
+        在聊天框末尾追加一条消息，并滚动到底部。
         """
-        if not hasattr(self, "chat_display_frame"):
+        chat_view = getattr(self, "chat_view", None)
+        if chat_view is None or not chat_view.winfo_exists():
             print("Error: Chat display frame not initialized.")
             return
 
-        # 调用 `_add_message_with_avatar` 动态添加消息
-        self._add_message_with_avatar(self.chat_display_frame, message, role)
-
-        # 刷新滑框滚动区域
-        self.chat_canvas.update_idletasks()
-        self.chat_canvas.yview_moveto(1.0)  # 滚动到底部
-
-    # 调整聊天框宽度
-    def adjust_chat_frame_width(self, message):
-        """
-        根据消息内容动态调整聊天框宽度。
-        """
-        # 计算消息的宽度（按字符长度计算，大致换算为像素宽度）
-        char_width = 8  # 每个字符约占 8 像素
-        max_width = 600  # 聊天框最大宽度
-        min_width = 200  # 聊天框最小宽度
-
-        message_width = len(message) * char_width
-        frame_width = min(max(message_width, min_width), max_width)
-
-        # 调整聊天框宽度
-        self.chat_display_frame.config(width=frame_width)
-        self.chat_display_frame.update_idletasks()
+        chat_view.append(message, role)
+        chat_view.scroll_to_end()
 
     # 考核模式界面
     def start_exam_mode(self):
-        global questions
         self.current_mode = "exam"
-        questions = self.get_exam_questions()
-        if questions:
-            self.show_question(0)
+        self.clear_screen()
+        # 在后台线程生成考题，期间显示进度提示，可取消返回主菜单
+        self.run_in_background(
+            self.get_exam_questions, busy_text="正在生成考题",
+            on_done=self.on_exam_questions_ready,
+            on_error=self.on_exam_questions_failed,
+            on_cancel=self.return_to_main,
+        )
 
-    # 生成考题
-    def get_exam_questions(self):
+    # 考题生成完成（界面线程）
+    def on_exam_questions_ready(self, exam_questions):
+        global questions
+        if not exam_questions:
+            self.on_exam_questions_failed("未能解析出考题")
+            return
+        questions = exam_questions
+        self.show_question(0)
+        self.show_usage_warning()
+
+    def on_exam_questions_failed(self, error):
+        messagebox.showerror("错误", f"生成考题时出错: {error}")
+        self.return_to_main()
+
+    # 生成考题（在后台线程运行，不访问界面控件）
+    def get_exam_questions(self, task):
         # 修改生成考题的提示，使题目更加精确
-        response = openai.ChatCompletion.create(
+        openai = get_config().load_openai()
+        response = self.usage_ledger.metered_completion(
+            "generation",
+            openai.ChatCompletion.create,
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": (
@@ -895,23 +903,49 @@ class App:
         content = response['choices'][0]['message']['content']
         print("处理后内容:", content)
 
-        # 将伪JSON转换为有效JSON
-        try:
-            # 去除Markdown代码块和转换近似JSON为有效JSON
-            formatted_content = re.sub(r'(\w+)=', r'"\1":', content)  # 将 `key=` 替换为 `"key":`
-            json_objects = re.findall(r'\{.*?\}', formatted_content, re.DOTALL)  # 提取每个JSON片段
-            questions = [json.loads(obj) for obj in json_objects]  # 解析每个JSON对象
-            print("解析后内容:", questions)
-            return questions
-        except json.JSONDecodeError as e:
-            messagebox.showerror("错误", f"解析考题时出错: {e}")
-            print("原始内容:", content)
-            return []
+        # 解析 {key="value", ...} 格式的考题（一次扫描，跳过多余文字，题目中的 = 不受影响）
+        parsed_questions = parse_records(content)
+        print("解析后内容:", parsed_questions)
+        return parsed_questions
+
+    # 创建考题界面（每场考试只创建一次，切换题目时只替换文字、选项和答案）
+    def build_exam_view(self):
+        self.exam_frame = tk.Frame(self.root)
+        self.exam_frame.pack(fill="both", expand=True)
+        self.question_label = tk.Label(self.exam_frame)
+        self.question_label.pack()
+        # 三种题型的输入控件放在同一位置，每次只显示当前题型需要的一个
+        input_frame = tk.Frame(self.exam_frame)
+        input_frame.pack(fill="x")
+        self.var = StringVar()
+        self.choice_frame = tk.Frame(input_frame)
+        self.radio_buttons = []  # 选项按钮按需增加，之后一直复用
+        self.fill_entry = tk.Entry(input_frame, width=40)
+        # 绑定事件，当输入内容变化时保存答案
+        self.fill_entry.bind("<KeyRelease>", self.save_fill_answer)
+        self.answer_text = tk.Text(input_frame, height=5, width=50)
+        self.answer_text.bind("<KeyRelease>", self.save_open_answer)
+        self.answer_widgets = {"选择": self.choice_frame, "填空": self.fill_entry, "简答": self.answer_text}
+        self.evaluation_label = tk.Label(self.exam_frame, justify='left', fg='blue')
+        # 上一题、下一题或提交按钮
+        self.nav_frame = tk.Frame(self.exam_frame)
+        self.nav_frame.pack(pady=20)
+        self.prev_btn = tk.Button(self.nav_frame, text="上一题", command=lambda: self.show_question(current_question_index - 1))
+        self.next_btn = tk.Button(self.nav_frame)
+        self.next_btn.pack(side=tk.RIGHT, padx=5)
+        # 返回主菜单按钮
+        self.return_btn = tk.Button(self.nav_frame, text="返回主菜单", command=self.return_to_main)
+        self.return_btn.pack(side=tk.RIGHT, padx=5)
+        self.shown_answer_widget = None
 
     # 显示考题
     def show_question(self, index):
         global current_question_index
-        self.clear_screen()
+        if getattr(self, "exam_frame", None) is None or not self.exam_frame.winfo_exists():
+            self.clear_screen()
+            self.build_exam_view()
+        else:
+            self.save_current_answer()  # 鼠标粘贴等不触发按键事件的输入，在切换题目前保存
         question = questions[index]
         current_question_index = index
 
@@ -926,6 +960,8 @@ class App:
             self.display_fill_question(question_description)
         elif question_type == "简答":
             self.display_open_question(question_description)
+        else:
+            self.show_answer_widget(None)
 
         # 显示评判结果（如果有）
         if index in self.evaluation_results:
@@ -937,39 +973,57 @@ class App:
                 f"参考答案: {evaluation['correct_answer']}\n"
                 f"答案解释: {evaluation['explanation']}"
             )
-            evaluation_label = tk.Label(self.root, text=evaluation_text, justify='left', fg='blue')
-            evaluation_label.pack(pady=10)
+            self.evaluation_label.config(text=evaluation_text)
+            self.evaluation_label.pack(pady=10, before=self.nav_frame)
+        else:
+            self.evaluation_label.pack_forget()
 
-        # 上一题、下一题或提交按钮
-        nav_frame = tk.Frame(self.root)
-        nav_frame.pack(pady=20)
+        # 第一题不显示“上一题”，最后一题显示“提交”
         if index > 0:
-            self.prev_btn = tk.Button(nav_frame, text="上一题", command=lambda: self.show_question(index - 1))
-            self.prev_btn.pack(side=tk.LEFT, padx=5)
+            self.prev_btn.pack(side=tk.LEFT, padx=5, before=self.next_btn)
+        else:
+            self.prev_btn.pack_forget()
         if index < len(questions) - 1:
-            self.next_btn = tk.Button(nav_frame, text="下一题", command=lambda: self.show_question(index + 1))
-            self.next_btn.pack(side=tk.RIGHT, padx=5)
+            self.next_btn.config(text="下一题", command=lambda: self.show_question(current_question_index + 1))
         else:
-            self.next_btn = tk.Button(nav_frame, text="提交", command=self.submit_exam)
-            self.next_btn.pack(side=tk.RIGHT, padx=5)
-        # 返回主菜单按钮
-        self.return_btn = tk.Button(nav_frame, text="返回主菜单", command=self.return_to_main)
-        self.return_btn.pack(side=tk.RIGHT, padx=5)
+            self.next_btn.config(text="提交", command=self.submit_exam)
+
+    # 只显示当前题型的输入控件
+    def show_answer_widget(self, widget):
+        if widget is self.shown_answer_widget:
+            return
+        if self.shown_answer_widget is not None:
+            self.shown_answer_widget.pack_forget()
+        if widget is not None:
+            widget.pack(pady=10, anchor="w" if widget is self.choice_frame else "center")
+        self.shown_answer_widget = widget
+
+    # 把当前输入框中的答案写入 user_answers
+    def save_current_answer(self):
+        if self.shown_answer_widget is self.fill_entry:
+            self.save_fill_answer(None)
+        elif self.shown_answer_widget is self.answer_text:
+            self.save_open_answer(None)
 
     # 显示选择题
     def display_choice_question(self, description, options):
-        question_label = tk.Label(self.root, text="选择题: " + description)
-        question_label.pack()
-        self.var = StringVar()
+        self.question_label.config(text="选择题: " + description)
+        choices = [opt.split(':', 1) for opt in options.split(',') if ':' in opt]
+        # 选项按钮不够时才新建
+        while len(self.radio_buttons) < len(choices):
+            radio_btn = tk.Radiobutton(self.choice_frame, variable=self.var, command=self.save_choice_answer)
+            self.radio_buttons.append(radio_btn)
+        for radio_btn, (opt_label, opt_text) in zip(self.radio_buttons, choices):
+            radio_btn.config(text=f"{opt_label}: {opt_text}", value=opt_label.strip())
+            radio_btn.pack(anchor="w")
+        for radio_btn in self.radio_buttons[len(choices):]:
+            radio_btn.pack_forget()
         # 检查是否已有答案
         if current_question_index in self.user_answers:
             self.var.set(self.user_answers[current_question_index])
         else:
             self.var.set(None)
-        for opt in options.split(','):
-            opt_label, opt_text = opt.split(':', 1)
-            radio_btn = tk.Radiobutton(self.root, text=f"{opt_label}: {opt_text}", variable=self.var, value=opt_label.strip(), command=self.save_choice_answer)
-            radio_btn.pack(anchor="w")
+        self.show_answer_widget(self.choice_frame)
 
     # 保存选择题的答案
     def save_choice_answer(self):
@@ -978,15 +1032,12 @@ class App:
 
     # 显示填空题
     def display_fill_question(self, description):
-        question_label = tk.Label(self.root, text="填空题: " + description)
-        question_label.pack()
-        self.fill_entry = tk.Entry(self.root, width=40)
+        self.question_label.config(text="填空题: " + description)
+        self.fill_entry.delete(0, tk.END)
         # 检查是否已有答案
         if current_question_index in self.user_answers:
             self.fill_entry.insert(0, self.user_answers[current_question_index])
-        self.fill_entry.pack(pady=10)
-        # 绑定事件，当输入内容变化时保存答案
-        self.fill_entry.bind("<KeyRelease>", self.save_fill_answer)
+        self.show_answer_widget(self.fill_entry)
 
     # 保存填空题的答案
     def save_fill_answer(self, event):
@@ -995,29 +1046,40 @@ class App:
 
     # 显示简答题
     def display_open_question(self, description):
-        question_label = tk.Label(self.root, text="简答题: " + description)
-        question_label.pack()
-        self.answer_text = tk.Text(self.root, height=5, width=50)
+        self.question_label.config(text="简答题: " + description)
+        self.answer_text.delete("1.0", tk.END)
         # 检查是否已有答案
         if current_question_index in self.user_answers:
             self.answer_text.insert(tk.END, self.user_answers[current_question_index])
-        self.answer_text.pack(pady=10)
-        # 绑定事件，当文本内容变化时保存答案
-        self.answer_text.bind("<KeyRelease>", self.save_open_answer)
+        self.show_answer_widget(self.answer_text)
 
     # 保存简答题的答案
     def save_open_answer(self, event):
         # 保存简答题的答案
         self.user_answers[current_question_index] = self.answer_text.get("1.0", tk.END).strip()
 
-    # 提交考试
+    # 提交考试：评分在后台线程进行，界面保持响应
     def submit_exam(self):
+        if self.busy_task is not None:
+            return  # 正在评分
+        self.save_current_answer()
+        self.run_in_background(
+            self.grade_exam, list(questions), dict(self.user_answers),
+            busy_text="正在评分", on_done=self.show_exam_result,
+        )
+
+    # 逐题评分（在后台线程运行，不访问界面控件），返回 (评判结果, 总得分)，取消时返回 None
+    def grade_exam(self, task, exam_questions, user_answers):
+        evaluation_results = {}
         total_score = 0
-        for index, question in enumerate(questions):
+        for index, question in enumerate(exam_questions):
+            if task.is_cancelled():
+                return None
+            task.report(f"正在评分 {index + 1}/{len(exam_questions)}")
             question_type = question['type']
             description = question['description']
             correct_answer = question['answer'].strip()
-            user_answer = self.user_answers.get(index, "").strip()
+            user_answer = user_answers.get(index, "").strip()
             evaluation = {}  # 用于保存评判结果
             if question_type == "选择":
                 print("用户答案:", user_answer, "正确答案:", correct_answer)
@@ -1033,7 +1095,7 @@ class App:
                     result = "错误"
                 total_score += score
                 # 保存评判结果
-                self.evaluation_results[index] = {
+                evaluation_results[index] = {
                     'result': result,
                     'score': score,
                     'reason': evaluation['reason'],
@@ -1047,7 +1109,7 @@ class App:
                     evaluation['reason'] = '回答正确'
                     total_score += score
                     # 保存评判结果
-                    self.evaluation_results[index] = {
+                    evaluation_results[index] = {
                         'result': '正确',
                         'score': score,
                         'reason': evaluation['reason'],
@@ -1056,7 +1118,11 @@ class App:
                     }
                 else:
                     # 使用GPT评判
-                    evaluation_text = self.check_answer_with_gpt(question, user_answer)
+                    try:
+                        evaluation_text = self.check_answer_with_gpt(question, user_answer)
+                    except Exception as e:  # 接口出错或 token 额度用完：本题记为评估失败，继续评下一题
+                        evaluation_results[index] = self.failed_evaluation(question, e)
+                        continue
                     # 解析评判结果
                     evaluation = self.parse_evaluation(evaluation_text)
                     score = evaluation.get('score', 0)
@@ -1068,7 +1134,7 @@ class App:
                     else:
                         result = '正确'
                     # 保存评判结果
-                    self.evaluation_results[index] = {
+                    evaluation_results[index] = {
                         'result': result,
                         'score': score,
                         'reason': evaluation.get('reason', ''),
@@ -1077,21 +1143,46 @@ class App:
                     }
             elif question_type == "简答":
                 # 使用GPT评判
-                evaluation_text = self.check_answer_with_gpt(question, user_answer)
+                try:
+                    evaluation_text = self.check_answer_with_gpt(question, user_answer)
+                except Exception as e:  # 同上
+                    evaluation_results[index] = self.failed_evaluation(question, e)
+                    continue
                 # 解析评判结果
                 evaluation = self.parse_evaluation(evaluation_text)
                 score = evaluation.get('score', 0)
                 total_score += score
                 # 保存评判结果
-                self.evaluation_results[index] = {
+                evaluation_results[index] = {
                     'result': '评分',
                     'score': score,
                     'reason': evaluation.get('reason', ''),
                     'correct_answer': correct_answer,
                     'explanation': question.get('explanation', '')
                 }
+        return evaluation_results, total_score
+
+    # 大模型未能评分的题目：不计分，并记录原因
+    def failed_evaluation(self, question, error):
+        print(f"grade_exam: Error grading '{question['description'][:20]}' - {error}")
+        return {
+            'result': '评估失败',
+            'score': 0,
+            'reason': f'未能评分: {error}',
+            'correct_answer': question['answer'].strip(),
+            'explanation': question.get('explanation', '')
+        }
+
+    # 评分完成后（界面线程）显示总得分
+    def show_exam_result(self, result):
+        self.evaluation_results, total_score = result
+        failed = sum(1 for evaluation in self.evaluation_results.values() if evaluation['result'] == '评估失败')
         # 显示总得分
-        messagebox.showinfo("总得分", f"你的总得分是: {total_score}")
+        message = f"你的总得分是: {total_score}"
+        if failed:
+            message += f"\n有 {failed} 道题未能评分，不计入总分，原因见各题的评判结果。"
+        messagebox.showinfo("总得分", message)
+        self.show_usage_warning()
         # 显示第一题，供用户查看评判结果
         self.show_question(0)
 
@@ -1107,7 +1198,8 @@ class App:
             "用户答案后面的内容才是用户的答案，也就是你要测评的内容"
             "请严格按照格式{{score=数字, reason=\"理由\"}}返回，不要有多余的内容。"
         )
-        response = openai.ChatCompletion.create(model="gpt-4o", messages=[
+        openai = get_config().load_openai()
+        response = self.usage_ledger.metered_completion("grading", openai.ChatCompletion.create, model="gpt-4o", messages=[
             {"role": "system", "content": prompt},
             {"role": "user", "content": f"问题：{question['description']}\n参考答案: {question['answer']}\n用户答案：{user_answer}"}
         ])
@@ -1117,15 +1209,9 @@ class App:
     def parse_evaluation(self, evaluation_text):
         # 将evaluation_text解析为字典
         try:
-            # 将 '=' 替换为 ':'
-            evaluation_text = evaluation_text.replace('=', ':')
-            # 使用正则表达式提取score和reason
-            pattern = r'\{\s*score\s*:\s*(\d+)\s*,\s*reason\s*:\s*"([^"]*)"\s*\}'
-            match = re.search(pattern, evaluation_text)
-            if match:
-                score = int(match.group(1))
-                reason = match.group(2)
-                return {'score': score, 'reason': reason}
+            evaluation = parse_evaluation_record(evaluation_text)
+            if evaluation:
+                return {'score': evaluation['score'], 'reason': evaluation['reason']}
             else:
                 return {'score': 0, 'reason': '无法解析评分结果'}
         except Exception as e:
@@ -1138,6 +1224,12 @@ class App:
             widget.destroy()
 
 
-root = tk.Tk()
-app = App(root)
-root.mainloop()
+def main():
+    root = tk.Tk()
+    app = App(root)
+    root.protocol("WM_DELETE_WINDOW", app.on_close)  # 关闭窗口时保存聊天记录并停止后台任务
+    root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import json
+import os
+import time
+
+from question_bank import GENERAL_TOPIC, tag_topics
+from storage import read_json, write_json
+
+# Bayesian knowledge tracing parameters
+P_INIT = 0.3 # Prior probability a topic is already mastered
+P_TRANSIT = 0.1 # Probability of learning the topic from one practice opportunity
+P_SLIP = 0.1 # Probability of a wrong answer although the topic is mastered
+P_GUESS = {"选择": 0.25, "填空": 0.05, "简答": 0.1} # Probability of a right answer without mastery
+MASTERED = 0.95 # Topics at or above this estimate count as mastered
+
+
+def bkt_update(p_known, correctness, guess, slip=P_SLIP, transit=P_TRANSIT):
+    """
+    One BKT step. correctness is in [0, 1] (partial credit interpolates between
+    the posteriors for a right and a wrong answer). Returns the new estimate.
+    """
+    right = p_known * (1 - slip) / (p_known * (1 - slip) + (1 - p_known) * guess)
+    wrong = p_known * slip / (p_known * slip + (1 - p_known) * (1 - guess))
+    posterior = correctness * right + (1 - correctness) * wrong
+    return posterior + (1 - posterior) * transit
+
+
+class MasteryTracker:
+    """
+    Per-topic mastery estimates of one student, updated by Bayesian knowledge tracing.
+    Only the current estimate is stored, so an update is O(questions in the exam)
+    and never replays earlier submissions.
+    File layout (mastery.json): {"topic": [p_known, observations, last_updated]}
+    """
+
+    def __init__(self, path="mastery.json"):
+        self.path = path
+        self.topics = {}
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            try:
+                self.topics = read_json(self.path, default=dict)
+            except (json.JSONDecodeError, OSError) as e:
+                print(f"Error loading mastery data: {e}")
+                self.topics = {}
+
+    def save(self):
+        write_json(self.path, self.topics, indent=None, separators=(",", ":"))
+
+    def observe(self, topic, correctness, question_type, now=None):
+        p_known, observations, _ = self.topics.get(topic, (P_INIT, 0, None))
+        p_known = bkt_update(p_known, correctness, P_GUESS.get(question_type, 0.1))
+        self.topics[topic] = [round(p_known, 4), observations + 1, int(now if now is not None else time.time())]
+
+    def update_from_exam(self, questions, evaluation_results):
+        """Applies one observation per graded question to each of its topics."""
+        now = time.time()
+        for index, evaluation in evaluation_results.items():
+            if not 0 <= index < len(questions) or evaluation.get("result") == "评估失败":
+                continue
+            question = questions[index]
+            correctness = min(max(evaluation.get("score", 0) / 10, 0.0), 1.0)
+            for topic in question.get("topics") or tag_topics(question):
+                self.observe(topic, correctness, question.get("type"), now)
+
+    def mastery(self, topic):
+        """Current probability that the topic is mastered (the prior if never observed)."""
+        return self.topics.get(topic, (P_INIT,))[0]
+
+    def weakest_topics(self, limit=3, min_observations=1):
+        """
+        Returns [(topic, p_known)] of observed, not yet mastered topics, weakest first.
+        The catch-all topic is left out since it does not name anything to practise.
+        """
+        candidates = [(topic, entry[0]) for topic, entry in self.topics.items()
+                      if topic != GENERAL_TOPIC and entry[1] >= min_observations and entry[0] < MASTERED]
+        return sorted(candidates, key=lambda item: item[1])[:limit]
@@ -0,0 +1,254 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from storage import read_json, update_json
+
+QUESTION_TYPES = ["选择", "填空", "简答"]
+DEFAULT_EXAM_LAYOUT = {"选择": 4, "填空": 4, "简答": 2} # 4 choice, 4 fill-in, 2 short answer
+
+# Topic tags for the 测试技术与传感器 course, matched by keyword.
+# A question gets every topic whose keywords appear in its text.
+SENSOR_TOPICS = {
+    "压电": ["压电"],
+    "电容": ["电容"],
+    "电感": ["电感", "差动变压器", "lvdt", "涡流"],
+    "霍尔": ["霍尔"],
+    "磁电": ["磁场", "磁电", "磁阻", "磁敏"],
+    "热电偶": ["热电偶", "热电势", "thermocouple"],
+    "热电阻": ["热电阻", "热敏", "铂电阻", "电阻随温度"],
+    "应变": ["应变", "拉伸计", "strain", "电阻变化"],
+    "光电": ["光电", "光纤", "红外", "光敏", "光信号"],
+    "超声": ["超声"],
+    "振动": ["振动", "加速度"],
+    "气体湿度": ["气体", "湿度"],
+    "静态特性": ["灵敏度", "线性度", "迟滞", "重复性", "可重复", "漂移", "分辨率", "精度", "稳定性"],
+    "信号调理": ["放大", "滤波", "噪声", "电桥", "调理", "a/d", "模数", "模拟信号", "数字信号"],
+    "标定": ["标定", "校准"],
+    "mems": ["mems", "微机电"],
+    "测试系统": ["测试系统", "数据采集", "动态特性", "频率响应", "表面", "粗糙度", "形貌"],
+}
+GENERAL_TOPIC = "综合"
+
+
+def tag_topics(question):
+    """Returns the topic tags of a question from keywords in its text."""
+    text = " ".join(str(question.get(field, "")) for field in ("description", "option", "options", "answer", "explanation")).lower()
+    topics = [topic for topic, keywords in SENSOR_TOPICS.items() if any(keyword in text for keyword in keywords)]
+    return topics or [GENERAL_TOPIC]
+
+
+def validate_question(question):
+    """Returns True if an LLM-generated question has the fields an exam needs."""
+    required_keys = ["type", "description", "answer", "explanation"] # 'option' is optional for non-choice
+    if not all(key in question for key in required_keys) or question.get("type") not in QUESTION_TYPES:
+        return False
+    if question["type"] == "选择" and "option" not in question:
+        return False
+    return True
+
+
+def _fingerprint(question):
+    """Normalized type+description used to reject exact duplicates."""
+    return question.get("type", "") + re.sub(r"[\s_\W]+", "", question.get("description", "").lower())
+
+
+class QuestionBank:
+    """
+    Persistent store of validated exam questions with usage statistics.
+    Questions are indexed by type and by topic tag in memory, so an exam can be
+    assembled from the bank without calling the LLM.
+    The file is shared by every user (and by the Tk and Gradio apps), so it is never
+    overwritten with this instance's copy: new questions and the usage counts
+    recorded since the last save are merged into the current file under its lock,
+    and the merged document (with what other writers added) becomes the new copy.
+    File layout (question_bank.json):
+    {"next_id": n, "questions": {"q1": {type, description, option, answer, explanation,
+                                        topics, used, correct, wrong, added, last_used}}}
+    """
+
+    def __init__(self, path="question_bank.json"):
+        self.path = path
+        self.questions = {}
+        self.next_id = 1
+        self.by_type = {question_type: set() for question_type in QUESTION_TYPES}
+        self.by_topic = {}
+        self._fingerprints = {}
+        self._unsaved = {} # question_id -> {"used": n, "correct": n, "wrong": n, "last_used": t} not yet in the file
+        self._lock = threading.RLock() # One instance serves all users of the process (see get_question_bank)
+        self.load()
+
+    def __len__(self):
+        return len(self.questions)
+
+    def load(self):
+        data = {}
+        if os.path.exists(self.path):
+            try:
+                data = read_json(self.path, default=dict)
+            except (json.JSONDecodeError, OSError) as e:
+                print(f"Error loading question bank: {e}")
+        with self._lock:
+            self._adopt(data)
+
+    def _adopt(self, data):
+        """Makes the file document data the in-memory copy and rebuilds the indexes."""
+        self.questions = data.get("questions", {})
+        self.next_id = data.get("next_id", len(self.questions) + 1)
+        self.by_type = {question_type: set() for question_type in QUESTION_TYPES}
+        self.by_topic = {}
+        self._fingerprints = {}
+        for question_id, question in self.questions.items():
+            self._index(question_id, question)
+
+    def _index(self, question_id, question):
+        self.by_type.setdefault(question["type"], set()).add(question_id)
+        for topic in question.get("topics", []):
+            self.by_topic.setdefault(topic, set()).add(question_id)
+        self._fingerprints[_fingerprint(question)] = question_id
+
+    def save(self, new_questions=(), source="llm"):
+        """
+        One read-merge-write of the file: adds the unsaved usage counts to the stored
+        ones, then appends new_questions that are valid and not already stored (by
+        anyone). Returns the bank ids of new_questions (None for invalid ones).
+        """
+        with self._lock, update_json(self.path) as doc:
+            data = doc.data
+            data.setdefault("questions", {})
+            data.setdefault("next_id", len(data["questions"]) + 1)
+            for question_id, counts in self._unsaved.items():
+                stored = data["questions"].get(question_id)
+                if stored is None:
+                    continue
+                for field in ("used", "correct", "wrong"):
+                    stored[field] = stored.get(field, 0) + counts.get(field, 0)
+                if counts.get("last_used"):
+                    stored["last_used"] = max(stored.get("last_used") or 0, counts["last_used"])
+            self._unsaved = {}
+            self._adopt(data)
+            bank_ids = [self._add(question, source) if validate_question(question) else None
+                        for question in new_questions]
+            data["next_id"] = self.next_id
+        return bank_ids
+
+    def _add(self, question, source):
+        existing_id = self._fingerprints.get(_fingerprint(question))
+        if existing_id is not None:
+            return existing_id
+        question_id = f"q{self.next_id}"
+        self.next_id += 1
+        stored = {
+            "type": question["type"],
+            "description": question["description"],
+            "option": question.get("option", "None"),
+            "answer": question["answer"],
+            "explanation": question.get("explanation", ""),
+            "topics": question.get("topics") or tag_topics(question),
+            "source": source,
+            "used": 0,
+            "correct": 0,
+            "wrong": 0,
+            "added": time.time(),
+            "last_used": None,
+        }
+        self.questions[question_id] = stored
+        self._index(question_id, stored)
+        return question_id
+
+    def add_question(self, question, source="llm"):
+        """Adds a validated question and saves. Returns its bank id, the existing id for a duplicate, or None."""
+        return self.add_questions([question], source)[0]
+
+    def add_questions(self, questions, source="llm"):
+        """Adds several questions in one save; returns their bank ids (None for invalid ones)."""
+        return self.save(questions, source)
+
+    def _count(self, question_id, field, now=None):
+        """Bumps a usage counter in memory and remembers it for the next save."""
+        self.questions[question_id][field] += 1
+        counts = self._unsaved.setdefault(question_id, {})
+        counts[field] = counts.get(field, 0) + 1
+        if now is not None:
+            self.questions[question_id]["last_used"] = counts["last_used"] = now
+
+    def available(self, question_type, topics=None, max_uses=None, exclude=()):
+        """Ids of questions of a type (optionally restricted to topics) that may still be served."""
+        with self._lock:
+            candidates = self.by_type.get(question_type, set())
+            if topics:
+                topic_ids = set()
+                for topic in topics:
+                    topic_ids |= self.by_topic.get(topic, set())
+                candidates = candidates & topic_ids
+            return [question_id for question_id in candidates
+                    if question_id not in exclude
+                    and (max_uses is None or self.questions[question_id]["used"] < max_uses)]
+
+    def assemble_exam(self, layout=None, topics=None, max_uses=None, exclude=()):
+        """
+        Builds an exam paper from the bank. For each type the least-used questions are
+        picked first (ties broken randomly). Returns (questions, shortage) where questions
+        are copies carrying their "bank_id" and shortage maps type -> number still missing.
+        """
+        layout = layout or DEFAULT_EXAM_LAYOUT
+        paper = []
+        shortage = {}
+        for question_type in QUESTION_TYPES:
+            wanted = layout.get(question_type, 0)
+            if wanted <= 0:
+                continue
+            candidates = self.available(question_type, topics, max_uses, exclude)
+            random.shuffle(candidates)
+            candidates.sort(key=lambda question_id: self.questions[question_id]["used"])
+            for question_id in candidates[:wanted]:
+                paper.append(self.as_exam_question(question_id))
+            if len(candidates) < wanted:
+                shortage[question_type] = wanted - len(candidates)
+        return paper, shortage
+
+    def as_exam_question(self, question_id):
+        question = self.questions[question_id]
+        return {
+            "type": question["type"],
+            "description": question["description"],
+            "option": question["option"],
+            "answer": question["answer"],
+            "explanation": question["explanation"],
+            "topics": list(question["topics"]),
+            "bank_id": question_id,
+        }
+
+    def record_usage(self, questions):
+        """Counts one more use for every bank question in an exam paper."""
+        now = time.time()
+        with self._lock:
+            for question in questions:
+                if question.get("bank_id") in self.questions:
+                    self._count(question["bank_id"], "used", now)
+
+    def record_results(self, questions, evaluation_results):
+        """Updates correct/wrong statistics from AppLogic.evaluation_results."""
+        with self._lock:
+            for index, evaluation in evaluation_results.items():
+                if not 0 <= index < len(questions):
+                    continue
+                question_id = questions[index].get("bank_id")
+                if question_id in self.questions:
+                    self._count(question_id, "correct" if evaluation.get("result") == "正确" else "wrong")
+
+
+_banks = {}
+_banks_lock = threading.Lock()
+
+
+def get_question_bank(path="question_bank.json"):
+    """The process-wide QuestionBank of path, shared by every user's AppLogic."""
+    key = os.path.abspath(path)
+    with _banks_lock:
+        if key not in _banks:
+            _banks[key] = QuestionBank(path)
+        return _banks[key]
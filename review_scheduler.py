@@ -0,0 +1,244 @@
+import heapq
+import json
+import os
+import re
+import threading
+import time
+
+from storage import atomic_write_json, file_lock, remove_file
+
+DAY_SECONDS = 24 * 60 * 60
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+
+# SM-2 recall quality (0-5) for each grading result
+RESULT_QUALITY = {"正确": 5, "部分正确": 3, "错误": 1}
+
+
+def normalize_answer(text):
+    """Lowercases an answer and drops whitespace and punctuation, for exact-match grading."""
+    return re.sub(r"[\s_\W]+", "", str(text).lower())
+
+
+def grade_locally(question, user_answer):
+    """
+    Grades a choice or fill-in question without the LLM.
+    Returns "正确"/"错误", or None for question types that need the LLM (简答).
+    """
+    if question.get("type") == "选择":
+        expected = re.findall(r"[A-Da-d]", str(question.get("answer", "")))
+        given = re.findall(r"[A-Da-d]", str(user_answer))
+        return "正确" if expected and sorted(set(given)) == sorted(set(expected)) else "错误"
+    if question.get("type") == "填空":
+        accepted = [normalize_answer(part) for part in re.split(r"[;；/、]|或", str(question.get("answer", "")))]
+        return "正确" if normalize_answer(user_answer) in [a for a in accepted if a] else "错误"
+    return None
+
+
+class ReviewScheduler:
+    """
+    SM-2 spaced repetition schedule for wrong book entries.
+    Each entry stores ease, interval (days), repetitions and the due timestamp.
+    Due entries are kept in a min-heap of (due, key); rescheduling pushes a new
+    heap entry and stale ones are skipped when they reach the top (lazy deletion),
+    so "what is due now" costs O(log n) instead of a scan of the whole wrong book.
+    File layout (review_schedule.json):
+    {"wrong_key": {"ease", "interval", "repetitions", "due", "lapses", "last_review"}}
+    flush_changes() appends only the entries changed since the last write to
+    review_schedule.json.journal, as JSON lines {"key": ..., "item": entry or null};
+    load() replays them, and they are folded into the file once the journal grows
+    past compact_bytes. save() rewrites the whole file.
+    """
+
+    def __init__(self, path="review_schedule.json", compact_bytes=64 * 1024):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.compact_bytes = compact_bytes
+        self.items = {}
+        self._heap = []
+        self._dirty = set() # Keys added, rescheduled or removed since the last write
+        self._lock = threading.RLock() # The write-behind flusher writes changes while requests reschedule
+        self.load()
+
+    def __len__(self):
+        return len(self.items)
+
+    def load(self):
+        with self._lock:
+            if os.path.exists(self.path) or os.path.exists(self.journal_path):
+                try:
+                    with file_lock(self.path, shared=True):
+                        self.items = self._replay()
+                except (json.JSONDecodeError, OSError) as e:
+                    print(f"Error loading review schedule: {e}")
+                    self.items = {}
+            self._dirty.clear()
+            self._heap = [(item["due"], key) for key, item in self.items.items()]
+            heapq.heapify(self._heap)
+
+    def _replay(self):
+        """The file plus the journal; the caller holds the lock."""
+        items = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as file:
+                items = json.load(file)
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError: # Torn write of a crashed save
+                        continue
+                    if record["item"] is None:
+                        items.pop(record["key"], None)
+                    else:
+                        items[record["key"]] = record["item"]
+        return items
+
+    def save(self):
+        """Rewrites the whole schedule (after bulk changes such as merging wrong questions)."""
+        with self._lock:
+            items = {key: dict(item) for key, item in self.items.items()}
+            self._dirty.clear()
+        with file_lock(self.path):
+            atomic_write_json(self.path, items, indent=None)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+
+    def flush_changes(self):
+        """
+        Appends the entries changed since the last write to the journal (safe to call
+        from the write-behind flusher). Entries other processes changed are kept.
+        """
+        with self._lock:
+            changes = [{"key": key, "item": dict(self.items[key]) if key in self.items else None}
+                       for key in sorted(self._dirty)]
+            self._dirty.clear()
+        if not changes:
+            return
+        try:
+            with file_lock(self.path):
+                with open(self.journal_path, "ab") as file:
+                    file.write("".join(json.dumps(change, ensure_ascii=False) + "\n" for change in changes).encode("utf-8"))
+                    file.flush()
+                    os.fsync(file.fileno())
+                if os.path.getsize(self.journal_path) > self.compact_bytes:
+                    atomic_write_json(self.path, self._replay(), indent=None)
+                    os.remove(self.journal_path)
+        except Exception:
+            with self._lock: # Written with the next change
+                self._dirty.update(change["key"] for change in changes)
+            raise
+
+    def delete_files(self):
+        """Removes the schedule file and its journal, and forgets every entry."""
+        self.clear()
+        with self._lock:
+            self._dirty.clear()
+        remove_file(self.journal_path)
+        return remove_file(self.path)
+
+    def _push(self, key):
+        heapq.heappush(self._heap, (self.items[key]["due"], key))
+        self._dirty.add(key)
+
+    def _is_current(self, entry):
+        due, key = entry
+        item = self.items.get(key)
+        return item is not None and item["due"] == due
+
+    def add(self, key, now=None):
+        """Schedules a new wrong question for review right away (no-op if already scheduled)."""
+        with self._lock:
+            if key in self.items:
+                return
+            self.items[key] = {"ease": DEFAULT_EASE, "interval": 0, "repetitions": 0,
+                               "due": now if now is not None else time.time(), "lapses": 0, "last_review": None}
+            self._push(key)
+
+    def lapse(self, key, now=None):
+        """The question was answered wrong again in an exam: restart its schedule."""
+        with self._lock:
+            if key not in self.items:
+                self.add(key, now)
+                return
+            self.review(key, RESULT_QUALITY["错误"], now)
+
+    def remove(self, key):
+        # The heap entry is left behind and skipped once it reaches the top
+        with self._lock:
+            if self.items.pop(key, None) is not None:
+                self._dirty.add(key)
+
+    def clear(self):
+        with self._lock:
+            self._dirty.update(self.items)
+            self.items = {}
+            self._heap = []
+
+    def sync(self, keys, now=None):
+        """Adds unscheduled keys and drops entries whose wrong question no longer exists."""
+        keys = set(keys)
+        with self._lock:
+            for key in self.items.keys() - keys:
+                self.remove(key)
+            for key in keys - self.items.keys():
+                self.add(key, now)
+
+    def review(self, key, quality, now=None):
+        """
+        Applies one SM-2 step for a recall quality of 0-5 and returns the updated entry.
+        Quality below 3 restarts the repetitions with a one day interval.
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            return self._review(key, quality, now)
+
+    def _review(self, key, quality, now):
+        item = self.items[key]
+        if quality < 3:
+            item["repetitions"] = 0
+            item["interval"] = 1
+            item["lapses"] += 1
+        else:
+            item["repetitions"] += 1
+            if item["repetitions"] == 1:
+                item["interval"] = 1
+            elif item["repetitions"] == 2:
+                item["interval"] = 6
+            else:
+                item["interval"] = round(item["interval"] * item["ease"])
+        item["ease"] = max(MIN_EASE, item["ease"] + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+        item["due"] = now + item["interval"] * DAY_SECONDS
+        item["last_review"] = now
+        self._push(key)
+        return item
+
+    def next_due(self, now=None):
+        """Returns the key of the most overdue entry, or None if nothing is due."""
+        now = now if now is not None else time.time()
+        with self._lock:
+            while self._heap and not self._is_current(self._heap[0]):
+                heapq.heappop(self._heap)
+            if self._heap and self._heap[0][0] <= now:
+                return self._heap[0][1]
+            return None
+
+    def due_keys(self, now=None, limit=20):
+        """Returns up to limit due keys, most overdue first, in O(limit log n)."""
+        now = now if now is not None else time.time()
+        keys = []
+        popped = []
+        with self._lock:
+            while self._heap and len(keys) < limit:
+                entry = heapq.heappop(self._heap)
+                if not self._is_current(entry):
+                    continue
+                if entry[0] > now:
+                    popped.append(entry)
+                    break
+                keys.append(entry[1])
+                popped.append(entry)
+            for entry in popped:
+                heapq.heappush(self._heap, entry)
+        return keys
@@ -0,0 +1,260 @@
+import argparse
+import contextlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from storage import atomic_write_json, read_json
+
+# Layout (little-endian):
+#   header  MAGIC | u32 record count | u64 offset of the offset table
+#   records u32 key length | key (UTF-8) | u32 value length | value (compact JSON, UTF-8), in the original key order
+#   table   u64 record offset per record, sorted by key bytes (binary searched in place)
+# SUMMARY_MAGIC files also store a summary of each record (compact JSON, e.g. a preview
+# for listings) between the key and the value: u32 summary length | summary
+MAGIC = b"AISNAP01"
+SUMMARY_MAGIC = b"AISNAP02"
+SUMMARY_CHARS = 64 # Longest string summary written by field_summary()
+_HEADER = struct.Struct("<8sIQ")
+_LENGTH = struct.Struct("<I")
+_OFFSET = struct.Struct("<Q")
+SNAPSHOT_SUFFIX = ".snap"
+
+
+def _encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def field_summary(field):
+    """A summary function for write_snapshot(): the record's field, strings cut to SUMMARY_CHARS."""
+    def summary(value):
+        field_value = value.get(field) if isinstance(value, dict) else None
+        return field_value[:SUMMARY_CHARS] if isinstance(field_value, str) else field_value
+    return summary
+
+
+def write_snapshot(path, data, summary=None):
+    """
+    Writes a {key: JSON value} dict as a snapshot file, atomically (temp file + rename).
+    summary(value), if given, is stored with each record and read back by
+    SnapshotReader.summaries() without decoding the values.
+    """
+    magic = MAGIC if summary is None else SUMMARY_MAGIC
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(_HEADER.pack(magic, 0, 0))
+            offsets = []
+            for key, value in data.items():
+                key_bytes = str(key).encode("utf-8")
+                value_bytes = _encode(value)
+                offsets.append((key_bytes, file.tell()))
+                file.write(_LENGTH.pack(len(key_bytes)) + key_bytes)
+                if summary is not None:
+                    summary_bytes = _encode(summary(value))
+                    file.write(_LENGTH.pack(len(summary_bytes)) + summary_bytes)
+                file.write(_LENGTH.pack(len(value_bytes)) + value_bytes)
+            table_offset = file.tell()
+            offsets.sort()
+            file.write(b"".join(_OFFSET.pack(offset) for _, offset in offsets))
+            file.seek(0)
+            file.write(_HEADER.pack(magic, len(offsets), table_offset))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+
+class SnapshotReader:
+    """
+    Memory-mapped read access to a snapshot file. get(key) binary searches the
+    offset table and decodes only that record; nothing else in the file is parsed.
+        with SnapshotReader("discuss.snap") as snapshot:
+            dialog = snapshot.get("dialog42")
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # Empty file
+            self._file.close()
+            raise ValueError(f"{path} is not a snapshot file")
+        if len(self._map) < _HEADER.size or self._map[:len(MAGIC)] not in (MAGIC, SUMMARY_MAGIC):
+            self.close()
+            raise ValueError(f"{path} is not a snapshot file")
+        magic, self.count, self._table_offset = _HEADER.unpack_from(self._map, 0)
+        self.has_summaries = magic == SUMMARY_MAGIC
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if not self._file.closed:
+            self._map.close()
+            self._file.close()
+
+    def __len__(self):
+        return self.count
+
+    def _read_key(self, offset):
+        """Returns (key bytes, offset of the value length) of the record at offset."""
+        key_length, = _LENGTH.unpack_from(self._map, offset)
+        key_start = offset + _LENGTH.size
+        value_offset = key_start + key_length
+        if self.has_summaries: # Skip the summary
+            summary_length, = _LENGTH.unpack_from(self._map, value_offset)
+            value_offset += _LENGTH.size + summary_length
+        return self._map[key_start:key_start + key_length], value_offset
+
+    def _read_value(self, offset):
+        value_length, = _LENGTH.unpack_from(self._map, offset)
+        value_start = offset + _LENGTH.size
+        return json.loads(self._map[value_start:value_start + value_length].decode("utf-8"))
+
+    def _find(self, key):
+        """Offset of the value length of key's record, or None."""
+        key_bytes = str(key).encode("utf-8")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            record_offset, = _OFFSET.unpack_from(self._map, self._table_offset + middle * _OFFSET.size)
+            middle_key, value_offset = self._read_key(record_offset)
+            if middle_key == key_bytes:
+                return value_offset
+            if middle_key < key_bytes:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def get(self, key, default=None):
+        value_offset = self._find(key)
+        return default if value_offset is None else self._read_value(value_offset)
+
+    def __getitem__(self, key):
+        value_offset = self._find(key)
+        if value_offset is None:
+            raise KeyError(key)
+        return self._read_value(value_offset)
+
+    def _records(self):
+        offset = _HEADER.size
+        for _ in range(self.count):
+            key_bytes, value_offset = self._read_key(offset)
+            value_length, = _LENGTH.unpack_from(self._map, value_offset)
+            yield key_bytes.decode("utf-8"), value_offset
+            offset = value_offset + _LENGTH.size + value_length
+
+    def keys(self):
+        """Keys in their original order, without decoding any value."""
+        return [key for key, _ in self._records()]
+
+    def summaries(self):
+        """
+        (key, summary) in the original key order, decoding only the summaries.
+        Raises ValueError if the file was written without them.
+        """
+        if not self.has_summaries:
+            raise ValueError(f"{self.path} has no record summaries")
+        result = []
+        offset = _HEADER.size
+        for _ in range(self.count):
+            key_length, = _LENGTH.unpack_from(self._map, offset)
+            summary_offset = offset + _LENGTH.size + key_length
+            key, value_offset = self._read_key(offset)
+            result.append((key.decode("utf-8"), self._read_value(summary_offset)))
+            value_length, = _LENGTH.unpack_from(self._map, value_offset)
+            offset = value_offset + _LENGTH.size + value_length
+        return result
+
+    def items(self):
+        for key, value_offset in self._records():
+            yield key, self._read_value(value_offset)
+
+    def to_dict(self):
+        return dict(self.items())
+
+
+def read_snapshot(path):
+    """Loads a whole snapshot file into a dict (same as json.load of the JSON layout)."""
+    with SnapshotReader(path) as snapshot:
+        return snapshot.to_dict()
+
+
+def json_to_snapshot(json_path, snapshot_path, summary=None):
+    """Converts a JSON object file (discuss.json, wrong.json, ...) and checks the result reads back equal."""
+    data = read_json(json_path)
+    if not isinstance(data, dict):
+        raise ValueError(f"{json_path} does not hold a JSON object")
+    write_snapshot(snapshot_path, data, summary)
+    if read_snapshot(snapshot_path) != data:
+        raise ValueError(f"{snapshot_path} does not match {json_path}")
+    return len(data)
+
+
+def _line_ending(path):
+    """"\r\n" if the first line of an existing file ends with it, else "\n"."""
+    try:
+        with open(path, "rb") as file:
+            return "\r\n" if file.readline().endswith(b"\r\n") else "\n"
+    except FileNotFoundError:
+        return "\n"
+
+
+def snapshot_to_json(snapshot_path, json_path, newline=None, **dump_options):
+    """
+    Converts back to the JSON layout (ensure_ascii=False, indent=4 unless overridden).
+    Lines end with newline; by default with the line ending of the file being replaced
+    (LF for a new file), so a round trip of discuss.json gives back the same bytes.
+    """
+    data = read_snapshot(snapshot_path)
+    atomic_write_json(json_path, data, newline=newline or _line_ending(json_path), **dump_options)
+    return len(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert JSON data files to and from the snapshot format.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    to_snapshot = commands.add_parser("to-snapshot", help="JSON object file -> snapshot")
+    to_snapshot.add_argument("json_path")
+    to_snapshot.add_argument("snapshot_path", nargs="?", help="defaults to the JSON path with a .snap suffix")
+    to_snapshot.add_argument("--summary-field", help="store this field of each record as its summary (Q1 for discuss.json)")
+    to_json = commands.add_parser("to-json", help="snapshot -> JSON object file")
+    to_json.add_argument("snapshot_path")
+    to_json.add_argument("json_path")
+    to_json.add_argument("--newline", choices=("lf", "crlf"), help="line ending (default: that of the file replaced, else lf)")
+    get = commands.add_parser("get", help="print one record by key")
+    get.add_argument("snapshot_path")
+    get.add_argument("key")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    if args.command == "to-snapshot":
+        output_path = args.snapshot_path or os.path.splitext(args.json_path)[0] + SNAPSHOT_SUFFIX
+        summary = field_summary(args.summary_field) if args.summary_field else None
+        count = json_to_snapshot(args.json_path, output_path, summary)
+        print(f"Wrote {count} records to {output_path} in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+    elif args.command == "to-json":
+        count = snapshot_to_json(args.snapshot_path, args.json_path, {"lf": "\n", "crlf": "\r\n"}.get(args.newline))
+        print(f"Wrote {count} records to {args.json_path} in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+    else:
+        with SnapshotReader(args.snapshot_path) as snapshot_file:
+            record = snapshot_file.get(args.key)
+        if record is None:
+            parser.exit(1, f"{args.key} not found\n")
+        print(json.dumps(record, ensure_ascii=False, indent=4))
@@ -0,0 +1,101 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import record_cache_hit
+
+# Question types graded by the LLM; choice questions are checked locally and gain nothing
+SPECULATIVE_TYPES = ("填空", "简答")
+
+
+class SpeculativeGrader:
+    """
+    Grades the answers of one exam in the background while the student is still
+    answering. When the student leaves a question, schedule() waits `delay`
+    seconds and, if the answer has not changed meanwhile, runs
+    grade_fn(question, answer) on a small thread pool. The evaluation is cached
+    against the exact answer text, so at submit time grade() only calls grade_fn
+    for answers that changed (or were never left long enough); for an answer
+    whose grading is still running it waits for that call instead of repeating it.
+    """
+
+    def __init__(self, grade_fn, delay=3.0, max_workers=2):
+        self.grade_fn = grade_fn
+        self.delay = delay
+        self.stats = {"scheduled": 0, "debounced": 0, "speculated": 0, "hits": 0, "misses": 0}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative-grading")
+        self._timers = {} # index -> Timer waiting for the answer to settle
+        self._results = {} # index -> (answer, Future) of the latest speculative grading
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def schedule(self, index, question, answer, current_answer):
+        """
+        Grades answer to question `index` after `delay` seconds unless current_answer()
+        returns something else by then. A later schedule() or cancel() for the same
+        index replaces the pending one (debounce).
+        """
+        answer = (answer or "").strip()
+        if question.get("type") not in SPECULATIVE_TYPES or not answer:
+            self.cancel(index)
+            return
+        with self._lock:
+            if self._closed:
+                return
+            cached = self._results.get(index)
+            if cached and cached[0] == answer:
+                return # Already graded or grading
+            self._cancel_timer(index)
+            timer = threading.Timer(self.delay, self._fire, args=(index, question, answer, current_answer))
+            timer.daemon = True
+            self._timers[index] = timer
+            self.stats["scheduled"] += 1
+        timer.start()
+
+    def cancel(self, index):
+        """Drops the pending grading of question `index` (its answer is being edited)."""
+        with self._lock:
+            self._cancel_timer(index)
+
+    def _cancel_timer(self, index):
+        timer = self._timers.pop(index, None)
+        if timer is not None:
+            timer.cancel()
+            self.stats["debounced"] += 1
+
+    def _fire(self, index, question, answer, current_answer):
+        with self._lock:
+            if self._closed or self._timers.get(index) is not threading.current_thread():
+                return
+            del self._timers[index]
+            if (current_answer() or "").strip() != answer:
+                self.stats["debounced"] += 1
+                return
+            self.stats["speculated"] += 1
+            self._results[index] = (answer, self._executor.submit(self.grade_fn, question, answer))
+
+    def grade(self, index, question, answer):
+        """Evaluation of answer: the cached speculative one if the text matches, else graded now."""
+        answer = (answer or "").strip()
+        if question.get("type") not in SPECULATIVE_TYPES:
+            return self.grade_fn(question, answer)
+        with self._lock:
+            self._cancel_timer(index)
+            cached = self._results.get(index)
+        if cached and cached[0] == answer:
+            try:
+                evaluation = cached[1].result()
+                if evaluation.get("result") != "评估失败": # Failed calls are retried below
+                    self.stats["hits"] += 1
+                    record_cache_hit("grading")
+                    return evaluation
+            except Exception as e:
+                print(f"Speculative grading of question {index + 1} failed: {e}")
+        self.stats["misses"] += 1
+        return self.grade_fn(question, answer)
+
+    def close(self):
+        """Stops pending and queued gradings; results of running calls are discarded."""
+        with self._lock:
+            self._closed = True
+            for index in list(self._timers):
+                self._cancel_timer(index)
+        self._executor.shutdown(wait=False, cancel_futures=True)
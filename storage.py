@@ -0,0 +1,145 @@
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+# Lock wait statistics of this process, see get_lock_stats()
+_stats_lock = threading.Lock()
+_lock_stats = {"acquisitions": 0, "contended": 0, "total_wait_ms": 0.0, "max_wait_ms": 0.0}
+CONTENDED_MS = 1.0 # Waits longer than this count as contended
+
+
+def _record_wait(wait_ms):
+    with _stats_lock:
+        _lock_stats["acquisitions"] += 1
+        _lock_stats["total_wait_ms"] += wait_ms
+        _lock_stats["max_wait_ms"] = max(_lock_stats["max_wait_ms"], wait_ms)
+        if wait_ms > CONTENDED_MS:
+            _lock_stats["contended"] += 1
+
+
+def get_lock_stats():
+    """Returns a copy of the lock wait statistics, with the average wait added."""
+    with _stats_lock:
+        stats = dict(_lock_stats)
+    stats["avg_wait_ms"] = stats["total_wait_ms"] / stats["acquisitions"] if stats["acquisitions"] else 0.0
+    return stats
+
+
+@contextlib.contextmanager
+def file_lock(path, shared=False):
+    """
+    Advisory lock on `path` held through the sidecar file `path + ".lock"`, so the data
+    file itself can be replaced atomically while locked. Readers take a shared lock,
+    writers an exclusive one. Windows has no shared byte-range locks, so both are exclusive there.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    start_time = time.perf_counter()
+    with open(path + ".lock", "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError: # LK_LOCK gives up after ~10 s; keep waiting
+                    continue
+        _record_wait((time.perf_counter() - start_time) * 1000)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def atomic_write_json(path, data, newline=None, **dump_options):
+    """
+    Writes JSON to a temp file in the same directory, fsyncs it and renames it over path,
+    so readers see either the old or the new file, never a truncated one.
+    dump_options default to ensure_ascii=False, indent=4 (the layout of the existing files).
+    newline is passed to open(): None writes the platform's line ending.
+    """
+    dump_options.setdefault("ensure_ascii", False)
+    dump_options.setdefault("indent", 4)
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline=newline) as file:
+            json.dump(data, file, **dump_options)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+
+def _load_json(path, default):
+    if not os.path.exists(path):
+        return default() if callable(default) else default
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def read_json(path, default=None):
+    """Reads a JSON file under a shared lock; returns default (or default()) if it does not exist."""
+    with file_lock(path, shared=True):
+        return _load_json(path, default)
+
+
+def write_json(path, data, **dump_options):
+    """Replaces a JSON file atomically under an exclusive lock."""
+    with file_lock(path):
+        atomic_write_json(path, data, **dump_options)
+
+
+class JsonUpdate:
+    """The document handed out by update_json. Mutate `data` (or assign it); discard() skips the write."""
+
+    def __init__(self, data):
+        self.data = data
+        self.write = True
+
+    def discard(self):
+        self.write = False
+
+
+@contextlib.contextmanager
+def update_json(path, default=dict, **dump_options):
+    """
+    Read-modify-write of a JSON file under one exclusive lock, so concurrent writers
+    in other processes cannot lose each other's updates:
+        with update_json("wrong.json") as doc:
+            doc.data["7"] = question
+    The file is written atomically when the block exits normally and not discarded.
+    """
+    with file_lock(path):
+        doc = JsonUpdate(_load_json(path, default))
+        yield doc
+        if doc.write:
+            atomic_write_json(path, doc.data, **dump_options)
+
+
+def remove_file(path):
+    """Deletes a data file under an exclusive lock. Returns True if it existed."""
+    with file_lock(path):
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
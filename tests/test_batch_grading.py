@@ -0,0 +1,45 @@
+import json
+
+from batch_grading import BatchGrader
+
+QUESTIONS = [
+    {"type": "选择", "description": "霍尔元件测量的是？", "option": "A:磁场,B:温度,C:湿度,D:压力", "answer": "A", "explanation": "略"},
+    {"type": "简答", "description": "简述压电效应。", "answer": "受力产生电荷", "explanation": "略"},
+]
+STUDENTS = [("s1", {0: "A", 1: "受力后表面产生电荷"}), ("s2", {0: "B", 1: "不知道"})]
+
+
+class FlakyGrader:
+    """Fails the first grading of one answer, like a timed-out LLM call."""
+
+    def __init__(self, failing_answer):
+        self.failing_answer = failing_answer
+        self.calls = []
+
+    def __call__(self, question, user_answer):
+        self.calls.append(user_answer)
+        if user_answer == self.failing_answer and self.calls.count(user_answer) == 1:
+            return {"result": "评估失败", "score": 0, "reason": "GPT 评估出错: timeout"}
+        return {"result": "正确", "score": 10, "reason": "ok"}
+
+
+def read_results(path):
+    with open(path, encoding="utf-8") as file:
+        return {record["student_id"]: record for record in map(json.loads, file)}
+
+
+def test_resume_grades_failed_answer_again(tmp_path):
+    output = str(tmp_path / "results.jsonl")
+    grade = FlakyGrader(failing_answer="受力后表面产生电荷")
+
+    first = BatchGrader(QUESTIONS, output, grade, processes=1, llm_threads=2).run(iter(STUDENTS))
+    assert first["failed"] == 1
+    assert set(read_results(output)) == {"s2"}
+
+    second = BatchGrader(QUESTIONS, output, grade, processes=1, llm_threads=2).run(iter(STUDENTS))
+    assert second["skipped"] == 1 and second["failed"] == 0
+    assert grade.calls.count("受力后表面产生电荷") == 2 # Graded again on resume
+    assert grade.calls.count("不知道") == 1 # s2 was written by the first run and is skipped
+    results = read_results(output)
+    assert results["s1"]["evaluations"]["1"]["result"] == "正确"
+    assert results["s1"]["total_score"] == 20
@@ -0,0 +1,106 @@
+import json
+import os
+import shutil
+
+import backendlogic
+import snapshot_format
+import pytest
+
+from chat_store import JsonChatStore, JournalChatStore, SnapshotChatStore, open_chat_store
+from snapshot_format import SnapshotReader, json_to_snapshot, snapshot_to_json
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def converse(logic, *turns):
+    for question, answer in turns:
+        logic.conversation_history += [{"role": "user", "content": question},
+                                       {"role": "assistant", "content": answer}]
+
+
+def read_bytes(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def test_default_backend_is_append_only(workdir):
+    assert isinstance(open_chat_store("discuss.json"), JournalChatStore)
+    assert isinstance(backendlogic.AppLogic()._get_chat_store(), JournalChatStore)
+
+
+@pytest.mark.parametrize("store_class", [JsonChatStore, JournalChatStore, SnapshotChatStore])
+def test_continuing_a_deleted_dialog_starts_a_new_one(workdir, store_class):
+    store = store_class("discuss.json")
+    first = [("什么是应变片？", "利用应变效应的传感元件。"), ("灵敏系数呢？", "电阻相对变化与应变之比。")]
+    dialog_key, _ = store.append_turns(None, first)
+    assert store.delete_dialog(dialog_key)
+
+    # Another session reuses the freed key for its own one-turn dialog
+    other = [("热电偶的原理？", "塞贝克效应。")]
+    assert store.append_turns(None, other)[0] == dialog_key
+    # The first session continues its dialog: it must neither resurrect it nor write into the other one
+    continued_key, fields = store.append_turns(dialog_key, first + [("温度影响呢？", "需要温度补偿。")], persisted=2)
+    assert continued_key != dialog_key and fields["Q1"] == "什么是应变片？" and fields["A3"] == "需要温度补偿。"
+    assert store.load_dialog(dialog_key) == {"num": 1, "Q1": "热电偶的原理？", "A1": "塞贝克效应。"}
+
+    assert store.delete_dialog(dialog_key)
+    # A deleted dialog is written again in full, under whichever key is free
+    new_key, fields = store.append_turns(dialog_key, other + [("冷端补偿？", "补偿冷端温度。")], persisted=1)
+    assert set(fields) == {"Q1", "A1", "Q2", "A2"} and store.load_dialog(new_key)["num"] == 2
+
+
+def test_closing_the_session_brings_discuss_json_up_to_date(workdir):
+    logic = backendlogic.AppLogic()
+    converse(logic, ("什么是应变片？", "利用应变效应的传感元件。"))
+    logic.save_chat_history_later()
+    logic.close()
+
+    assert not os.path.exists(logic._get_chat_store().journal_path)
+    with open(logic.chat_record_path, encoding="utf-8") as file: # As a direct reader sees it
+        assert json.load(file) == {"dialog1": {"num": 1, "Q1": "什么是应变片？", "A1": "利用应变效应的传感元件。"}}
+
+
+def test_saves_never_rewrite_unchanged_turns(workdir):
+    logic = backendlogic.AppLogic()
+    store = logic._get_chat_store()
+    converse(logic, ("什么是应变片？", "利用应变效应的传感元件。"), ("灵敏系数呢？", "电阻相对变化与应变之比。"))
+    logic.save_chat_history()
+    document = read_bytes(store.path)
+    journal = read_bytes(store.journal_path)
+
+    converse(logic, ("温度影响呢？", "需要温度补偿。"))
+    logic.save_chat_history()
+    logic.save_chat_history() # Nothing new: nothing is written
+
+    assert read_bytes(store.path) == document
+    new_journal = read_bytes(store.journal_path)
+    assert new_journal.startswith(journal) # Earlier records untouched
+    records = [json.loads(line) for line in new_journal[len(journal):].splitlines()]
+    assert records == [{"dialog": logic.current_dialog_key, "start": 2, "turns": [["温度影响呢？", "需要温度补偿。"]]}]
+    assert store.load_dialog(logic.current_dialog_key)["num"] == 3
+
+
+def test_snapshot_history_list_does_not_decode_dialogs(workdir, monkeypatch):
+    store = SnapshotChatStore("discuss.json", compact_bytes=0) # Every save compacts into discuss.snap
+    store.append_turns(None, [("什么是压电效应？" * 10, "某些晶体受力时产生电荷。")])
+    store.compact_bytes = 1 << 20
+    store.append_turns(None, [("霍尔元件怎么接线？", "四个端子……")])
+
+    def fail(*args):
+        raise AssertionError("whole archive decoded")
+    monkeypatch.setattr(SnapshotReader, "items", fail) # Behind load_all() and to_dict()
+    assert store.list_dialogs() == [("dialog1", ("什么是压电效应？" * 10)[:30]), ("dialog2", "霍尔元件怎么接线？")]
+
+    logic = backendlogic.AppLogic()
+    logic.chat_store = store
+    assert logic.load_chat_history_list() == (store.list_dialogs(), {})
+    conversation, error = logic.load_chat_detail(None, "dialog1") # One record, by key
+    assert error is None and conversation[1]["content"] == "某些晶体受力时产生电荷。"
+
+
+def test_snapshot_round_trip_keeps_the_tracked_file_bytes(workdir):
+    shutil.copy(os.path.join(REPO_ROOT, "discuss.json"), "discuss.json")
+    original = read_bytes("discuss.json")
+    json_to_snapshot("discuss.json", "discuss.snap", snapshot_format.field_summary("Q1"))
+    snapshot_to_json("discuss.snap", "discuss.json")
+    assert read_bytes("discuss.json") == original
@@ -0,0 +1,72 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import instrumentation
+from instrumentation import MetricsRegistry, record_cache_hit, timed_completion
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """A fresh default registry, with each LLM call taking 0.3 s."""
+    registry = MetricsRegistry()
+    monkeypatch.setattr(instrumentation, "_default_registry", registry)
+    clock = iter(n * 0.3 for n in range(100))
+    monkeypatch.setattr(instrumentation, "time", SimpleNamespace(perf_counter=lambda: next(clock), time=time.time))
+    return registry
+
+
+def completion(**kwargs):
+    return {"usage": {"prompt_tokens": 1000, "completion_tokens": 100},
+            "choices": [{"message": {"content": "ok"}}]}
+
+
+def failing_completion(**kwargs):
+    raise TimeoutError("Request timed out")
+
+
+def metric_lines(registry):
+    return registry.to_prometheus().splitlines()
+
+
+def test_metrics_text_has_calls_latency_tokens_and_cost(registry):
+    timed_completion("grading", completion, model="gpt-4o", messages=[])
+    with pytest.raises(TimeoutError):
+        timed_completion("grading", failing_completion, model="gpt-4o", messages=[])
+    record_cache_hit("grading", 2)
+    lines = metric_lines(registry)
+
+    assert "# TYPE llm_calls_total counter" in lines
+    assert 'llm_calls_total{call_site="grading",outcome="ok"} 1' in lines
+    assert 'llm_calls_total{call_site="grading",outcome="error"} 1' in lines
+    assert 'llm_cache_hits_total{call_site="grading"} 2' in lines
+    assert 'llm_tokens_total{call_site="grading",type="prompt"} 1000' in lines
+    assert 'llm_cost_usd_total{call_site="grading"} 0.0035' in lines # 1000 * 2.5 / 1e6 + 100 * 10 / 1e6
+    # Cumulative buckets: both 0.3 s calls fall in le=0.5 and every bound above it
+    assert 'llm_call_duration_seconds_bucket{call_site="grading",le="0.25"} 0' in lines
+    assert 'llm_call_duration_seconds_bucket{call_site="grading",le="0.5"} 2' in lines
+    assert 'llm_call_duration_seconds_bucket{call_site="grading",le="+Inf"} 2' in lines
+    assert 'llm_call_duration_seconds_count{call_site="grading"} 2' in lines
+    assert lines.count("# TYPE llm_call_duration_seconds histogram") == 1
+
+
+def test_metrics_text_exports_collectors_and_escapes_labels(registry):
+    registry.register_collector("write_behind", lambda: {"written": 3, "state": "idle"})
+    registry.register_collector("broken", lambda: 1 / 0)
+    registry.inc("events_total", labels={"path": 'C:\\data\\"new"'})
+    lines = metric_lines(registry)
+
+    assert lines[-2:] == ["# TYPE write_behind_written gauge", "write_behind_written 3"] # Non-numbers are left out
+    assert 'events_total{path="C:\\\\data\\\\\\"new\\""} 1' in lines
+
+
+def test_metrics_json_has_quantiles_and_recent_spans(registry):
+    for _ in range(3):
+        timed_completion("chat", completion, model="gpt-4o", messages=[])
+    report = registry.to_json(recent=2)
+
+    [latency] = [h for h in report["histograms"] if h["name"] == "llm_call_duration_seconds"]
+    assert latency["count"] == 3 and latency["mean"] == pytest.approx(0.3)
+    assert 0.25 < latency["p50"] <= latency["p99"] <= 0.5
+    assert [span["latency_s"] for span in report["recent_spans"]] == [0.3, 0.3]
@@ -0,0 +1,54 @@
+import json
+import os
+
+from llm_parse import decode_json_object, parse_evaluation_record, parse_records, parse_score
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "llm_responses.jsonl")
+
+
+def test_records_among_prose_fences_and_full_width_punctuation():
+    text = ("好的，以下是为你生成的考题：\n```\n"
+            '{type="选择", description="1+1=？", option="A:1,B:2,C:3,D:4", answer="B", explanation="略"}\n'
+            "｛type＝“填空”，description＝“床前明月光，_______地上霜。”，option＝None，answer＝“疑是”｝\n"
+            '{"type": "简答", "description": "简述压电效应。", "answer": "受力产生电荷。"}\n```\n祝你考试顺利！')
+    records = parse_records(text)
+
+    assert [record["type"] for record in records] == ["选择", "填空", "简答"]
+    assert records[0]["description"] == "1+1=？" and records[0]["option"] == "A:1,B:2,C:3,D:4"
+    assert records[1]["description"] == "床前明月光，_______地上霜。" and records[1]["option"] == "None"
+
+
+def test_unescaped_quotes_escapes_and_truncation():
+    text = ('{description="所谓"零点漂移"是指什么？", answer="温度\\n变化\\u5f15起", explanation="\\frac{a}{b}"}\n'
+            '{type="简答", description="简述热电偶的冷端补')
+    first, truncated = parse_records(text)
+
+    assert first["description"] == '所谓"零点漂移"是指什么？' # Inner quotes kept as text
+    assert first["answer"] == "温度\n变化引起" and first["explanation"] == "\\frac{a}{b}"
+    assert truncated == {"type": "简答", "description": "简述热电偶的冷端补"}
+
+
+def test_evaluation_scores_in_the_forms_graders_reply_with():
+    assert parse_evaluation_record('{score=8, reason="基本正确"}') == {"score": 8, "reason": "基本正确"}
+    assert parse_evaluation_record("评分如下：score: ８分 reason: 缺少温度补偿")["score"] == 8
+    assert parse_evaluation_record('score=7.5/10, reason="部分正确"')["score"] == 7
+    # The first record with a usable score counts
+    assert parse_evaluation_record('{score="待定"} {score=6, reason="见上"}') == {"score": 6, "reason": "见上"}
+    assert parse_evaluation_record("无法评分。") is None
+    assert parse_score("满分") is None
+
+
+def test_structured_output_falls_back_to_the_tolerant_parser():
+    assert decode_json_object('{"score": 9, "reason": "正确"}') == {"score": 9, "reason": "正确"}
+    assert decode_json_object("[1, 2]") is None and decode_json_object("score=9") is None
+
+
+def test_every_corpus_response_yields_records():
+    with open(CORPUS, encoding="utf-8") as file:
+        responses = [json.loads(line) for line in file if line.strip()]
+    for response in responses:
+        if response["kind"] == "questions":
+            records = parse_records(response["text"])
+            assert records and all("description" in record for record in records), response["text"][:80]
+        else:
+            assert parse_evaluation_record(response["text"]) is not None, response["text"][:80]
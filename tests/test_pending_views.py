@@ -0,0 +1,51 @@
+import backendlogic
+from write_behind import WriteBehindQueue
+
+
+def turn(question, answer):
+    return [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+
+
+def slow_logic():
+    logic = backendlogic.AppLogic("alice")
+    logic.write_behind = WriteBehindQueue(delay=60) # Nothing is written unless a view flushes
+    return logic
+
+
+def test_history_list_shows_queued_dialog_without_flushing(workdir):
+    logic = slow_logic()
+    logic.conversation_history = turn("什么是霍尔效应？", "磁场中的载流导体……")
+    logic.save_chat_history_later()
+
+    history_list, chat_data = logic.load_chat_history_list()
+    assert len(logic.write_behind) == 1
+    [(dialog_key, preview)] = history_list
+    assert preview == "什么是霍尔效应？"
+
+    # Continuing the queued dialog extends the same pending save instead of starting another one
+    conversation, error = logic.load_chat_detail({}, dialog_key)
+    assert error is None and conversation == logic.conversation_history
+    logic.conversation_history += turn("它有什么应用？", "霍尔传感器……")
+    logic.save_chat_history_later()
+    assert len(logic.write_behind) == 1
+
+    logic.write_behind.close()
+    stored = logic._get_chat_store().load_all()
+    assert list(stored) == ["dialog1"] and stored["dialog1"]["num"] == 2
+    assert logic.load_chat_history_list()[0] == [("dialog1", "什么是霍尔效应？")]
+
+
+def test_wrong_book_types_include_queued_exam_without_flushing(workdir):
+    logic = slow_logic()
+    logic.exam_questions = [{"type": "填空", "description": "热电偶基于____效应。", "answer": "塞贝克"}]
+    logic.evaluation_results = {0: {"result": "错误", "score": 0}}
+    logic.user_answers = {0: "霍尔"}
+    logic.save_wrong_questions_later()
+
+    assert logic.wrong_question_types() == {"填空"}
+    assert len(logic.write_behind) == 1
+
+    logic.write_behind.close()
+    wrong_data, error = logic.load_wrong_questions()
+    assert error is None and [question["type"] for question in wrong_data.values()] == ["填空"]
+    assert logic.wrong_question_types() == {"填空"}
@@ -0,0 +1,67 @@
+import backendlogic
+from question_bank import QuestionBank
+
+
+def choice_question(n):
+    return {"type": "选择", "description": f"第{n}种传感器利用的是哪种效应？", "option": "A:压电,B:霍尔,C:光电,D:热电",
+            "answer": "A", "explanation": "略"}
+
+
+def fake_generation(n):
+    return lambda counts, topics=None, examples=None: ([choice_question(n)], None)
+
+
+def test_two_users_keep_each_others_bank_updates(workdir, monkeypatch):
+    users = []
+    for n, user_id in enumerate(("alice", "bob"), start=1):
+        logic = backendlogic.AppLogic(user_id)
+        logic.exam_layout = {"选择": 1}
+        # As in two processes (Tk and Gradio app): separate copies, both loaded before either writes
+        logic.question_bank = QuestionBank(logic.question_bank_path)
+        monkeypatch.setattr(logic, "_generate_questions_with_llm", fake_generation(n))
+        users.append(logic)
+
+    for logic in users:
+        questions, error = logic.generate_exam_questions()
+        assert error is None and len(questions) == 1
+    for logic in users:
+        logic.user_answers = {0: "A"}
+        logic.submit_exam()
+
+    stored = QuestionBank("question_bank.json").questions
+    assert sorted(question["description"] for question in stored.values()) == [
+        choice_question(1)["description"], choice_question(2)["description"]]
+    for question in stored.values():
+        assert (question["used"], question["correct"], question["wrong"]) == (1, 1, 0)
+
+
+def test_users_share_one_bank_instance(workdir):
+    alice, bob = backendlogic.AppLogic("alice"), backendlogic.AppLogic("bob")
+    assert alice._get_question_bank() is bob._get_question_bank()
+
+
+def test_duplicate_added_by_another_writer_keeps_its_id(workdir):
+    first, second = QuestionBank("bank.json"), QuestionBank("bank.json")
+    [first_id] = first.add_questions([choice_question(1)])
+    assert second.add_questions([choice_question(1), choice_question(2)]) == [first_id, "q2"]
+    assert len(QuestionBank("bank.json")) == 2
+
+
+def test_top_up_skips_regenerated_questions_already_on_the_paper(workdir, monkeypatch):
+    logic = backendlogic.AppLogic()
+    logic.exam_layout = {"选择": 2}
+    logic.question_bank = QuestionBank(logic.question_bank_path)
+    logic.question_bank.add_questions([choice_question(1)])
+    replies = [[choice_question(1)], [choice_question(2)]] # The first reply repeats the bank question
+    requests = []
+
+    def generate(counts, topics=None, examples=None):
+        requests.append(dict(counts))
+        return replies.pop(0), None
+    monkeypatch.setattr(logic, "_generate_questions_with_llm", generate)
+
+    questions, error = logic.generate_exam_questions()
+    assert error is None
+    assert sorted(question["description"] for question in questions) == [
+        choice_question(1)["description"], choice_question(2)["description"]]
+    assert requests == [{"选择": 1}, {"选择": 1}]
@@ -0,0 +1,60 @@
+import json
+import os
+
+import backendlogic
+from review_scheduler import ReviewScheduler
+from storage import write_json
+
+
+def read_bytes(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def test_graded_review_appends_only_the_changed_entry(workdir, monkeypatch):
+    logic = backendlogic.AppLogic()
+    wrong_data = {str(n): {"type": "选择", "description": f"第{n}题", "answer": "A"} for n in range(1, 51)}
+    write_json(logic.wrong_question_path, wrong_data)
+    [(key, question), *_], error = logic.start_review_session()
+    assert error is None
+    logic._get_review_scheduler().save()
+    schedule = read_bytes(logic.review_schedule_path)
+
+    with monkeypatch.context() as patch:
+        # A later session reuses the resident wrong book and schedule: nothing is reread
+        patch.setattr(backendlogic, "read_json", lambda *args, **kwargs: {})
+        patch.setattr(ReviewScheduler, "load", lambda self: None)
+        assert logic.start_review_session()[0][0][0] == key
+
+        evaluation, error = logic.grade_review_answer(key, question, "A")
+        assert error is None and evaluation["interval"] == 1
+        logic.write_behind.flush()
+    assert read_bytes(logic.review_schedule_path) == schedule
+    with open(logic.review_schedule_path + ".journal", encoding="utf-8") as file:
+        records = [json.loads(line) for line in file]
+    assert [record["key"] for record in records] == [key]
+
+    reloaded = ReviewScheduler(logic.review_schedule_path)
+    assert len(reloaded) == 50 and reloaded.items[key]["repetitions"] == 1
+
+
+def test_journal_is_folded_into_the_file_past_compact_bytes(workdir):
+    scheduler = ReviewScheduler("schedule.json", compact_bytes=200)
+    for n in range(10):
+        scheduler.add(str(n), now=0)
+    scheduler.flush_changes()
+    assert not os.path.exists("schedule.json.journal") # Ten entries are past compact_bytes
+    with open("schedule.json", encoding="utf-8") as file:
+        assert len(json.load(file)) == 10
+    scheduler.remove("3")
+    scheduler.flush_changes()
+
+    other = ReviewScheduler("schedule.json") # Another process
+    other.review("5", 5, now=0)
+    other.flush_changes()
+    scheduler.review("7", 5, now=0)
+    scheduler.flush_changes()
+
+    reloaded = ReviewScheduler("schedule.json")
+    assert "3" not in reloaded.items
+    assert reloaded.items["5"]["repetitions"] == reloaded.items["7"]["repetitions"] == 1
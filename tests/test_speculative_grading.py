@@ -0,0 +1,73 @@
+import threading
+import time
+
+from speculative_grading import SpeculativeGrader
+
+QUESTION = {"type": "简答", "description": "简述压电效应。", "answer": "受力产生电荷。"}
+
+
+class RecordingGrader:
+    """grade_fn recording the answers it was called with."""
+
+    def __init__(self, result="正确"):
+        self.result = result
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, question, answer):
+        result = self.result # Decided before the call is visible in calls
+        with self.lock:
+            self.calls.append(answer)
+        return {"result": result, "score": 10, "answer": answer}
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_cached_grading_is_used_only_for_the_same_answer():
+    grade_fn = RecordingGrader()
+    grader = SpeculativeGrader(grade_fn, delay=0.01)
+    grader.schedule(0, QUESTION, " 受力产生电荷 ", lambda: "受力产生电荷")
+    wait_until(lambda: grade_fn.calls)
+
+    assert grader.grade(0, QUESTION, "受力产生电荷")["answer"] == "受力产生电荷"
+    assert grade_fn.calls == ["受力产生电荷"] and grader.stats["hits"] == 1
+
+    # The answer was changed after its speculative grading: graded again, on the new text
+    assert grader.grade(0, QUESTION, "受力后表面产生电荷")["answer"] == "受力后表面产生电荷"
+    assert grade_fn.calls == ["受力产生电荷", "受力后表面产生电荷"] and grader.stats["misses"] == 1
+    grader.close()
+
+
+def test_answers_edited_before_the_delay_are_not_graded_early():
+    grade_fn = RecordingGrader()
+    grader = SpeculativeGrader(grade_fn, delay=0.05)
+    grader.schedule(0, QUESTION, "受力", lambda: "受力产生电荷") # Edited since it was left
+    grader.schedule(1, QUESTION, "温差", lambda: "温差")
+    grader.cancel(1) # Being edited again
+    grader.schedule(2, QUESTION, "光照", lambda: "光照")
+    grader.schedule(2, QUESTION, "光照产生电子", lambda: "光照产生电子") # Replaces the pending one
+    wait_until(lambda: grader.stats["speculated"] == 1)
+    wait_until(lambda: grade_fn.calls)
+    time.sleep(0.1) # Past every delay
+    assert grade_fn.calls == ["光照产生电子"]
+
+    assert grader.grade(1, QUESTION, "温差")["answer"] == "温差"
+    assert grade_fn.calls == ["光照产生电子", "温差"]
+    grader.close()
+
+
+def test_failed_speculative_grading_is_retried_at_submit():
+    grade_fn = RecordingGrader(result="评估失败")
+    grader = SpeculativeGrader(grade_fn, delay=0.01)
+    grader.schedule(0, QUESTION, "受力产生电荷", lambda: "受力产生电荷")
+    wait_until(lambda: grade_fn.calls)
+
+    grade_fn.result = "正确"
+    assert grader.grade(0, QUESTION, "受力产生电荷")["result"] == "正确"
+    assert grade_fn.calls == ["受力产生电荷", "受力产生电荷"] and grader.stats["hits"] == 0
+    grader.close()
@@ -0,0 +1,58 @@
+import tkinter as tk
+
+import pytest
+
+from tk_chat_view import MessageLayout, VirtualChatView
+
+
+@pytest.fixture
+def tk_root():
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        pytest.skip(f"no display: {e}")
+    root.geometry("820x320")
+    yield root
+    root.destroy()
+
+
+def records(count):
+    return [{"role": "assistant" if n % 2 else "user", "content": f"第{n}条消息"} for n in range(count)]
+
+
+def test_layout_moves_messages_below_a_measured_height():
+    layout = MessageLayout()
+    for _ in range(5):
+        layout.append(100)
+    assert layout.visible_range(150, 250) == (1, 3)
+    assert layout.visible_range(150, 250, overscan=1) == (0, 4)
+
+    layout.set_height(1, 40) # Measured shorter than estimated
+    assert [layout.top(index) for index in range(5)] == [0, 100, 140, 240, 340]
+    assert layout.total_height() == 440 and layout.visible_range(150, 250) == (2, 4)
+
+
+def test_scrolling_reuses_message_widgets(tk_root):
+    view = VirtualChatView(tk_root, height=300, overscan=2)
+    view.pack(fill="both", expand=True)
+    view.extend(records(1000))
+    tk_root.update()
+    view.refresh()
+    on_screen = view.row_count
+    assert 0 < on_screen < 40 # About a screenful, not one per message
+
+    for fraction in (0.3, 0.6, 0.9, 0.0):
+        view.canvas.yview_moveto(fraction)
+        view.refresh()
+        tk_root.update()
+        top, height = view.canvas.canvasy(0), max(view.canvas.winfo_height(), 300)
+        start, stop = view.layout.visible_range(top, top + height, view.overscan)
+        assert sorted(view.rows) == list(range(start, stop))
+        for index, row in view.rows.items(): # Recycled rows show their new message
+            assert row.label.cget("text") == view.messages[index][1]
+    assert view.row_count <= on_screen + 2 * view.overscan
+
+    view.clear()
+    view.extend(records(3))
+    view.refresh()
+    assert len(view.rows) == 3 and view.row_count <= on_screen + 2 * view.overscan # Cleared rows are reused too
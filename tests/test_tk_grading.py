@@ -0,0 +1,28 @@
+import queue
+
+import main
+from tk_worker import BackgroundTask
+from usage_ledger import QuotaExceededError
+
+
+def test_failed_grading_does_not_abort_the_exam():
+    app = object.__new__(main.App) # grade_exam runs on the worker thread and uses no widgets
+    replies = [QuotaExceededError("本次会话的 token 额度已不足"), '{score=6, reason="部分正确"}']
+
+    def check_answer_with_gpt(question, user_answer):
+        reply = replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+    app.check_answer_with_gpt = check_answer_with_gpt
+
+    questions = [
+        {"type": "选择", "description": "霍尔元件的材料？", "answer": "B"},
+        {"type": "简答", "description": "简述压电效应。", "answer": "受力产生电荷。"},
+        {"type": "简答", "description": "简述热电效应。", "answer": "温差产生电势。"},
+    ]
+    evaluation_results, total_score = app.grade_exam(BackgroundTask(queue.Queue()), questions, {0: "B", 1: "...", 2: "..."})
+
+    assert total_score == 16
+    assert evaluation_results[1]["result"] == "评估失败" and "额度" in evaluation_results[1]["reason"]
+    assert evaluation_results[2]["score"] == 6
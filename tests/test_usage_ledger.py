@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+import usage_ledger
+from usage_ledger import HistoryTokenCounter, QuotaExceededError, UsageLedger
+from write_behind import WriteBehindQueue
+
+
+@pytest.fixture
+def counted_calls(monkeypatch):
+    """Counts one token per character and records every text counted."""
+    texts = []
+    monkeypatch.setattr(usage_ledger, "count_tokens", lambda text: texts.append(text) or len(text))
+    return texts
+
+
+def message(role, content):
+    return {"role": role, "content": content}
+
+
+def test_check_cuts_the_reply_budget_warns_and_refuses(workdir):
+    ledger = UsageLedger(session_quota=1000, daily_quota=None, max_tokens={"chat": 300}, write_behind=WriteBehindQueue(delay=0))
+    assert ledger.check("chat", 100) == 300 and ledger.pop_warning() is None
+
+    ledger.record("chat", 400, 200)
+    assert ledger.check("chat", 100) == 300 # 1000 - 600 - 100 left
+    ledger.record("chat", 100, 50)
+    assert ledger.check("chat", 100) == 150 # Cut to what the session has left
+    assert "850/1000" in ledger.pop_warning() # Past 80% of the quota, counting this prompt
+    ledger.record("chat", 100, 100)
+    with pytest.raises(QuotaExceededError):
+        ledger.check("chat", 30) # 1000 - 950 - 30 < MIN_REPLY_TOKENS
+
+    ledger.start_session()
+    assert ledger.check("chat", 30) == 300
+
+
+def test_daily_quota_adds_up_every_session_and_process(workdir):
+    ledger = UsageLedger(session_quota=None, daily_quota=1000, write_behind=WriteBehindQueue(delay=0))
+    ledger.record("chat", 300, 100)
+    ledger.record("grading", 100, 50)
+    ledger.write_behind.flush()
+
+    other = UsageLedger(session_quota=None, daily_quota=1000, write_behind=WriteBehindQueue(delay=0)) # Another process
+    assert other.check("generation", 400) == 1000 - 550 - 400
+    other.record("generation", 400, 100)
+    other.write_behind.flush()
+    with open("usage.json", encoding="utf-8") as file:
+        [day] = json.load(file).values()
+    assert day == {"chat": [300, 100], "grading": [100, 50], "generation": [400, 100]}
+
+
+def test_history_counter_counts_only_new_messages(counted_calls):
+    counter = HistoryTokenCounter()
+    history = [message("user", "应变片"), message("assistant", "应变效应")]
+    assert counter.count(history) == 2 * usage_ledger.MESSAGE_OVERHEAD_TOKENS + 7
+
+    history += [message("user", "热电偶"), message("assistant", "塞贝克效应")]
+    del counted_calls[:]
+    assert counter.count(history) == 4 * usage_ledger.MESSAGE_OVERHEAD_TOKENS + 15
+    assert counted_calls == ["热电偶", "塞贝克效应"]
+    del counted_calls[:]
+    assert counter.count(history) == 4 * usage_ledger.MESSAGE_OVERHEAD_TOKENS + 15 and counted_calls == []
+
+
+def test_history_counter_recounts_a_replaced_or_shortened_history(counted_calls):
+    counter = HistoryTokenCounter()
+    history = [message("user", "应变片"), message("assistant", "应变效应"), message("user", "热电偶")]
+    counter.count(history)
+
+    # Same length, different last message (another dialog was loaded)
+    loaded = [message("user", "霍尔"), message("assistant", "磁场"), message("user", "电容传感器")]
+    assert counter.count(loaded) == usage_ledger.count_message_tokens(loaded)
+    # Withdrawn message
+    assert counter.count(loaded[:2]) == usage_ledger.count_message_tokens(loaded[:2])
+    # Edited in place, then grown
+    history = [message("user", "霍尔"), message("assistant", "洛伦兹力")]
+    history.append(message("user", "应用"))
+    assert counter.count(history) == usage_ledger.count_message_tokens(history)
@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+
+import backendlogic
+from review_scheduler import ReviewScheduler
+from storage import write_json
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "wrong_dedup.py")
+
+
+def test_cli_merges_under_the_lock_and_resyncs_the_schedule(workdir):
+    write_json("wrong.json", {
+        "1": {"type": "填空", "description": "电阻应变片的工作原理是基于金属的____效应。", "answer": "应变"},
+        "2": {"type": "填空", "description": "电阻应变片的工作原理基于金属的____效应", "answer": "应变"},
+        "3": {"type": "选择", "description": "下列哪种传感器属于有源传感器？", "answer": "A"},
+    })
+    scheduler = ReviewScheduler("review_schedule.json")
+    scheduler.sync(["1", "2", "3"])
+    scheduler.save()
+
+    result = subprocess.run([sys.executable, SCRIPT, "wrong.json"], capture_output=True, text=True, check=True)
+    assert "Merged 1 " in result.stdout
+
+    with open("wrong.json", encoding="utf-8") as file:
+        wrong_data = json.load(file)
+    assert sorted(wrong_data) == ["1", "3"] and wrong_data["1"]["count"] == 2
+    assert sorted(ReviewScheduler("review_schedule.json").items) == ["1", "3"]
+
+
+def fill_in(description, answer):
+    return {"type": "填空", "description": description, "option": "None", "answer": answer, "explanation": "略"}
+
+
+def choice(description, option, answer):
+    return {"type": "选择", "description": description, "option": option, "answer": answer, "explanation": "略"}
+
+
+# Similar wording (character bigram Jaccard 0.45-0.75), different questions
+NEAR_MISSES = [
+    (fill_in("用于振动测量的常见传感器是哪一种？", "加速度传感器"), fill_in("用于温度测量的常见传感器是哪一种？", "热电偶")),
+    (fill_in("热电偶冷端补偿的目的是什么？", "消除冷端温度变化的影响"), fill_in("热电阻冷端补偿的目的是什么？", "热电阻无需冷端补偿")),
+    (choice("压电传感器能否用于静态力的测量？", "A:能,B:不能", "B"), choice("压电传感器能否用于动态力的测量？", "A:能,B:不能", "A")),
+    (choice("电容式传感器的灵敏度与极板间距的关系？", "A:正比,B:反比", "B"), choice("电感式传感器的灵敏度与气隙的关系？", "A:正比,B:反比,C:无关", "B")),
+]
+
+
+def submit_wrong(logic, questions, answers):
+    return logic._write_wrong_questions(questions, {index: {"result": "错误"} for index in range(len(questions))},
+                                        dict(enumerate(answers)))
+
+
+def test_near_miss_questions_stay_separate_entries(workdir):
+    logic = backendlogic.AppLogic()
+    for first, second in NEAR_MISSES:
+        submit_wrong(logic, [first], ["第一题的答案"])
+        submit_wrong(logic, [second], ["第二题的答案"])
+
+    wrong_data, _ = logic.load_wrong_questions()
+    assert len(wrong_data) == 2 * len(NEAR_MISSES)
+    for entry, question in zip(wrong_data.values(), [question for pair in NEAR_MISSES for question in pair]):
+        assert (entry["description"], entry["answer"], entry["count"]) == (question["description"], question["answer"], 1)
+    assert [entry["user_answer"] for entry in wrong_data.values()] == ["第一题的答案", "第二题的答案"] * len(NEAR_MISSES)
+
+
+def test_reworded_question_with_the_same_answer_is_merged(workdir):
+    logic = backendlogic.AppLogic()
+    submit_wrong(logic, [fill_in("电阻应变片的工作原理是基于金属的____效应。", "应变")], ["压阻"])
+    submit_wrong(logic, [fill_in("电阻应变片的工作原理基于金属的____效应", "应变 ")], ["压电"])
+
+    [entry] = logic.load_wrong_questions()[0].values()
+    assert entry["description"] == "电阻应变片的工作原理是基于金属的____效应。" # Stored wording kept
+    assert (entry["count"], entry["user_answer"]) == (2, "压电")
@@ -0,0 +1,231 @@
+import math
+import tkinter as tk
+import tkinter.font as tkfont
+from bisect import bisect_right
+
+VIEW_WIDTH = 800
+TEXT_WIDTH = int(VIEW_WIDTH * 2 / 3)  # AI messages take the left 2/3, user messages the right 2/3
+AVATAR_SIZE = 40
+MESSAGE_PADY = 5
+MESSAGE_FONT = ("microsoftyahei", 10)
+
+
+class MessageLayout:
+    """
+    Vertical positions of the messages in a VirtualChatView. Heights start as
+    estimates and are replaced by measured ones once a message has been shown;
+    offsets[i] is the top of message i and offsets[-1] the total height.
+    """
+
+    def __init__(self):
+        self.heights = []
+        self.offsets = [0]
+        self._dirty_from = None  # First index whose offset is stale
+
+    def __len__(self):
+        return len(self.heights)
+
+    def append(self, height):
+        self._flush()
+        self.heights.append(height)
+        self.offsets.append(self.offsets[-1] + height)
+
+    def set_height(self, index, height):
+        if self.heights[index] != height:
+            self.heights[index] = height
+            self._dirty_from = index if self._dirty_from is None else min(self._dirty_from, index)
+
+    def clear(self):
+        self.heights = []
+        self.offsets = [0]
+        self._dirty_from = None
+
+    def _flush(self):
+        if self._dirty_from is None:
+            return
+        for i in range(self._dirty_from, len(self.heights)):
+            self.offsets[i + 1] = self.offsets[i] + self.heights[i]
+        self._dirty_from = None
+
+    def top(self, index):
+        self._flush()
+        return self.offsets[index]
+
+    def total_height(self):
+        self._flush()
+        return self.offsets[-1]
+
+    def visible_range(self, top, bottom, overscan=0):
+        """Indexes [start, stop) of the messages overlapping the pixel rows top..bottom, widened by overscan messages."""
+        self._flush()
+        if not self.heights:
+            return 0, 0
+        first = max(bisect_right(self.offsets, top) - 1, 0)
+        last = min(bisect_right(self.offsets, bottom), len(self.heights))
+        return max(first - overscan, 0), min(last + overscan, len(self.heights))
+
+
+class _MessageRow:
+    """Avatar and text label of one message; reused for whichever message scrolls into view."""
+
+    def __init__(self, canvas, on_mousewheel):
+        self.frame = tk.Frame(canvas, bg="white")
+        self.avatar = tk.Canvas(self.frame, width=AVATAR_SIZE, height=AVATAR_SIZE, bg="white", highlightthickness=0)
+        self.circle = self.avatar.create_oval(5, 5, 35, 35, outline="")
+        self.initials = self.avatar.create_text(20, 20, font=(MESSAGE_FONT[0], 10, "bold"))
+        self.label = tk.Label(self.frame, wraplength=TEXT_WIDTH, bg="white", font=MESSAGE_FONT)
+        for widget in (self.frame, self.avatar, self.label):
+            for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+                widget.bind(sequence, on_mousewheel)
+        self.role = None
+        self.item = None  # Canvas window item while the row is placed
+
+    def show(self, message, role):
+        if role != self.role:
+            assistant = role == "assistant"
+            self.avatar.itemconfigure(self.circle, fill="red" if assistant else "yellow")
+            self.avatar.itemconfigure(self.initials, text="AI" if assistant else "我", fill="white" if assistant else "black")
+            self.avatar.pack(side="top", anchor="w" if assistant else "e")
+            self.label.config(fg="green" if assistant else "blue", justify="left" if assistant else "right")
+            self.label.pack(side="left" if assistant else "right", padx=5)
+            self.role = role
+        self.label.config(text=message)
+
+
+class VirtualChatView(tk.Frame):
+    """
+    Scrollable chat transcript that only creates widgets for the messages in or
+    near the viewport. Rows that scroll out of view are recycled for the ones
+    scrolling in, so a dialog with thousands of messages costs about as many
+    widgets as fit on screen. extend() takes {"role": ..., "content": ...}
+    records, as in the conversation history.
+    """
+
+    def __init__(self, parent, width=VIEW_WIDTH, height=600, overscan=3, **kwargs):
+        super().__init__(parent, bg="white", **kwargs)
+        self.overscan = overscan
+        self.messages = []
+        self.layout = MessageLayout()
+        self.rows = {}  # Message index -> _MessageRow placed on the canvas
+        self._free_rows = []
+        self._refresh_pending = False
+        self._font = tkfont.Font(self, font=MESSAGE_FONT)
+        self._line_height = self._font.metrics("linespace")
+
+        self.canvas = tk.Canvas(self, bg="white", width=width, height=height, highlightthickness=0)
+        self.scrollbar = tk.Scrollbar(self, orient="vertical", command=self.canvas.yview)
+        # Every scroll (scrollbar, wheel, yview_moveto) goes through yscrollcommand
+        self.canvas.configure(yscrollcommand=self._on_scroll)
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas.bind("<Configure>", self._on_resize)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.canvas.bind(sequence, self._on_mousewheel)
+
+    def __len__(self):
+        return len(self.messages)
+
+    @property
+    def row_count(self):
+        """Message widgets created so far (placed plus recycled)."""
+        return len(self.rows) + len(self._free_rows)
+
+    def append(self, message, role="user"):
+        self.messages.append((role, message))
+        self.layout.append(self._estimate_height(message))
+        self._update_scrollregion()
+        self._schedule_refresh()
+
+    def extend(self, records):
+        for record in records:
+            if record.get("content"):
+                self.append(record["content"], role="assistant" if record["role"] == "assistant" else "user")
+
+    def clear(self):
+        for index in list(self.rows):
+            self._release(index)
+        self.messages = []
+        self.layout.clear()
+        self._update_scrollregion()
+
+    def scroll_to_end(self):
+        self.canvas.yview_moveto(1.0)
+        self.refresh()
+        # Measured heights can differ from the estimates, so settle on the real bottom
+        self.canvas.yview_moveto(1.0)
+
+    def _estimate_height(self, message):
+        lines = 0
+        for paragraph in message.split("\n"):
+            lines += max(1, math.ceil(self._font.measure(paragraph) / TEXT_WIDTH))
+        return AVATAR_SIZE + lines * self._line_height + 2 * MESSAGE_PADY
+
+    def _content_width(self):
+        return max(self.canvas.winfo_width(), int(self.canvas.cget("width"))) - 20
+
+    def _update_scrollregion(self):
+        self.canvas.configure(scrollregion=(0, 0, self._content_width(), self.layout.total_height()))
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self._schedule_refresh()
+
+    def _on_resize(self, event):
+        for row in self.rows.values():
+            self.canvas.itemconfigure(row.item, width=self._content_width())
+        self._update_scrollregion()
+        self._schedule_refresh()
+
+    def _on_mousewheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.canvas.yview_scroll(-1, "units")
+        else:
+            self.canvas.yview_scroll(1, "units")
+        return "break"
+
+    def _schedule_refresh(self):
+        if not self._refresh_pending:
+            self._refresh_pending = True
+            self.after_idle(self.refresh)
+
+    def _acquire(self, index):
+        row = self._free_rows.pop() if self._free_rows else _MessageRow(self.canvas, self._on_mousewheel)
+        role, message = self.messages[index]
+        row.show(message, role)
+        row.item = self.canvas.create_window(10, self.layout.top(index) + MESSAGE_PADY, window=row.frame,
+                                             anchor="nw", width=self._content_width())
+        self.rows[index] = row
+        return row
+
+    def _release(self, index):
+        row = self.rows.pop(index)
+        self.canvas.delete(row.item)  # Unmaps the frame; the widgets are kept for reuse
+        row.item = None
+        self._free_rows.append(row)
+
+    def refresh(self):
+        """Places rows for the messages in or near the viewport and recycles the others."""
+        self._refresh_pending = False
+        if not self.winfo_exists():
+            return
+        height = max(self.canvas.winfo_height(), int(self.canvas.cget("height")))
+        top = self.canvas.canvasy(0)
+        start, stop = self.layout.visible_range(top, top + height, self.overscan)
+        for index in [index for index in self.rows if not start <= index < stop]:
+            self._release(index)
+        new_rows = [(index, self._acquire(index)) for index in range(start, stop) if index not in self.rows]
+        if not new_rows:
+            return
+        # Replace the estimates with the real heights, then move the rows below a change
+        self.canvas.update_idletasks()
+        changed = False
+        for index, row in new_rows:
+            measured = row.frame.winfo_reqheight() + 2 * MESSAGE_PADY
+            if measured != self.layout.heights[index]:
+                self.layout.set_height(index, measured)
+                changed = True
+        if changed:
+            for index, row in self.rows.items():
+                self.canvas.coords(row.item, 10, self.layout.top(index) + MESSAGE_PADY)
+            self._update_scrollregion()
+            self._schedule_refresh()  # The viewport may now cover other messages
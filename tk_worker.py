@@ -0,0 +1,96 @@
+import queue
+import threading
+import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BackgroundTask:
+    """
+    Handle of one job submitted to TkWorker. The job function receives it as its
+    first argument: it can report(progress) to the UI and should check
+    is_cancelled() between steps. Callbacks always run on the Tk thread.
+    """
+
+    def __init__(self, results, on_done=None, on_error=None, on_progress=None, on_cancel=None):
+        self._results = results
+        self._cancelled = threading.Event()
+        self.finished = False
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.on_cancel = on_cancel
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def report(self, progress):
+        """Called from the worker thread; on_progress(progress) runs on the Tk thread."""
+        self._results.put((self, "progress", progress))
+
+    def cancel(self):
+        """
+        Called on the Tk thread. The result of a running request is discarded when it
+        arrives (an HTTP call cannot be interrupted); on_cancel runs right away.
+        """
+        if self.finished or self.is_cancelled():
+            return
+        self._cancelled.set()
+        if self.on_cancel:
+            self.on_cancel()
+
+
+class TkWorker:
+    """
+    Runs blocking calls (LLM requests) on worker threads so the Tk mainloop keeps
+    repainting and handling input. Results go through a queue that is drained with
+    root.after while jobs are pending, so callbacks never touch widgets from another thread.
+    """
+
+    def __init__(self, root, max_workers=2, poll_ms=50):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tk-worker")
+        self._results = queue.Queue()
+        self._pending = 0
+
+    def submit(self, func, *args, on_done=None, on_error=None, on_progress=None, on_cancel=None):
+        """Runs func(task, *args) in the background and returns the task. Call from the Tk thread."""
+        task = BackgroundTask(self._results, on_done, on_error, on_progress, on_cancel)
+        self._executor.submit(self._run, task, func, args)
+        self._pending += 1
+        if self._pending == 1:
+            self.root.after(self.poll_ms, self._drain)
+        return task
+
+    def _run(self, task, func, args):
+        try:
+            self._results.put((task, "done", func(task, *args)))
+        except BaseException as e:
+            self._results.put((task, "error", e))
+
+    def _drain(self):
+        while True:
+            try:
+                task, kind, value = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if kind != "progress":
+                self._pending -= 1
+                task.finished = True
+            if task.is_cancelled():
+                continue
+            callback = {"done": task.on_done, "error": task.on_error, "progress": task.on_progress}[kind]
+            if callback:
+                try:
+                    callback(value)
+                except Exception as e:
+                    print(f"Error in background task callback: {e}")
+        if self._pending:
+            try:
+                self.root.after(self.poll_ms, self._drain)
+            except tk.TclError: # The window was closed
+                pass
+
+    def shutdown(self):
+        """Drops queued jobs; requests already running finish on their own and are ignored."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,238 @@
+import datetime
+import math
+import re
+import threading
+
+from instrumentation import timed_completion
+from storage import read_json, update_json
+from write_behind import get_write_behind_queue
+
+# Reply budget per call site, sent as max_tokens (gpt-4o has no default cap)
+DEFAULT_MAX_TOKENS = {"chat": 1024, "generation": 4096, "grading": 256}
+DEFAULT_SESSION_QUOTA = 200_000 # Tokens per teaching session (a conversation and the exams taken during it)
+DEFAULT_DAILY_QUOTA = 500_000 # Tokens per user per day, whatever the number of sessions
+SOFT_LIMIT_RATIO = 0.8 # Past this share of a quota every call comes with a warning
+MIN_REPLY_TOKENS = 32 # A call whose reply could not get this many tokens is refused
+
+# Chat format overhead, as in OpenAI's counting recipe for the gpt-4o family
+MESSAGE_OVERHEAD_TOKENS = 3 # Role and separators of one message
+REPLY_PRIMING_TOKENS = 3 # Every reply is primed with <|start|>assistant<|message|>
+
+# CJK ideographs, kana, hangul and full-width forms: about one token per character
+_CJK_PATTERN = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """The gpt-4o tokenizer if tiktoken is installed and its BPE file can be loaded, else None."""
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            _encoding_loaded = True
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e: # Not installed, or offline on the first download of the BPE file
+                print(f"tiktoken unavailable, estimating token counts: {e}")
+        return _encoding
+
+
+def estimate_tokens(text):
+    """Token count without a tokenizer: one per CJK character, one per four other characters."""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def count_tokens(text):
+    """Tokens of text under the gpt-4o tokenizer (estimated if tiktoken is not available)."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages):
+    """Prompt tokens of chat messages, without the reply priming."""
+    return sum(MESSAGE_OVERHEAD_TOKENS + count_tokens(message.get("content") or "") for message in messages)
+
+
+class HistoryTokenCounter:
+    """
+    Running token count of a conversation history that grows at the end, so a
+    teaching turn only counts the messages added since the previous one. A history
+    that was replaced or shortened (new dialog, loaded dialog, withdrawn message)
+    is noticed by its last counted message and recounted.
+    """
+
+    def __init__(self):
+        self.counted = 0 # Messages of the history included in total
+        self.total = 0
+        self._last = None # Copy of the last counted message
+
+    def count(self, history):
+        if self.counted and (len(history) < self.counted or history[self.counted - 1] != self._last):
+            self.counted = 0
+            self.total = 0
+        new_messages = history[self.counted:]
+        if new_messages:
+            self.total += count_message_tokens(new_messages)
+            self.counted = len(history)
+            self._last = dict(history[-1])
+        return self.total
+
+
+class QuotaExceededError(Exception):
+    """A call was refused because it would take a session or a user past a hard token limit."""
+
+
+class UsageLedger:
+    """
+    Prompt and completion tokens of one user's LLM calls per call site (chat,
+    generation, grading), kept as running totals for the current session and for
+    the day. Before each call, check() compares them with the quotas: past
+    soft_ratio of a quota the call goes ahead with a warning, a call that would go
+    past one is refused with QuotaExceededError, and the reply's max_tokens is cut
+    to what the tightest quota has left. A quota of None is unlimited.
+    The day's totals are added to `path` on the write-behind flusher.
+    File layout (usage.json): {"YYYY-MM-DD": {"chat": [prompt_tokens, completion_tokens], ...}}
+    """
+
+    def __init__(self, path="usage.json", session_quota=DEFAULT_SESSION_QUOTA, daily_quota=DEFAULT_DAILY_QUOTA,
+                 max_tokens=None, soft_ratio=SOFT_LIMIT_RATIO, write_behind=None):
+        self.path = path
+        self.session_quota = session_quota
+        self.daily_quota = daily_quota
+        self.max_tokens = dict(max_tokens or DEFAULT_MAX_TOKENS)
+        self.soft_ratio = soft_ratio
+        self.write_behind = write_behind or get_write_behind_queue()
+        self.session = {} # call_site -> [prompt_tokens, completion_tokens] since start_session()
+        self.day = None # Date of self.today, loaded from the file on first use
+        self.today = {} # call_site -> [prompt_tokens, completion_tokens] of that date
+        self.warning = None # Latest soft limit warning, cleared by pop_warning()
+        self._unsaved = {} # date -> call_site -> [prompt_tokens, completion_tokens] not yet in the file
+        self._lock = threading.Lock() # Speculative and batch grading record from worker threads
+
+    def start_session(self):
+        with self._lock:
+            self.session = {}
+            self.warning = None
+
+    def _load_today(self):
+        day = datetime.date.today().isoformat()
+        if day != self.day:
+            try:
+                stored = read_json(self.path, default=dict).get(day, {})
+            except Exception as e:
+                print(f"Error loading token usage: {e}")
+                stored = {}
+            self.today = {call_site: list(tokens) for call_site, tokens in stored.items()}
+            self.day = day
+        return self.today
+
+    def check(self, call_site, prompt_tokens):
+        """
+        Called before a request with its prompt tokens. Returns the max_tokens to send:
+        the call site's reply budget, cut to what the quotas have left. Raises
+        QuotaExceededError if that leaves less than MIN_REPLY_TOKENS.
+        """
+        with self._lock:
+            budget = self.max_tokens.get(call_site, DEFAULT_MAX_TOKENS["chat"])
+            warnings = []
+            for scope, totals, quota in (("本次会话", self.session, self.session_quota),
+                                         ("今日", self._load_today(), self.daily_quota)):
+                if quota is None:
+                    continue
+                used = _total(totals)
+                remaining = quota - used - prompt_tokens
+                if remaining < MIN_REPLY_TOKENS:
+                    raise QuotaExceededError(f"{scope}的 token 额度已不足（已用 {used}/{quota}，本次请求约需 {prompt_tokens}），请稍后再试或联系老师调整额度。")
+                budget = min(budget, remaining)
+                if used + prompt_tokens >= quota * self.soft_ratio: # Counting this request's prompt
+                    warnings.append(f"{scope}的 token 用量约 {used + prompt_tokens}/{quota}"
+                                    f"（{(used + prompt_tokens) * 100 // quota}%），即将达到上限。")
+            if warnings:
+                self.warning = " ".join(warnings)
+            return budget
+
+    def record(self, call_site, prompt_tokens, completion_tokens):
+        with self._lock:
+            _add(self.session, call_site, prompt_tokens, completion_tokens)
+            _add(self._load_today(), call_site, prompt_tokens, completion_tokens)
+            _add(self._unsaved.setdefault(self.day, {}), call_site, prompt_tokens, completion_tokens)
+        self.write_behind.submit((self.path, "usage"), self._save)
+
+    def _save(self):
+        """Adds the unsaved totals to the file; other processes of the same user add theirs too."""
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, {}
+        if not unsaved:
+            return
+        try:
+            with update_json(self.path, indent=None, separators=(",", ":")) as doc:
+                for day, call_sites in unsaved.items():
+                    stored = doc.data.setdefault(day, {})
+                    for call_site, tokens in call_sites.items():
+                        _add(stored, call_site, *tokens)
+        except Exception:
+            with self._lock: # Keep them for the next save
+                for day, call_sites in unsaved.items():
+                    for call_site, tokens in call_sites.items():
+                        _add(self._unsaved.setdefault(day, {}), call_site, *tokens)
+            raise
+
+    def pop_warning(self):
+        with self._lock:
+            warning, self.warning = self.warning, None
+            return warning
+
+    def metered_completion(self, call_site, create, messages, prompt_tokens=None, **kwargs):
+        """
+        Runs create(messages=messages, max_tokens=..., **kwargs) under check() and records
+        its usage. prompt_tokens is the count of messages if the caller keeps one
+        (see HistoryTokenCounter). Usage missing from the response is counted locally.
+        """
+        if prompt_tokens is None:
+            prompt_tokens = count_message_tokens(messages)
+        prompt_tokens += REPLY_PRIMING_TOKENS
+        max_tokens = self.check(call_site, prompt_tokens)
+        response = timed_completion(call_site, create, messages=messages, max_tokens=max_tokens, **kwargs)
+        usage = response.get("usage") or {}
+        completion_tokens = usage.get("completion_tokens")
+        if completion_tokens is None:
+            completion_tokens = count_tokens(response["choices"][0]["message"]["content"])
+        self.record(call_site, usage.get("prompt_tokens") or prompt_tokens, completion_tokens)
+        return response
+
+    def summary(self):
+        """Session and day totals with their quotas, per call site and overall."""
+        with self._lock:
+            return {
+                "session": _summarize(self.session, self.session_quota),
+                "today": _summarize(self._load_today(), self.daily_quota),
+            }
+
+
+def _add(totals, call_site, prompt_tokens, completion_tokens):
+    tokens = totals.setdefault(call_site, [0, 0])
+    tokens[0] += prompt_tokens
+    tokens[1] += completion_tokens
+
+
+def _total(totals):
+    return sum(prompt + completion for prompt, completion in totals.values())
+
+
+def _summarize(totals, quota):
+    return {
+        "prompt_tokens": sum(tokens[0] for tokens in totals.values()),
+        "completion_tokens": sum(tokens[1] for tokens in totals.values()),
+        "total_tokens": _total(totals),
+        "quota": quota,
+        "by_call_site": {call_site: {"prompt_tokens": prompt, "completion_tokens": completion}
+                         for call_site, (prompt, completion) in sorted(totals.items())},
+    }
@@ -0,0 +1,111 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict
+
+
+class WriteBehindQueue:
+    """
+    Runs persistence callbacks on a background flusher thread so request handlers
+    do not wait on disk I/O. Callbacks are keyed (e.g. by file and dialog); a new
+    submit for a key that is still pending replaces the older callback, so repeated
+    saves of the same dialog within `delay` seconds are written once.
+    Readers call flush(match) first to see their own writes; everything left is
+    flushed when the interpreter exits.
+    """
+
+    def __init__(self, delay=0.2, name="write-behind"):
+        self.delay = delay
+        self.stats = {"submitted": 0, "coalesced": 0, "written": 0, "errors": 0}
+        self._pending = OrderedDict() # key -> (callback, first submit time)
+        self._running_key = None
+        self._flushing = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending)
+
+    def submit(self, key, callback):
+        """Queues callback() under key. After close() the callback runs inline."""
+        with self._cond:
+            if not self._closed:
+                self.stats["submitted"] += 1
+                if key in self._pending:
+                    self.stats["coalesced"] += 1
+                    self._pending[key] = (callback, self._pending[key][1]) # Keep its place in line
+                else:
+                    self._pending[key] = (callback, time.monotonic())
+                self._cond.notify_all()
+                return
+        callback()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return # Closed and drained
+                key, (callback, submitted_at) = next(iter(self._pending.items()))
+                remaining = submitted_at + self.delay - time.monotonic()
+                if remaining > 0 and not self._flushing and not self._closed:
+                    self._cond.wait(remaining) # Let more saves of this key coalesce
+                    continue
+                del self._pending[key]
+                self._running_key = key
+            try:
+                callback()
+                outcome = "written"
+            except Exception as e:
+                print(f"Write-behind flush of {key!r} failed: {e}")
+                outcome = "errors"
+            with self._cond:
+                self.stats[outcome] += 1
+                self._running_key = None
+                self._cond.notify_all()
+
+    def flush(self, match=None, timeout=None):
+        """
+        Blocks until no pending or running callback has a key accepted by match
+        (all keys if match is None). Returns False on timeout.
+        """
+        match = match or (lambda key: True)
+        with self._cond:
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(
+                    lambda: not any(match(key) for key in self._pending)
+                    and (self._running_key is None or not match(self._running_key)),
+                    timeout,
+                )
+            finally:
+                self._flushing -= 1
+
+    def close(self):
+        """Flushes everything and stops the flusher thread."""
+        if not self._thread.is_alive():
+            return
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
+_default_queue = None
+_default_queue_lock = threading.Lock()
+
+
+def get_write_behind_queue():
+    """The process-wide queue shared by every AppLogic (one flusher thread per process)."""
+    global _default_queue
+    with _default_queue_lock:
+        if _default_queue is None:
+            _default_queue = WriteBehindQueue()
+        return _default_queue
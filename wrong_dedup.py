@@ -0,0 +1,192 @@
+import os
+import random
+import re
+import sys
+import zlib
+
+from review_scheduler import ReviewScheduler, normalize_answer
+from storage import update_json
+
+# Characters ignored when shingling: blanks (____), punctuation and whitespace
+_NOISE_PATTERN = re.compile(r"[\s_\W]+", re.UNICODE)
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def question_shingles(text, size=2):
+    """Returns the set of character shingles of a question description."""
+    text = _NOISE_PATTERN.sub("", text.lower())
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class MinHashLSH:
+    """
+    MinHash signatures over character shingles, bucketed with banded LSH.
+    Questions whose estimated Jaccard similarity is at least `threshold` are
+    treated as near-duplicates. A lookup only compares against the few
+    entries sharing an LSH bucket instead of the whole wrong book.
+    With 96 permutations in 32 bands of 3 rows, pairs at 0.6 Jaccard share a
+    bucket >99% of the time while pairs at 0.1 only ~3% of the time.
+    Character bigrams cannot tell "用于振动测量的…" from "用于温度测量的…" (0.67),
+    so similar wording alone never makes a duplicate: see same_question_fields().
+    """
+
+    def __init__(self, num_perm=96, bands=32, threshold=0.6, shingle_size=2, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+        self.buckets = {}  # (band, band_hash) -> set of keys
+        self.signatures = {}  # key -> signature tuple
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def signature(self, text):
+        """Computes the MinHash signature of a text."""
+        hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in question_shingles(text, self.shingle_size)]
+        if not hashes:
+            return tuple([_MERSENNE_PRIME] * self.num_perm)
+        return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._perms)
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            start = band * self.rows
+            yield band, hash(signature[start:start + self.rows])
+
+    def add(self, key, text):
+        """Indexes a text under key (replacing any previous entry for that key)."""
+        self.remove(key)
+        signature = self.signature(text)
+        self.signatures[key] = signature
+        for band_key in self._band_keys(signature):
+            self.buckets.setdefault(band_key, set()).add(key)
+        return signature
+
+    def remove(self, key):
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for band_key in self._band_keys(signature):
+            bucket = self.buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self.buckets[band_key]
+
+    def similarity(self, signature_a, signature_b):
+        """Estimated Jaccard similarity of two signatures."""
+        return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / self.num_perm
+
+    def query(self, text, accept=None):
+        """
+        Returns (key, similarity) of the most similar indexed entry at or above the
+        threshold, or (None, 0.0). `accept(key)` can reject candidates (e.g. other types).
+        """
+        signature = self.signature(text)
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(self.buckets.get(band_key, ()))
+        best_key, best_similarity = None, 0.0
+        for key in candidates:
+            if accept is not None and not accept(key):
+                continue
+            similarity = self.similarity(signature, self.signatures[key])
+            if similarity >= self.threshold and similarity > best_similarity:
+                best_key, best_similarity = key, similarity
+        return best_key, best_similarity
+
+
+def build_wrong_question_index(wrong_data, **lsh_options):
+    """Builds an LSH index over the descriptions of a wrong.json-style dict."""
+    index = MinHashLSH(**lsh_options)
+    for key, question in wrong_data.items():
+        index.add(key, question.get("description", ""))
+    return index
+
+
+def _options(question):
+    """Normalized options of an exam question ("option") or a wrong book entry ("options")."""
+    options = normalize_answer(question.get("options", question.get("option", "")) or "")
+    return "" if options == "none" else options
+
+
+def same_question_fields(stored, question):
+    """Whether two questions have the same type, answer and options (compared normalized)."""
+    return (stored.get("type") == question.get("type")
+            and normalize_answer(stored.get("answer", "")) == normalize_answer(question.get("answer", ""))
+            and _options(stored) == _options(question))
+
+
+def find_duplicate_wrong_question(index, wrong_data, question):
+    """
+    Returns the key of a wrong question with a similar description and the same type,
+    answer and options, or None. Similar wording with another answer is another question
+    (热电偶 vs 热电阻 冷端补偿), so it is kept as a separate entry.
+    """
+    key, _ = index.query(
+        question.get("description", ""),
+        accept=lambda candidate: same_question_fields(wrong_data.get(candidate, {}), question),
+    )
+    return key
+
+
+def cluster_wrong_questions(wrong_data, **lsh_options):
+    """
+    Merges near-duplicate entries of an existing wrong book in bulk.
+    Entries are visited in key order; each one either starts a cluster or is folded
+    into the earlier entry it duplicates, whose "count" accumulates the occurrences
+    and whose user_answer becomes the latest one.
+    Returns (merged_data, number_of_entries_merged).
+    """
+    def sort_key(key):
+        return (0, int(key)) if str(key).isdigit() else (1, str(key))
+
+    index = MinHashLSH(**lsh_options)
+    merged = {}
+    merged_count = 0
+    for key in sorted(wrong_data, key=sort_key):
+        question = dict(wrong_data[key])
+        duplicate_key = find_duplicate_wrong_question(index, merged, question)
+        if duplicate_key is None:
+            question["count"] = question.get("count", 1)
+            merged[key] = question
+            index.add(key, question.get("description", ""))
+        else:
+            representative = merged[duplicate_key]
+            representative["count"] = representative.get("count", 1) + question.get("count", 1)
+            if question.get("user_answer"):
+                representative["user_answer"] = question["user_answer"]
+            merged_count += 1
+    return merged, merged_count
+
+
+def rebuild_wrong_book_file(path, schedule_path=None):
+    """
+    Runs cluster_wrong_questions() on a wrong book file in one locked read-merge-write,
+    then drops the merged-away keys from its review schedule (review_schedule.json next
+    to it by default), if there is one. Returns (merged_data, number_of_entries_merged).
+    """
+    with update_json(path) as doc:
+        doc.data, merged_count = cluster_wrong_questions(doc.data)
+        if not merged_count:
+            doc.discard()
+    schedule_path = schedule_path or os.path.join(os.path.dirname(path), "review_schedule.json")
+    if os.path.exists(schedule_path) or os.path.exists(schedule_path + ".journal"):
+        scheduler = ReviewScheduler(schedule_path)
+        scheduler.sync(doc.data.keys())
+        scheduler.save()
+    return doc.data, merged_count
+
+
+if __name__ == "__main__":
+    # Bulk rebuild of an existing wrong book: python wrong_dedup.py [wrong.json] [review_schedule.json]
+    path = sys.argv[1] if len(sys.argv) > 1 else "wrong.json"
+    merged_data, merged = rebuild_wrong_book_file(path, sys.argv[2] if len(sys.argv) > 2 else None)
+    print(f"Merged {merged} near-duplicate wrong questions; {len(merged_data)} entries remain in {path}")